@@ -0,0 +1,61 @@
+"""Training steps per second of the conv INN with and without `--compile`
+
+Extra commandline arguments are passed on to `InnArgs`, e.g. `--coupling-channels 64`.
+"""
+import sys
+from typing import Tuple
+
+import torch
+from torch.utils.benchmark import Compare, Timer
+
+from nifr.configs import InnArgs
+from nifr.models import PartitionedInn
+from nifr.models.factory import build_conv_inn
+
+SHAPES = {"cmnist": (3, 32, 32), "celeba": (3, 64, 64)}
+
+
+def _train_step(inn: PartitionedInn, x: torch.Tensor) -> None:
+    _, nll = inn.routine(x)
+    inn.zero_grad()
+    nll.backward()
+    inn.step()
+
+
+def _build(args: InnArgs, shape: Tuple[int, ...], compile_graphs: bool) -> PartitionedInn:
+    torch.manual_seed(0)
+    inn = PartitionedInn(args, build_conv_inn(args, shape), shape).to(args.device)
+    if compile_graphs:
+        inn.compile_graphs()
+    return inn
+
+
+def main() -> None:
+    args = InnArgs(explicit_bool=True, underscores_to_dashes=True)
+    args.parse_args(sys.argv[1:])
+    args.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    results = []
+    for dataset, shape in SHAPES.items():
+        x = torch.rand(args.batch_size, *shape, device=args.device)
+        for compile_graphs in (False, True):
+            inn = _build(args, shape, compile_graphs)
+            inn.train()
+            for _ in range(3):  # warm-up; this includes the compilation
+                _train_step(inn, x)
+            description = "compiled" if compile_graphs else "eager"
+            timer = Timer(
+                stmt="step(inn, x)",
+                globals={"step": _train_step, "inn": inn, "x": x},
+                label="INN training step",
+                sub_label=f"{dataset} {tuple(shape)}, batch size {args.batch_size}",
+                description=description,
+            )
+            measurement = timer.blocked_autorange(min_run_time=5)
+            print(f"{dataset}, {description}: {1 / measurement.median:.2f} steps/s")
+            results.append(measurement)
+    Compare(results).print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Training throughput of the conv INN with data-parallel training
+
+Run it with different numbers of processes and compare the samples per second, e.g.
+
+    OMP_NUM_THREADS=4 torchrun --standalone --nproc-per-node 4 benchmarks/bench_distributed.py
+
+The batch size (`--batch-size`) is split over the processes, like in `--distributed` training.
+Extra commandline arguments are passed on to `InnArgs`.
+"""
+import sys
+import time
+
+import torch
+import torch.distributed as dist
+
+from nifr.configs import InnArgs
+from nifr.models import PartitionedInn
+from nifr.models.factory import build_conv_inn
+from nifr.utils import all_reduce_mean, broadcast_module, get_world_size, is_main_process
+
+SHAPE = (3, 32, 32)
+
+
+def _train_step(inn: PartitionedInn, x: torch.Tensor) -> None:
+    _, nll = inn.routine(x)
+    inn.zero_grad()
+    nll.backward()
+    all_reduce_mean(param.grad for param in inn.model.parameters() if param.grad is not None)
+    inn.step()
+
+
+def main() -> None:
+    dist.init_process_group("gloo")
+    args = InnArgs(explicit_bool=True, underscores_to_dashes=True)
+    args.parse_args(sys.argv[1:])
+    args.device = torch.device("cpu")
+    world_size = get_world_size()
+
+    torch.manual_seed(0)
+    inn = PartitionedInn(args, build_conv_inn(args, SHAPE), SHAPE)
+    broadcast_module(inn)
+    inn.train()
+    x = torch.rand(args.batch_size // world_size, *SHAPE)
+
+    for _ in range(3):  # warm-up
+        _train_step(inn, x)
+    dist.barrier()
+    num_steps = 20
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        _train_step(inn, x)
+    dist.barrier()
+    duration = time.perf_counter() - start
+    if is_main_process():
+        samples_per_second = num_steps * args.batch_size / duration
+        print(
+            f"{world_size} processes, {torch.get_num_threads()} threads each: "
+            f"{num_steps / duration:.2f} steps/s, {samples_per_second:.0f} samples/s"
+        )
+    dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    main()
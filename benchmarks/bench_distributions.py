@@ -0,0 +1,37 @@
+"""Micro-benchmark of the log-probability of the base density that is used with `--idf`"""
+import torch
+from torch.utils.benchmark import Compare, Timer
+
+from nifr.utils import DLogistic, DLogisticMixture, MixtureDistribution
+
+PROBS = 5 * [1 / 5]
+DIST_PARAMS = [(0, 0.5), (2, 0.5), (-2, 0.5), (4, 0.5), (-4, 0.5)]
+
+
+def main() -> None:
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    looped = MixtureDistribution(
+        probs=PROBS, components=[DLogistic(loc, scale) for loc, scale in DIST_PARAMS]
+    )
+    stacked = DLogisticMixture(
+        probs=torch.tensor(PROBS, device=device),
+        locs=torch.tensor([loc for loc, _ in DIST_PARAMS], dtype=torch.float32, device=device),
+        scales=torch.tensor([scale for _, scale in DIST_PARAMS], device=device),
+    )
+    results = []
+    for shape in [(64, 3, 32, 32), (256, 3, 64, 64)]:
+        z = torch.randint(-8, 9, shape, device=device).float().requires_grad_(True)
+        for name, dist in [("MixtureDistribution", looped), ("DLogisticMixture", stacked)]:
+            timer = Timer(
+                stmt="dist.log_prob(z).sum().backward()",
+                globals={"dist": dist, "z": z},
+                label="log_prob + backward",
+                sub_label=str(shape),
+                description=name,
+            )
+            results.append(timer.blocked_autorange(min_run_time=1))
+    Compare(results).print()
+
+
+if __name__ == "__main__":
+    main()
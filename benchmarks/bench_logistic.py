@@ -0,0 +1,52 @@
+"""Benchmark of the logistic base density (`--base_density logistic`) on CelebA-sized latents"""
+import torch
+import torch.distributions as td
+from torch.utils.benchmark import Compare, Timer
+
+from nifr.utils import Logistic
+
+
+def _transformed_logistic(loc: torch.Tensor, scale: torch.Tensor) -> td.Distribution:
+    """The generic construction that `Logistic` replaces"""
+    base = td.Uniform(torch.zeros_like(loc), torch.ones_like(loc))
+    transforms = [td.SigmoidTransform().inv, td.AffineTransform(loc=loc, scale=scale)]
+    return td.TransformedDistribution(base, transforms)
+
+
+def _peak_memory_mb(dist: td.Distribution, z: torch.Tensor) -> float:
+    torch.cuda.synchronize()
+    torch.cuda.reset_peak_memory_stats()
+    baseline = torch.cuda.memory_allocated()
+    dist.log_prob(z).sum().backward()
+    torch.cuda.synchronize()
+    return (torch.cuda.max_memory_allocated() - baseline) / 1024 ** 2
+
+
+def main() -> None:
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    loc = torch.zeros(1, device=device)
+    scale = torch.ones(1, device=device)
+    dists = {
+        "TransformedDistribution": _transformed_logistic(loc, scale),
+        "Logistic": Logistic(loc, scale),
+    }
+
+    results = []
+    for batch_size in (64, 256):
+        z = torch.randn(batch_size, 3 * 64 * 64, device=device, requires_grad=True)
+        for name, dist in dists.items():
+            timer = Timer(
+                stmt="dist.log_prob(z).sum().backward()",
+                globals={"dist": dist, "z": z},
+                label="log_prob + backward",
+                sub_label=f"batch size {batch_size}",
+                description=name,
+            )
+            results.append(timer.blocked_autorange(min_run_time=1))
+            if device.type == "cuda":
+                print(f"{name}, batch size {batch_size}: {_peak_memory_mb(dist, z):.1f} MB peak")
+    Compare(results).print()
+
+
+if __name__ == "__main__":
+    main()
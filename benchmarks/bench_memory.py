@@ -0,0 +1,92 @@
+"""Activation memory and training steps per second of the conv INN with the memory saving modes
+
+The modes are `--checkpoint-couplings` (checkpointing of the coupling networks in all levels)
+and `--reversible-backprop`. The inputs have the shape of CelebA (3x64x64). Extra commandline
+arguments are passed on to `InnArgs`, e.g. `--levels 3 --level-depth 3 --batch-size 32`.
+"""
+import sys
+from typing import Dict, List
+
+import torch
+from torch.utils.benchmark import Compare, Timer
+
+from nifr.configs import InnArgs
+from nifr.layers import set_reversible_backprop
+from nifr.layers.inn.coupling import CouplingLayer
+from nifr.models import PartitionedInn
+from nifr.models.factory import build_conv_inn
+
+SHAPE = (3, 64, 64)
+
+
+def _train_step(inn: PartitionedInn, x: torch.Tensor) -> None:
+    _, nll = inn.routine(x)
+    inn.zero_grad()
+    nll.backward()
+    inn.step()
+
+
+def _saved_activations_mb(inn: PartitionedInn, x: torch.Tensor) -> float:
+    """Size of all tensors that autograd keeps for the backward pass"""
+    sizes: Dict[int, int] = {}
+
+    def _pack(tensor: torch.Tensor) -> torch.Tensor:
+        # tensors that share storage (like views) are only counted once
+        storage = tensor.untyped_storage()
+        sizes[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(_pack, lambda tensor: tensor):
+        _, nll = inn.routine(x)
+    del nll
+    return sum(sizes.values()) / 1024 ** 2
+
+
+def _peak_memory_mb(inn: PartitionedInn, x: torch.Tensor) -> float:
+    torch.cuda.synchronize()
+    torch.cuda.reset_peak_memory_stats()
+    baseline = torch.cuda.memory_allocated()
+    _train_step(inn, x)
+    torch.cuda.synchronize()
+    return (torch.cuda.max_memory_allocated() - baseline) / 1024 ** 2
+
+
+def _set_mode(inn: PartitionedInn, mode: str) -> None:
+    set_reversible_backprop(inn.model, mode == "reversible")
+    for module in inn.modules():
+        if isinstance(module, CouplingLayer):
+            module.checkpoint = mode == "checkpointed"
+
+
+def main() -> None:
+    args = InnArgs(explicit_bool=True, underscores_to_dashes=True)
+    args.parse_args(sys.argv[1:])
+    args.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    torch.manual_seed(0)
+    inn = PartitionedInn(args, build_conv_inn(args, SHAPE), SHAPE).to(args.device)
+    inn.train()
+    x = torch.rand(args.batch_size, *SHAPE, device=args.device)
+
+    results: List = []
+    for mode in ("standard", "checkpointed", "reversible"):
+        _set_mode(inn, mode)
+        _train_step(inn, x)  # warm-up
+        report = f"{mode}: {_saved_activations_mb(inn, x):.1f} MB of saved activations"
+        if args.device.type == "cuda":
+            report += f", {_peak_memory_mb(inn, x):.1f} MB peak"
+        timer = Timer(
+            stmt="step(inn, x)",
+            globals={"step": _train_step, "inn": inn, "x": x},
+            label="INN training step",
+            sub_label=f"levels {args.levels}, level depth {args.level_depth}",
+            description=mode,
+        )
+        measurement = timer.blocked_autorange(min_run_time=5)
+        print(f"{report}, {1 / measurement.median:.2f} steps/s")
+        results.append(measurement)
+    Compare(results).print()
+
+
+if __name__ == "__main__":
+    main()
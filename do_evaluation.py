@@ -4,6 +4,7 @@ Usage:
 
     python do_evaluation.py <path to checkpoint>
 """
+import json
 import subprocess
 import sys
 import time
@@ -18,7 +19,7 @@ import torch
 class EvalArgs(tap.Tap):
     """Commandline arguments for running evaluation."""
 
-    checkpoint_path: str  # Path to the checkpoint file
+    checkpoint_path: str  # Path to the checkpoint (directory or file)
     csv_file: Optional[str] = None  # Where to store the results
     eval_id: List[int] = []  # ID of the evaluation to run; if not specified, run all.
     test_batch_size: int = 1000  # test batch size
@@ -44,7 +45,12 @@ def main():
 
     # ============================= load ARGS from checkpoint file ================================
     print(f"Loading from '{chkpt_path}' ...")
-    chkpt = torch.load(chkpt_path, map_location=torch.device("cpu"))
+    if chkpt_path.is_dir():
+        # the metadata of a checkpoint directory is stored separately from the tensors
+        with (chkpt_path / "meta.json").open() as f:
+            chkpt = json.load(f)
+    else:
+        chkpt = torch.load(chkpt_path, map_location=torch.device("cpu"))
 
     checkout_commit = eval_args.checkout_commit and "sha" in chkpt
     if checkout_commit:
@@ -96,6 +102,8 @@ def main():
     base_args += ["--evaluate", "True"]
     base_args += ["--results-csv", csv_file]
     base_args += ["--use-wandb", "False"]
+    if "distributed" in model_args or not checkout_commit:  # older commits don't have this arg
+        base_args += ["--distributed", "False"]  # the evaluation runs in a single process
     if "encode_batch_size" in model_args:  # `encode_batch_size` is an arg that was only added later
         base_args += ["--encode-batch-size", str(eval_args.test_batch_size)]
     else:
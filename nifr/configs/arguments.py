@@ -31,6 +31,7 @@ class SharedArgs(Tap):
     pretrain: bool = True  # Whether to perform unsupervised pre-training.
     pretrain_pcnt: float = 0.4
     test_pcnt: float = 0.2
+    data_cache: bool = False  # store the resolved adult/celeba splits on disk and reuse them
 
     # Adult data set feature settings
     drop_native: bool = True
@@ -47,10 +48,13 @@ class SharedArgs(Tap):
     padding: int = 2  # by how many pixels to pad the input images
     quant_level: Literal["3", "5", "8"] = "8"  # number of bits that encode color
     input_noise: bool = True  # add uniform noise to the input
+    cmnist_cache: bool = False  # serve cMNIST from a pre-rendered, memory-mapped store
+    batch_colorize: bool = False  # colorize cMNIST training batches on the device
 
     # CelebA settings
     celeba_sens_attr: List[CelebAttrs] = ["Male"]
     celeba_target_attr: CelebAttrs = "Smiling"
+    celeba_packed: bool = False  # load the images packed by pack_celeba.py instead of the JPEGs
 
     # GenFaces settings
     genfaces_sens_attr: GenfacesAttributes = "gender"
@@ -73,6 +77,9 @@ class SharedArgs(Tap):
     eval_epochs: int = 40
     eval_lr: float = 1e-3
     encode_batch_size: int = 1000
+    encodings_dir: str = ""  # if set, stream encodings into memory-mapped files in this directory
+    encoding_cache_dir: str = ""  # if set, reuse encodings of the same model state and data
+    encoding_cache_size_gb: float = 20.0  # least recently used encodings are deleted beyond this
 
     # Misc
     gpu: int = 0  # which GPU to use (if available)
@@ -87,12 +94,17 @@ class SharedArgs(Tap):
     results_csv: str = ""  # name of CSV file to save results to
     feat_attr: bool = False
     all_attrs: bool = False
+    all_attrs_multi_head: bool = False  # evaluate all celeba attributes with one multi-head network
 
     def process_args(self):
         if not 0 < self.data_pcnt <= 1:
             raise ValueError("data_pcnt has to be between 0 and 1")
         if self.super_val_freq < 0:
             raise ValueError("frequency cannot be negative")
+        if self.batch_colorize and self.dataset != "cmnist":
+            raise ValueError("batch_colorize is only available for cmnist")
+        if self.batch_colorize and self.cmnist_cache:
+            raise ValueError("batch_colorize and cmnist_cache cannot be combined")
 
     def add_arguments(self):
         self.add_argument("-d", "--device", type=lambda x: torch.device(x), default="cpu")
@@ -127,6 +139,9 @@ class InnArgs(SharedArgs):
     ae_loss_weight: float = 1
     vae: bool = False
     kl_weight: float = 0.1
+    # encode the pretraining set once with the frozen auto-encoder and train the INN on that
+    ae_latent_cache: bool = False
+    ae_latent_dtype: Literal["float16", "float32"] = "float16"  # storage type of the encodings
 
     # Discriminator settings
     disc_lr: float = 3e-4
@@ -144,7 +159,20 @@ class InnArgs(SharedArgs):
     nll_weight: float = 1e-2
     pred_s_weight: float = 1
     recon_stability_weight: float = 0
-    jit: bool = False
+    compile: bool = False  # compile the INN (forward pass with NLL, and inverse) with torch.compile
+    jit: bool = False  # deprecated alias of `compile`
+    # reconstruct the activations of the INN during backprop instead of storing them
+    reversible_backprop: bool = False
+    # recompute the activations of the coupling networks during backprop instead of storing them
+    checkpoint_couplings: bool = False
+    checkpoint_levels: List[int] = []  # levels with checkpointing; all levels if empty
+    # "bf16": run the networks inside the coupling layers under bfloat16 autocast
+    precision: Literal["fp32", "bf16"] = "fp32"
+    # data-parallel training with one process per rank (gloo backend); launch with torchrun and
+    # set OMP_NUM_THREADS to the number of cores per process
+    distributed: bool = False
+    keep_best_checkpoints: int = 1  # how many of the checkpoints with the best val loss to keep
+    keep_last_checkpoints: int = 1  # how many of the most recent checkpoints to keep
 
     path_to_ae: str = ""
 
@@ -163,6 +191,21 @@ class InnArgs(SharedArgs):
             raise ValueError("bn_lag has to be between 0 and 1")
         if not self.num_discs >= 1:
             raise ValueError("Size of adversarial ensemble must be 1 or greater.")
+        if self.reversible_backprop and self.batch_norm:
+            raise ValueError("batch norm layers can't be inverted exactly during training")
+        if self.ae_latent_cache and not self.autoencode:
+            raise ValueError("ae_latent_cache requires autoencode")
+        if self.checkpoint_levels and not self.checkpoint_couplings:
+            raise ValueError("checkpoint_levels requires checkpoint_couplings")
+        if any(not 0 <= level < self.levels for level in self.checkpoint_levels):
+            raise ValueError(f"checkpoint_levels have to be between 0 and {self.levels - 1}")
+        if self.keep_best_checkpoints < 0 or self.keep_last_checkpoints < 1:
+            raise ValueError("at least the last checkpoint has to be kept")
+        if self.distributed and self.evaluate:
+            raise ValueError("evaluation can't be distributed")
+        if self.jit:
+            # the blocks used to be scripted individually; compiling covers the whole model
+            self.compile = True
 
 
 class VaeArgs(SharedArgs):
@@ -1,6 +1,8 @@
 from .adult import get_data_tuples, load_adult_data, pytorch_data_to_dataframe
 from .celeba import CelebA
 from .data_loading import *
+from .dataset_wrappers import DataTupleDataset, TabularBatchLoader
+from .encodings import *
 from .misc import *
 from .ssrp import *
 from .transforms import *
@@ -1,13 +1,15 @@
 import os
+from multiprocessing import Pool
 from pathlib import Path
-from typing import List, Literal, Sequence
+from typing import Any, Dict, List, Literal, Optional, Sequence
 
+import numpy as np
 import pandas as pd
 import torch
 from PIL import Image
 from torchvision.datasets import VisionDataset
 from torchvision.datasets.utils import check_integrity, download_file_from_google_drive
-from torchvision.transforms import ToTensor
+from torchvision.transforms import CenterCrop, Compose, Resize, ToTensor
 
 from ethicml.preprocessing import (
     ProportionalSplit,
@@ -85,6 +87,12 @@ class CelebA(VisionDataset):
         download (bool, optional): If true, downloads the dataset from the internet and
             puts it in root directory. If dataset is already downloaded, it is not
             downloaded again.
+        packed (bool, optional): If true, the images are read from the memory-mapped array
+            created by `pack_celeba` instead of being decoded from the JPEGs. In this case,
+            `transform` receives a float tensor with values in [0, 1] instead of a PIL image.
+        image_size (int, optional): Image size of the packed array. Only used if `packed`.
+        split_state (dict, optional): The `split_state` of an earlier instance with the same
+            settings. If given, the attribute files are not parsed again.
     """
 
     base_folder = "celeba"
@@ -155,6 +163,9 @@ class CelebA(VisionDataset):
         target_transform=None,
         download: bool = False,
         seed: int = 42,
+        packed: bool = False,
+        image_size: int = 64,
+        split_state: Optional[Dict[str, Any]] = None,
     ):
         super().__init__(root, transform=transform, target_transform=target_transform)
 
@@ -167,6 +178,42 @@ class CelebA(VisionDataset):
             )
 
         base = Path(self.root) / self.base_folder
+        if split_state is None:
+            split_state = self._resolve_split(
+                base, biased, mixing_factor, unbiased_pcnt, sens_attrs, target_attr_name, seed
+            )
+        self.filename = split_state["filename"]
+        self.other_attrs = split_state["other_attrs"]
+        self.sens_attr = split_state["sens_attr"]
+        self.target_attr = split_state["target_attr"]
+        self.s_dim = split_state["s_dim"]
+
+        self.packed_images = None
+        if packed:
+            packed_dir = base / f"packed_{image_size}"
+            if not (packed_dir / "images.npy").is_file():
+                raise RuntimeError(
+                    f"No packed images found in {packed_dir}."
+                    f" Create them with `python pack_celeba.py --root {self.root}"
+                    f" --image-size {image_size}`."
+                )
+            # copy-on-write keeps the memory map zero-copy while giving torch writable arrays
+            self.packed_images = np.load(packed_dir / "images.npy", mmap_mode="c")
+            packed_filenames = np.load(packed_dir / "filenames.npy")
+            row_of_file = pd.Series(np.arange(len(packed_filenames)), index=packed_filenames)
+            self.packed_rows = row_of_file.loc[self.filename].to_numpy()
+
+    @staticmethod
+    def _resolve_split(
+        base: Path,
+        biased: bool,
+        mixing_factor: float,
+        unbiased_pcnt: float,
+        sens_attrs: List[CelebAttrs],
+        target_attr_name: CelebAttrs,
+        seed: int,
+    ) -> Dict[str, Any]:
+        """Parse the attribute files and select the samples that belong to the split."""
         partition_file = base / "list_eval_partition.txt"
         # partition: information about which samples belong to train, val or test
         partition = pd.read_csv(
@@ -181,7 +228,7 @@ class CelebA(VisionDataset):
         attr_names = list(attrs.columns)
 
         if len(sens_attrs) == 2 and ("Male" in sens_attrs) and ("Young" in sens_attrs):
-            self.s_dim = 4
+            s_dim = 4
             gender = (all_data["Male"] + 1) // 2  # map from {-1, 1} to {0, 1}
             age = (all_data["Young"] + 1) // 2  # map from {-1, 1} to {0, 1}
             sens_attr = (gender * 2 + age).to_frame(name="agender")
@@ -197,10 +244,10 @@ class CelebA(VisionDataset):
                 raise ValueError(f"at least one of {sens_attrs} does not exist as an attribute.")
             # only use those samples where exactly one of the specified attributes is true
             all_data = all_data.loc[((all_data[sens_attrs] + 1) // 2).sum(axis="columns") == 1]
-            self.s_dim = len(sens_attrs)
+            s_dim = len(sens_attrs)
             # perform the reverse operation of one-hot encoding
             data_only_sens = all_data[sens_attrs]
-            data_only_sens.columns = list(range(self.s_dim))
+            data_only_sens.columns = list(range(s_dim))
             sens_attr = data_only_sens.idxmax(axis="columns").to_frame(name=",".join(sens_attrs))
         else:
             sens_attr_name = sens_attrs[0]
@@ -208,7 +255,7 @@ class CelebA(VisionDataset):
                 raise ValueError(f"{sens_attr_name} does not exist as an attribute.")
             sens_attr = all_data[[sens_attr_name]]
             sens_attr = (sens_attr + 1) // 2  # map from {-1, 1} to {0, 1}
-            self.s_dim = 1
+            s_dim = 1
 
         if target_attr_name not in attr_names:
             raise ValueError(f"{target_attr_name} does not exist as an attribute.")
@@ -227,7 +274,7 @@ class CelebA(VisionDataset):
             unbiased_dt, biased_dt = train_test_split(all_dt, unbiased_pcnt, random_seed=seed)
 
         if biased:
-            if self.s_dim > 1:
+            if s_dim > 1:
                 if mixing_factor not in (0, 1):
                     raise ValueError("multi-valued s can't be used with mixing")
                 if mixing_factor == 0:
@@ -245,10 +292,24 @@ class CelebA(VisionDataset):
         else:
             filename, sens_attr, target_attr = unbiased_dt
 
-        self.filename = filename["filenames"].to_numpy()
-        self.other_attrs = filename.drop("filenames", axis=1)
-        self.sens_attr = torch.as_tensor(sens_attr.to_numpy())
-        self.target_attr = torch.as_tensor(target_attr.to_numpy())
+        return {
+            "filename": filename["filenames"].to_numpy(),
+            "other_attrs": filename.drop("filenames", axis=1),
+            "sens_attr": torch.as_tensor(sens_attr.to_numpy()),
+            "target_attr": torch.as_tensor(target_attr.to_numpy()),
+            "s_dim": s_dim,
+        }
+
+    @property
+    def split_state(self) -> Dict[str, Any]:
+        """Everything that is needed to recreate this split without parsing the attribute files"""
+        return {
+            "filename": self.filename,
+            "other_attrs": self.other_attrs,
+            "sens_attr": self.sens_attr,
+            "target_attr": self.target_attr,
+            "s_dim": self.s_dim,
+        }
 
     def _check_integrity(self):
         base = Path(self.root) / self.base_folder
@@ -281,9 +342,12 @@ class CelebA(VisionDataset):
             f.extractall(os.path.join(self.root, self.base_folder))
 
     def __getitem__(self, index):
-        X = Image.open(
-            os.path.join(self.root, self.base_folder, "img_align_celeba", self.filename[index])
-        )
+        if self.packed_images is not None:
+            X = torch.from_numpy(self.packed_images[self.packed_rows[index]]).float() / 255
+        else:
+            X = Image.open(
+                os.path.join(self.root, self.base_folder, "img_align_celeba", self.filename[index])
+            )
         S = self.sens_attr[index]
         target = self.target_attr[index]
 
@@ -303,6 +367,54 @@ class CelebA(VisionDataset):
         return "\n".join(lines).format(**self.__dict__)
 
 
+class _DecodeAndResize:
+    """Picklable function for decoding and resizing the images in worker processes."""
+
+    def __init__(self, image_dir: Path, image_size: int):
+        self.image_dir = image_dir
+        self.transform = Compose([Resize(image_size), CenterCrop(image_size)])
+
+    def __call__(self, filename: str) -> np.ndarray:
+        image = Image.open(self.image_dir / filename).convert("RGB")
+        # HWC -> CHW, which is the layout `ToTensor` would produce
+        return np.asarray(self.transform(image), dtype=np.uint8).transpose(2, 0, 1)
+
+
+def pack_celeba(root: str, image_size: int = 64, num_workers: int = 4) -> Path:
+    """Decode and resize all CelebA images once and store them in one contiguous uint8 array.
+
+    This creates the directory `<root>/celeba/packed_<image_size>` with
+        - `images.npy`: uint8 array of shape (N, 3, image_size, image_size)
+        - `filenames.npy`: the filename of every row of `images.npy`
+
+    Returns:
+        the path to the directory
+    """
+    base = Path(root) / CelebA.base_folder
+    partition = pd.read_csv(
+        base / "list_eval_partition.txt", delim_whitespace=True, header=None, index_col=0
+    )
+    filenames = partition.index.to_numpy()
+    packed_dir = base / f"packed_{image_size}"
+    packed_dir.mkdir(parents=True, exist_ok=True)
+
+    # write to a temporary file first so that a crash can't leave a half-written array
+    tmp_path = packed_dir / "images.tmp.npy"
+    images = np.lib.format.open_memmap(
+        tmp_path, mode="w+", dtype=np.uint8, shape=(len(filenames), 3, image_size, image_size)
+    )
+    decode = _DecodeAndResize(base / "img_align_celeba", image_size)
+    with Pool(num_workers) as pool:
+        for i, image in enumerate(pool.imap(decode, filenames, chunksize=256)):
+            images[i] = image
+    images.flush()
+    del images
+
+    np.save(packed_dir / "filenames.npy", filenames.astype(str))
+    tmp_path.rename(packed_dir / "images.npy")
+    return packed_dir
+
+
 def select_biased_subset(
     data: DataTuple, s_for_y0: Sequence[int], s_for_y1: Sequence[int]
 ) -> DataTuple:
@@ -0,0 +1,168 @@
+"""Pre-rendered, memory-mapped store for Colored MNIST"""
+import hashlib
+import json
+import shutil
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+from torch.utils.data import Dataset, Subset
+from torchvision.datasets import MNIST
+
+from ethicml.vision.data import LdColorizer
+
+from .transforms import colorize
+
+__all__ = ["PrerenderedLdDataset", "render_ld_store"]
+
+_STORE_FILES = ("levels.npy", "colors.npy", "labels.npy")
+
+
+def _unwrap_mnist(dataset: Dataset) -> Tuple[MNIST, np.ndarray]:
+    """Find the MNIST dataset underneath (possibly nested) subsets and the selected indexes."""
+    if isinstance(dataset, Subset):
+        source, inds = _unwrap_mnist(dataset.dataset)
+        return source, inds[np.asarray(dataset.indices, dtype=np.int64)]
+    if isinstance(dataset, MNIST):
+        return dataset, np.arange(len(dataset), dtype=np.int64)
+    raise TypeError("The Colored MNIST cache can only be built from MNIST or subsets of it.")
+
+
+def _store_key(inds: np.ndarray, settings: Dict[str, Union[int, float, bool]]) -> str:
+    hasher = hashlib.sha1(json.dumps(settings, sort_keys=True).encode())
+    hasher.update(np.ascontiguousarray(inds).tobytes())
+    return hasher.hexdigest()[:16]
+
+
+def render_ld_store(
+    source_dataset: Dataset,
+    colorizer: LdColorizer,
+    cache_dir: Path,
+    num_classes: int,
+    padding: int,
+    n_bits_x: int,
+    seed: int,
+    chunk_size: int = 10_000,
+) -> Path:
+    """Render the deterministic part of a Colored MNIST split once and save it to disk.
+
+    The store consists of three `.npy` files that can be memory-mapped:
+        - `levels.npy`: uint8 array (N, 1, H, W), padded and quantized intensities
+        - `colors.npy`: float32 array (N, num_classes, 3), a color for every sample and every class
+        - `labels.npy`: int64 array (N,), the digit labels
+
+    Because the colorization is linear in the color, these are enough to produce the colorized
+    image for any label with one broadcasted operation.
+
+    Returns:
+        path to the directory of the store; if it already existed, nothing is rendered
+    """
+    mnist, inds = _unwrap_mnist(source_dataset)
+    settings = {
+        "scale": float(colorizer.scale[0, 0]),
+        "background": colorizer.background,
+        "black": colorizer.black,
+        "binarize": colorizer.binarize,
+        "greyscale": colorizer.greyscale,
+        "padding": padding,
+        "n_bits_x": n_bits_x,
+        "seed": seed,
+    }
+    store_dir = cache_dir / _store_key(inds, settings)
+    if all((store_dir / filename).is_file() for filename in _STORE_FILES):
+        return store_dir
+
+    # render into a temporary directory first so that a crash can't leave a half-written store
+    tmp_dir = cache_dir / f"{store_dir.name}.tmp"
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+
+    num_samples = len(inds)
+    height, width = (size + 2 * padding for size in mnist.data.shape[1:])
+    levels = np.lib.format.open_memmap(
+        tmp_dir / "levels.npy", mode="w+", dtype=np.uint8, shape=(num_samples, 1, height, width)
+    )
+    n_bins = 2 ** n_bits_x
+    for start in range(0, num_samples, chunk_size):
+        chunk = mnist.data[torch.as_tensor(inds[start : start + chunk_size])].unsqueeze(1)
+        chunk = F.pad(chunk, [padding] * 4)
+        if n_bits_x < 8:
+            # store the index of the quantization bin instead of the (inexact) float value
+            chunk = torch.floor(torch.clamp(chunk.float() / 255, 0, 1 - 1e-6) * n_bins)
+        levels[start : start + chunk_size] = chunk.to(torch.uint8).numpy()
+    levels.flush()
+    del levels
+
+    # sample the colors in the same way as `LdColorizer` but all at once
+    palette = np.stack(colorizer.palette).astype(np.float32)[:num_classes]
+    random_state = np.random.RandomState(seed)
+    noise = random_state.multivariate_normal(
+        np.zeros(3), colorizer.scale, size=(num_samples, num_classes)
+    )
+    colors = np.clip(palette[np.newaxis] + noise, 0, 1).astype(np.float32)
+    np.save(tmp_dir / "colors.npy", colors)
+    np.save(tmp_dir / "labels.npy", torch.as_tensor(mnist.targets)[inds].numpy().astype(np.int64))
+
+    with (tmp_dir / "settings.json").open("w") as f:
+        json.dump(settings, f)
+    if store_dir.exists():
+        shutil.rmtree(store_dir)
+    tmp_dir.rename(store_dir)
+    return store_dir
+
+
+class PrerenderedLdDataset(Dataset):
+    """Colored MNIST that is served from a store produced by `render_ld_store`.
+
+    Only the parts that are random on every access are computed on the fly: the label draws for
+    `li_augmentation`, the color lookup and the dequantization noise.
+    """
+
+    def __init__(
+        self,
+        store_dir: Path,
+        num_classes: int,
+        li_augmentation: bool = False,
+        noise_n_bits_x: Optional[int] = None,
+    ):
+        with (store_dir / "settings.json").open() as f:
+            settings = json.load(f)
+        # copy-on-write keeps the memory map zero-copy while giving torch writable arrays
+        self.levels = np.load(store_dir / "levels.npy", mmap_mode="c")
+        self.colors = torch.from_numpy(np.load(store_dir / "colors.npy"))
+        self.labels = torch.from_numpy(np.load(store_dir / "labels.npy"))
+
+        n_bits_x = settings["n_bits_x"]
+        self.level_divisor = 255 if n_bits_x >= 8 else 2 ** n_bits_x
+        self.noise_bins = None if noise_n_bits_x is None else 2 ** noise_n_bits_x
+        self.background = settings["background"]
+        self.black = settings["black"]
+        self.binarize = settings["binarize"]
+        self.greyscale = settings["greyscale"]
+        self.num_classes = num_classes
+        self.li_augmentation = li_augmentation
+
+    def __len__(self):
+        return self.labels.size(0)
+
+    def __getitem__(self, index) -> Tuple[Tensor, Tensor, Tensor]:
+        x = torch.from_numpy(self.levels[index]).float() / self.level_divisor
+        y = self.labels[index]
+
+        if self.li_augmentation:
+            s = torch.randint_like(y, low=0, high=self.num_classes)
+        else:
+            s = y.clone()
+
+        if self.noise_bins is not None:
+            x = torch.clamp(x + torch.rand_like(x) / self.noise_bins, min=0, max=1)
+        if self.binarize:
+            x = (x > 0.5).float()
+
+        color = self.colors[index, s].unsqueeze(0)
+        x = colorize(x.unsqueeze(0), color, self.background, self.black, self.greyscale)
+        return x.squeeze(0), s, y
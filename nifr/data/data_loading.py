@@ -1,9 +1,11 @@
 from __future__ import annotations
 
 import platform
-from typing import TYPE_CHECKING, NamedTuple, Optional
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Optional, Tuple
 
-from torch.utils.data import Dataset, random_split
+from torch import nn
+from torch.utils.data import Dataset, Subset, random_split
 from torchvision import transforms
 from torchvision.datasets import MNIST
 
@@ -12,11 +14,18 @@ from ethicml.vision.data import LdColorizer
 
 from .adult import load_adult_data
 from .celeba import CelebA
+from .cmnist_cache import PrerenderedLdDataset, render_ld_store
 from .dataset_wrappers import LdAugmentedDataset
 from .misc import shrink_dataset, train_test_split
 from .perturbed_adult import load_perturbed_adult
+from .split_cache import (
+    CACHEABLE_DATASETS,
+    load_cached_splits,
+    save_cached_splits,
+    split_cache_path,
+)
 from .ssrp import SSRP
-from .transforms import NoisyDequantize, Quantize
+from .transforms import BatchLdColorizer, NoisyDequantize, Quantize
 
 if TYPE_CHECKING:
     from nifr.configs import SharedArgs
@@ -31,6 +40,7 @@ class DatasetTriplet(NamedTuple):
     task_train: Dataset
     s_dim: int
     y_dim: int
+    pretrain_batch_transform: Optional[nn.Module] = None
 
 
 def load_dataset(args: SharedArgs) -> DatasetTriplet:
@@ -38,8 +48,25 @@ def load_dataset(args: SharedArgs) -> DatasetTriplet:
     pretrain_data: Dataset
     test_data: Dataset
     train_data: Dataset
+    pretrain_batch_transform: Optional[nn.Module] = None
     data_root = args.root or find_data_dir()
 
+    cache_path: Optional[Path] = None
+    if args.data_cache and args.dataset in CACHEABLE_DATASETS:
+        cache_path = split_cache_path(args, data_root)
+        if cache_path.is_file():
+            pretrain_data, test_data, train_data, args.s_dim, args.y_dim = load_cached_splits(
+                cache_path,
+                make_celeba=lambda state: _celeba(args, data_root, biased=False, split_state=state),
+            )
+            return DatasetTriplet(
+                pretrain=pretrain_data,
+                task=test_data,
+                task_train=train_data,
+                s_dim=args.s_dim,
+                y_dim=args.y_dim,
+            )
+
     # =============== get whole dataset ===================
     if args.dataset == "cmnist":
         base_aug = [transforms.ToTensor()]
@@ -70,27 +97,64 @@ def load_dataset(args: SharedArgs) -> DatasetTriplet:
             greyscale=args.greyscale,
         )
 
-        pretrain_data = LdAugmentedDataset(
-            pretrain_data,
-            ld_augmentations=colorizer,
-            num_classes=10,
-            li_augmentation=True,
-            base_augmentations=data_aug + base_aug,
-        )
-        train_data = LdAugmentedDataset(
-            train_data,
-            ld_augmentations=colorizer,
-            num_classes=10,
-            li_augmentation=False,
-            base_augmentations=data_aug + base_aug,
-        )
-        test_data = LdAugmentedDataset(
-            test_data,
-            ld_augmentations=colorizer,
-            num_classes=10,
-            li_augmentation=True,
-            base_augmentations=base_aug,
-        )
+        if args.cmnist_cache:
+            if data_aug:
+                raise ValueError("the cMNIST cache cannot be used with random rotations or shifts")
+            n_bits_x = int(args.quant_level)
+            noise_n_bits_x = n_bits_x if args.input_noise else None
+            cache_dir = Path(data_root) / "cmnist_cache"
+
+            def _prerendered(source: Dataset, li_augmentation: bool) -> PrerenderedLdDataset:
+                store_dir = render_ld_store(
+                    source,
+                    colorizer,
+                    cache_dir=cache_dir,
+                    num_classes=10,
+                    padding=args.padding,
+                    n_bits_x=n_bits_x,
+                    seed=args.data_split_seed,
+                )
+                return PrerenderedLdDataset(
+                    store_dir,
+                    num_classes=10,
+                    li_augmentation=li_augmentation,
+                    noise_n_bits_x=noise_n_bits_x,
+                )
+
+            pretrain_data = _prerendered(pretrain_data, li_augmentation=True)
+            train_data = _prerendered(train_data, li_augmentation=False)
+            test_data = _prerendered(test_data, li_augmentation=True)
+        elif args.batch_colorize:
+            # the pretraining set only provides greyscale images; quantization, noise and
+            # colorization are done on whole batches by `pretrain_batch_transform`
+            quant_n_bits_x = int(args.quant_level) if args.quant_level != "8" else None
+            noise_n_bits_x = int(args.quant_level) if args.input_noise else None
+            greyscale_aug = [
+                aug for aug in base_aug if not isinstance(aug, (Quantize, NoisyDequantize))
+            ]
+            # the transforms are set on the MNIST object, so the pretraining set needs its own
+            pretrain_source = MNIST(root=data_root, download=True, train=True)
+            pretrain_data = LdAugmentedDataset(
+                Subset(pretrain_source, pretrain_data.indices),
+                ld_augmentations=[],
+                num_classes=10,
+                li_augmentation=False,
+                base_augmentations=data_aug + greyscale_aug,
+            )
+            pretrain_batch_transform = BatchLdColorizer(
+                colorizer,
+                num_classes=10,
+                li_augmentation=True,
+                quant_n_bits_x=quant_n_bits_x,
+                noise_n_bits_x=noise_n_bits_x,
+            )
+            _, train_data, test_data = _ld_augmented_cmnist(
+                None, train_data, test_data, colorizer, data_aug, base_aug
+            )
+        else:
+            pretrain_data, train_data, test_data = _ld_augmented_cmnist(
+                pretrain_data, train_data, test_data, colorizer, data_aug, base_aug
+            )
 
         args.y_dim = 10
         args.s_dim = 10
@@ -118,47 +182,14 @@ def load_dataset(args: SharedArgs) -> DatasetTriplet:
 
     elif args.dataset == "celeba":
 
-        image_size = 64
-        transform = [
-            transforms.Resize(image_size),
-            transforms.CenterCrop(image_size),
-            transforms.ToTensor(),
-        ]
-        if args.quant_level != "8":
-            transform.append(Quantize(int(args.quant_level)))
-        if args.input_noise:
-            transform.append(NoisyDequantize(int(args.quant_level)))
-        transform.append(transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5)))
-        transform = transforms.Compose(transform)
+        unbiased_data = _celeba(args, data_root, biased=False)
 
         unbiased_pcnt = args.test_pcnt + args.pretrain_pcnt
-        unbiased_data = CelebA(
-            root=data_root,
-            sens_attrs=args.celeba_sens_attr,
-            target_attr_name=args.celeba_target_attr,
-            biased=False,
-            mixing_factor=args.task_mixing_factor,
-            unbiased_pcnt=unbiased_pcnt,
-            download=True,
-            transform=transform,
-            seed=args.data_split_seed,
-        )
-
         pretrain_len = round(args.pretrain_pcnt / unbiased_pcnt * len(unbiased_data))
         test_len = len(unbiased_data) - pretrain_len
         pretrain_data, test_data = random_split(unbiased_data, lengths=(pretrain_len, test_len))
 
-        train_data = CelebA(
-            root=data_root,
-            sens_attrs=args.celeba_sens_attr,
-            target_attr_name=args.celeba_target_attr,
-            biased=True,
-            mixing_factor=args.task_mixing_factor,
-            unbiased_pcnt=unbiased_pcnt,
-            download=True,
-            transform=transform,
-            seed=args.data_split_seed,
-        )
+        train_data = _celeba(args, data_root, biased=True)
 
         args.y_dim = 1
         args.s_dim = unbiased_data.s_dim
@@ -226,13 +257,93 @@ def load_dataset(args: SharedArgs) -> DatasetTriplet:
         train_data = shrink_dataset(train_data, args.data_pcnt)
         test_data = shrink_dataset(test_data, args.data_pcnt)
 
+    if cache_path is not None:
+        save_cached_splits(
+            cache_path,
+            pretrain=pretrain_data,
+            task=test_data,
+            task_train=train_data,
+            s_dim=args.s_dim,
+            y_dim=args.y_dim,
+        )
+
     return DatasetTriplet(
         pretrain=pretrain_data,
         task=test_data,
         task_train=train_data,
         s_dim=args.s_dim,
         y_dim=args.y_dim,
+        pretrain_batch_transform=pretrain_batch_transform,
+    )
+
+
+def _celeba(
+    args: SharedArgs, data_root: str, biased: bool, split_state: Optional[Dict[str, Any]] = None
+) -> CelebA:
+    image_size = 64
+    if args.celeba_packed:
+        # the packed images are already resized, cropped and converted to tensors
+        transform = []
+    else:
+        transform = [
+            transforms.Resize(image_size),
+            transforms.CenterCrop(image_size),
+            transforms.ToTensor(),
+        ]
+    if args.quant_level != "8":
+        transform.append(Quantize(int(args.quant_level)))
+    if args.input_noise:
+        transform.append(NoisyDequantize(int(args.quant_level)))
+    transform.append(transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5)))
+
+    return CelebA(
+        root=data_root,
+        sens_attrs=args.celeba_sens_attr,
+        target_attr_name=args.celeba_target_attr,
+        biased=biased,
+        mixing_factor=args.task_mixing_factor,
+        unbiased_pcnt=args.test_pcnt + args.pretrain_pcnt,
+        download=True,
+        transform=transforms.Compose(transform),
+        seed=args.data_split_seed,
+        packed=args.celeba_packed,
+        image_size=image_size,
+        split_state=split_state,
+    )
+
+
+def _ld_augmented_cmnist(
+    pretrain_data: Optional[Dataset],
+    train_data: Dataset,
+    test_data: Dataset,
+    colorizer: LdColorizer,
+    data_aug: List,
+    base_aug: List,
+) -> Tuple[Optional[Dataset], Dataset, Dataset]:
+    """Colorize the MNIST splits on the fly."""
+    if pretrain_data is not None:
+        pretrain_data = LdAugmentedDataset(
+            pretrain_data,
+            ld_augmentations=colorizer,
+            num_classes=10,
+            li_augmentation=True,
+            base_augmentations=data_aug + base_aug,
+        )
+    train_data = LdAugmentedDataset(
+        train_data,
+        ld_augmentations=colorizer,
+        num_classes=10,
+        li_augmentation=False,
+        base_augmentations=data_aug + base_aug,
+    )
+    test_data = LdAugmentedDataset(
+        test_data,
+        ld_augmentations=colorizer,
+        num_classes=10,
+        li_augmentation=True,
+        base_augmentations=base_aug,
     )
+    return pretrain_data, train_data, test_data
 
 
 def find_data_dir() -> str:
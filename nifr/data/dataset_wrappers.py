@@ -1,6 +1,6 @@
 import random
 from pathlib import Path
-from typing import TYPE_CHECKING, List, Optional, Tuple
+from typing import TYPE_CHECKING, Iterator, List, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
@@ -134,9 +134,17 @@ class DataTupleDataset(BaseDataset):
         self.x_cont = dataset.x[self.cont_features].to_numpy(dtype=np.float32)
         self.s = dataset.s.to_numpy(dtype=np.float32)
         self.y = dataset.y.to_numpy(dtype=np.float32)
+        self._build_tensors()
 
         self.transform = transform
 
+    def _build_tensors(self):
+        """Tensor views of the whole dataset for serving complete batches with `get_batch`"""
+        num_samples = self.s.shape[0]
+        self.x = torch.from_numpy(np.concatenate([self.x_disc, self.x_cont], axis=1))
+        self._s = torch.tensor(self.s.reshape(num_samples, -1))
+        self._y = torch.tensor(self.y.reshape(num_samples, -1))
+
     def __len__(self):
         return self.s.shape[0]
 
@@ -149,6 +157,7 @@ class DataTupleDataset(BaseDataset):
         self.x_cont = self.x_cont[inds]
         self.s = self.s[inds]
         self.y = self.y[inds]
+        self._build_tensors()
 
     @property
     def transform(self):
@@ -185,11 +194,25 @@ class DataTupleDataset(BaseDataset):
 
         return x, s, y
 
+    def get_batch(
+        self, index: torch.Tensor, generator: Optional[torch.Generator] = None
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Get the samples for a whole tensor of indexes at once.
+
+        The result is the same as collating the individual samples.
+        """
+        if self.transform:
+            # transforms work on single samples
+            xs, ss, ys = zip(*(self[i] for i in index.tolist()))
+            return torch.stack(xs), torch.stack(ss), torch.stack(ys)
+        return self.x[index], self._s[index].squeeze(1), self._y[index].squeeze(1)
+
 
 class PerturbedDataTupleDataset(DataTupleDataset):
     def __init__(self, dataset, features: List[str], num_bins: np.ndarray, transform=None):
         super().__init__(dataset, disc_features=[], cont_features=features, transform=transform)
         self.bin_size = 1 / num_bins
+        self._bin_size = torch.as_tensor(self.bin_size, dtype=torch.float32)
         self.random = np.random.RandomState(seed=42)
 
     def __getitem__(self, index):
@@ -198,8 +221,8 @@ class PerturbedDataTupleDataset(DataTupleDataset):
         s = self.s[index]
         y = self.y[index]
 
-        # add a bit of noise
-        x += self.random.uniform(low=0, high=self.bin_size, size=x.shape)
+        # add a bit of noise (not in-place; `x` is a view of the dataset)
+        x = x + self.random.uniform(low=0, high=self.bin_size, size=x.shape).astype(np.float32)
 
         x = torch.from_numpy(x).squeeze(0)
         s = torch.from_numpy(s).squeeze()
@@ -207,6 +230,96 @@ class PerturbedDataTupleDataset(DataTupleDataset):
 
         return x, s, y
 
+    def get_batch(
+        self, index: torch.Tensor, generator: Optional[torch.Generator] = None
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        x = self.x[index]
+        # add a bit of noise
+        x = x + torch.rand(x.shape, generator=generator) * self._bin_size
+        return x, self._s[index].squeeze(1), self._y[index].squeeze(1)
+
+
+class TabularBatchLoader:
+    """Drop-in replacement for a DataLoader over a `DataTupleDataset` (or a subset of one)
+
+    Instead of fetching and collating individual samples, whole batches are taken from the
+    dataset by indexing with a tensor of indexes. The shuffling order and the dequantization noise
+    of `PerturbedDataTupleDataset` are drawn from a generator that is seeded anew in every epoch,
+    so the iteration is reproducible and independent of worker processes.
+
+    With `num_replicas` > 1, every process gets its share of each batch of `batch_size` samples
+    (like with `ResumableSampler`); the last incomplete batch is dropped.
+    """
+
+    def __init__(
+        self,
+        dataset: Union[DataTupleDataset, Subset],
+        batch_size: int,
+        shuffle: bool = False,
+        drop_last: bool = False,
+        seed: int = 0,
+        num_replicas: int = 1,
+        rank: int = 0,
+    ):
+        if batch_size % num_replicas != 0:
+            raise ValueError("the batch size has to be divisible by the number of replicas")
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last or num_replicas > 1
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self._skip = 0
+
+        # resolve (nested) subsets to indexes into the underlying dataset
+        base, inds = dataset, None
+        while isinstance(base, Subset):
+            sub_inds = torch.as_tensor(base.indices, dtype=torch.long)
+            inds = sub_inds if inds is None else sub_inds[inds]
+            base = base.dataset
+        if not isinstance(base, DataTupleDataset):
+            raise TypeError("TabularBatchLoader only works with a DataTupleDataset.")
+        self._base = base
+        self._inds = inds
+
+    def __len__(self) -> int:
+        num_samples = len(self.dataset)
+        if self.drop_last:
+            return num_samples // self.batch_size
+        return -(-num_samples // self.batch_size)
+
+    def set_position(self, num_batches: int) -> None:
+        """Continue as if `num_batches` batches had been drawn, starting with the next epoch."""
+        epochs, self._skip = divmod(num_batches, len(self))
+        self.epoch += epochs
+
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        self.epoch += 1
+
+        num_samples = len(self.dataset)
+        if self.shuffle:
+            order = torch.randperm(num_samples, generator=generator)
+        else:
+            order = torch.arange(num_samples)
+        if self._inds is not None:
+            order = self._inds[order]
+        if self.num_replicas > 1:
+            # the order is shared, but the noise has to be different in every process
+            seeds = torch.randint(2 ** 62, (self.num_replicas,), generator=generator)
+            generator.manual_seed(int(seeds[self.rank]))
+
+        skip, self._skip = self._skip, 0
+        for k, start in enumerate(range(0, len(self) * self.batch_size, self.batch_size)):
+            batch_inds = order[start : start + self.batch_size][self.rank :: self.num_replicas]
+            # skipped batches are still drawn, so that the noise of the later ones doesn't change
+            batch = self._base.get_batch(batch_inds, generator)
+            if k >= skip:
+                yield batch
+
 
 class TripletDataset(Dataset):
     def __init__(self, root: str):
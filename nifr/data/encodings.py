@@ -0,0 +1,174 @@
+"""Memory-mapped storage for encodings and reconstructions of whole datasets"""
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+from torch import Tensor, nn
+from torch.utils.data import Dataset
+
+__all__ = ["EncodedDataset", "EncodingCache", "EncodingWriter", "get_encoding_cache"]
+
+_INDEX_FILE = "index.json"
+_NUMPY_DTYPES = {torch.float16: np.float16, torch.float32: np.float32}
+
+
+class EncodingWriter:
+    """Streams batches into a preallocated, memory-mapped `.npy` file.
+
+    Only the batch that is being written has to be in memory. Values in [0, 1] (like images) can be
+    stored as uint8; everything else is stored as float16 (or float32 if `half_precision` is
+    False). The index file is written last, so a directory without it is incomplete.
+    """
+
+    def __init__(
+        self, directory: Path, num_samples: int, quantize: bool = False, half_precision: bool = True
+    ):
+        self.directory = directory
+        self.num_samples = num_samples
+        self.quantize = quantize
+        self.float_dtype = torch.float16 if half_precision else torch.float32
+        self._data: Optional[np.memmap] = None
+        self._num_written = 0
+        self._s: List[Tensor] = []
+        self._y: List[Tensor] = []
+
+        if self.directory.exists():
+            shutil.rmtree(self.directory)
+        self.directory.mkdir(parents=True)
+
+    def write(self, x: Tensor, s: Tensor, y: Tensor) -> None:
+        if self._data is None:
+            self._data = np.lib.format.open_memmap(
+                self.directory / "data.npy",
+                mode="w+",
+                dtype=np.uint8 if self.quantize else _NUMPY_DTYPES[self.float_dtype],
+                shape=(self.num_samples,) + tuple(x.shape[1:]),
+            )
+        x = x.detach()
+        if self.quantize:
+            x = torch.round(x.clamp(min=0, max=1) * 255).to(torch.uint8)
+        else:
+            x = x.to(self.float_dtype)
+        end = self._num_written + x.size(0)
+        self._data[self._num_written : end] = x.cpu().numpy()
+        self._num_written = end
+        self._s.append(s.cpu())
+        self._y.append(y.cpu())
+
+    def finish(self) -> "EncodedDataset":
+        if self._data is None or self._num_written != self.num_samples:
+            raise RuntimeError(
+                f"expected {self.num_samples} samples but {self._num_written} were written"
+            )
+        self._data.flush()
+        shape = self._data.shape
+        del self._data
+        self._data = None
+
+        np.save(self.directory / "s.npy", torch.cat(self._s, dim=0).numpy())
+        np.save(self.directory / "y.npy", torch.cat(self._y, dim=0).numpy())
+        index = {"num_samples": self.num_samples, "shape": shape, "quantized": self.quantize}
+        with (self.directory / _INDEX_FILE).open("w") as f:
+            json.dump(index, f)
+        return EncodedDataset(self.directory)
+
+
+class EncodedDataset(Dataset):
+    """Dataset over the files written by `EncodingWriter`; samples are read lazily from disk.
+
+    Indexing with a list of indexes returns a whole batch, which is much faster than collating
+    single samples (use it with a `BatchSampler` as the sampler of a `DataLoader`).
+    """
+
+    def __init__(self, directory: Path):
+        with (directory / _INDEX_FILE).open() as f:
+            index = json.load(f)
+        self.directory = directory
+        self.quantized: bool = index["quantized"]
+        # copy-on-write keeps the memory map zero-copy while giving torch writable arrays
+        self.data = np.load(directory / "data.npy", mmap_mode="c")
+        self.s = torch.from_numpy(np.load(directory / "s.npy"))
+        self.y = torch.from_numpy(np.load(directory / "y.npy"))
+
+    @staticmethod
+    def is_complete(directory: Path) -> bool:
+        return (directory / _INDEX_FILE).is_file()
+
+    def __len__(self) -> int:
+        return self.s.size(0)
+
+    def __getitem__(self, index: Union[int, List[int]]) -> Tuple[Tensor, Tensor, Tensor]:
+        x = torch.from_numpy(self.data[index]).float()
+        if self.quantized:
+            x /= 255
+        return x, self.s[index], self.y[index]
+
+
+class EncodingCache:
+    """Content-addressed store of encoded datasets.
+
+    Every entry is a directory named after a key that identifies the model state and the data. It
+    contains one `EncodingWriter` store per kind of encoding (e.g. "xy" or "zy"). When the total
+    size exceeds `max_size_gb`, the least recently used entries are deleted.
+    """
+
+    def __init__(self, root: Path, max_size_gb: float):
+        self.root = root
+        self.max_size_bytes = int(max_size_gb * 1024 ** 3)
+        self.hits = 0
+        self.misses = 0
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(model: nn.Module, config: Dict[str, Any]) -> str:
+        """Hash of the complete state of `model` and of the settings in `config`"""
+        hasher = hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode())
+        for name, tensor in model.state_dict().items():
+            hasher.update(name.encode())
+            # hash the raw bytes so that every dtype is supported
+            hasher.update(tensor.detach().cpu().contiguous().view(-1).view(torch.uint8).numpy())
+        return hasher.hexdigest()
+
+    def entry_dir(self, key: str) -> Path:
+        return self.root / key
+
+    def lookup(self, key: str, names: Sequence[str]) -> Optional[Dict[str, EncodedDataset]]:
+        """Get the stored encodings for `key` or None if not all of `names` are stored."""
+        entry = self.entry_dir(key)
+        if not all(EncodedDataset.is_complete(entry / name) for name in names):
+            self.misses += 1
+            return None
+        self.hits += 1
+        os.utime(entry)  # mark as recently used
+        return {name: EncodedDataset(entry / name) for name in names}
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Delete the least recently used entries until the cache fits into the size limit."""
+        entries = [entry for entry in self.root.iterdir() if entry.is_dir()]
+        sizes = {
+            entry: sum(f.stat().st_size for f in entry.rglob("*") if f.is_file())
+            for entry in entries
+        }
+        total = sum(sizes.values())
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            if total <= self.max_size_bytes:
+                break
+            if entry.name == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= sizes[entry]
+
+
+_CACHES: Dict[Tuple[Path, float], EncodingCache] = {}
+
+
+def get_encoding_cache(root: Path, max_size_gb: float) -> EncodingCache:
+    """Get the cache for `root`; the same object is returned for repeated calls in a process."""
+    if (root, max_size_gb) not in _CACHES:
+        _CACHES[(root, max_size_gb)] = EncodingCache(root, max_size_gb)
+    return _CACHES[(root, max_size_gb)]
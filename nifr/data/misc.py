@@ -1,16 +1,19 @@
 import csv
 import os
 from itertools import groupby
-from typing import Iterator, List, Tuple
+from typing import Callable, Iterator, List, Optional, Sized, Tuple, Union
 
 import numpy as np
 import torch
-from torch.utils.data import Dataset, Sampler, Subset, random_split
+from torch import Tensor
+from torch.utils.data import DataLoader, Dataset, Sampler, Subset, random_split
 
 __all__ = [
     "train_test_split",
     "shrink_dataset",
     "RandomSampler",
+    "ResumableSampler",
+    "DeviceLoader",
     "group_features",
     "set_transform",
     "grouped_features_indexes",
@@ -83,6 +86,106 @@ class RandomSampler(Sampler):
         return self.num_samples
 
 
+class ResumableSampler(Sampler):
+    """Samples elements in a random order that can be resumed in the middle of an epoch.
+
+    The order is drawn from a generator that is seeded anew in every epoch, so the position of the
+    iteration is determined by the number of batches that have been drawn (see `set_position`).
+
+    With `num_replicas` > 1, every process gets its share of each batch of `batch_size` samples.
+    All processes have to use the same seed. The last incomplete batch is then dropped, so that
+    all processes do the same number of steps.
+
+    `worker_generator` should be passed to the DataLoader as `generator`. The DataLoader draws the
+    seeds of its workers from it at the start of every epoch, so it's seeded anew for every epoch
+    (and process), which makes the randomness in the workers resumable as well.
+    """
+
+    def __init__(
+        self,
+        data_source: Sized,
+        batch_size: int,
+        seed: int = 0,
+        num_replicas: int = 1,
+        rank: int = 0,
+    ):
+        if batch_size % num_replicas != 0:
+            raise ValueError("the batch size has to be divisible by the number of replicas")
+        self.data_source = data_source
+        self.batch_size = batch_size
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self._start = 0
+        self.worker_generator = torch.Generator()
+        self._seed_workers()
+
+    def _seed_workers(self) -> None:
+        self.worker_generator.manual_seed((self.seed + self.epoch) * self.num_replicas + self.rank)
+
+    @property
+    def batches_per_epoch(self) -> int:
+        if self.num_replicas > 1:
+            return len(self.data_source) // self.batch_size
+        return -(-len(self.data_source) // self.batch_size)
+
+    def set_position(self, num_batches: int) -> None:
+        """Continue as if `num_batches` batches had been drawn, starting with the next epoch."""
+        epochs, batch = divmod(num_batches, self.batches_per_epoch)
+        self.epoch += epochs
+        self._start = batch * self.batch_size
+        self._seed_workers()
+
+    def __iter__(self) -> Iterator[int]:
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        self.epoch += 1
+        # the DataLoader starts the workers of the next epoch before it iterates over the sampler
+        self._seed_workers()
+        order = torch.randperm(len(self.data_source), generator=generator)
+        order = order[self._start : self.batches_per_epoch * self.batch_size]
+        self._start = 0
+        if self.num_replicas > 1:
+            order = order.view(-1, self.batch_size)[:, self.rank :: self.num_replicas].flatten()
+        return iter(order.tolist())
+
+    def __len__(self) -> int:
+        num_samples = min(self.batches_per_epoch * self.batch_size, len(self.data_source))
+        return num_samples // self.num_replicas
+
+
+class DeviceLoader:
+    """Wrap a DataLoader such that batches are moved to the device and then transformed there.
+
+    The transformation is called as `x, s = batch_transform(x, s)`.
+    """
+
+    def __init__(
+        self,
+        data_loader: DataLoader,
+        device: Union[str, torch.device],
+        batch_transform: Optional[Callable[[Tensor, Tensor], Tuple[Tensor, Tensor]]] = None,
+    ):
+        self.data_loader = data_loader
+        self.dataset = data_loader.dataset
+        self.device = device
+        self.batch_transform = batch_transform
+
+    def __iter__(self) -> Iterator[Tuple[Tensor, Tensor, Tensor]]:
+        for x, s, y in self.data_loader:
+            x = x.to(self.device, non_blocking=True)
+            s = s.to(self.device, non_blocking=True)
+            y = y.to(self.device, non_blocking=True)
+            if self.batch_transform is not None:
+                with torch.no_grad():
+                    x, s = self.batch_transform(x, s)
+            yield x, s, y
+
+    def __len__(self):
+        return len(self.data_loader)
+
+
 def data_tuple_to_dataset_sample(data, sens, target, root: str, filename: str) -> None:
     """
 
@@ -0,0 +1,122 @@
+"""On-disk cache for the splits that are produced by `load_dataset`"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import pickle
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from torch.utils.data import Dataset, Subset
+
+from .celeba import CelebA
+from .dataset_wrappers import DataTupleDataset
+
+if TYPE_CHECKING:
+    from nifr.configs import SharedArgs
+
+__all__ = ["load_cached_splits", "save_cached_splits", "split_cache_path"]
+
+_CACHE_VERSION = 1
+# datasets for which building the splits is expensive enough to be worth caching
+CACHEABLE_DATASETS = ("adult", "celeba")
+# all fields of `SharedArgs` that influence which samples end up in which split
+_DATA_FIELDS = (
+    "dataset",
+    "data_pcnt",
+    "task_mixing_factor",
+    "pretrain",
+    "pretrain_pcnt",
+    "test_pcnt",
+    "drop_native",
+    "drop_discrete",
+    "input_noise",
+    "celeba_sens_attr",
+    "celeba_target_attr",
+    "seed",  # `random_split` uses the global RNG
+    "data_split_seed",
+)
+_SPLIT_NAMES = ("pretrain", "task", "task_train")
+
+
+def split_cache_path(args: SharedArgs, data_root: str) -> Path:
+    """Location of the cached splits for the data settings in `args`"""
+    settings = {field: getattr(args, field) for field in _DATA_FIELDS}
+    settings["version"] = _CACHE_VERSION
+    key = hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+    return Path(data_root) / "split_cache" / f"{args.dataset}_{key}.pkl"
+
+
+def _unwrap_subset(dataset: Dataset) -> Tuple[Dataset, Optional[np.ndarray]]:
+    """Find the dataset underneath (possibly nested) subsets and the selected indexes."""
+    if isinstance(dataset, Subset):
+        base, inds = _unwrap_subset(dataset.dataset)
+        sub_inds = np.asarray(dataset.indices, dtype=np.int64)
+        return base, (sub_inds if inds is None else inds[sub_inds])
+    return dataset, None
+
+
+def _base_state(dataset: Dataset) -> Dict[str, Any]:
+    if isinstance(dataset, CelebA):
+        return {"kind": "celeba", "state": dataset.split_state}
+    if isinstance(dataset, DataTupleDataset):
+        # the whole dataset is small and its arrays are already scaled
+        return {"kind": "tabular", "dataset": dataset}
+    raise TypeError(f"splits of {type(dataset).__name__} cannot be cached")
+
+
+def save_cached_splits(
+    path: Path, pretrain: Dataset, task: Dataset, task_train: Dataset, s_dim: int, y_dim: int
+) -> None:
+    """Store the resolved splits such that `load_cached_splits` can recreate them."""
+    base_ids: List[int] = []
+    bases: List[Dict[str, Any]] = []
+    splits: Dict[str, Tuple[int, Optional[np.ndarray]]] = {}
+    for name, dataset in zip(_SPLIT_NAMES, (pretrain, task, task_train)):
+        base, inds = _unwrap_subset(dataset)
+        # splits that share an underlying dataset should share it again after loading
+        if id(base) not in base_ids:
+            base_ids.append(id(base))
+            bases.append(_base_state(base))
+        splits[name] = (base_ids.index(id(base)), inds)
+
+    contents = {"bases": bases, "splits": splits, "s_dim": s_dim, "y_dim": y_dim}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # write to a temporary file first so that concurrent runs never see a half-written cache
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmp_path.open("wb") as f:
+        pickle.dump(contents, f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path.replace(path)
+
+
+def load_cached_splits(
+    path: Path, make_celeba: Callable[[Dict[str, Any]], CelebA]
+) -> Tuple[Dataset, Dataset, Dataset, int, int]:
+    """Recreate the splits that were stored with `save_cached_splits`.
+
+    Args:
+        path: path to the cache file
+        make_celeba: function that constructs a `CelebA` instance from a `split_state`
+
+    Returns:
+        pretrain, task and task_train splits followed by s_dim and y_dim
+    """
+    with path.open("rb") as f:
+        contents = pickle.load(f)
+
+    bases: List[Dataset] = []
+    for base in contents["bases"]:
+        if base["kind"] == "celeba":
+            bases.append(make_celeba(base["state"]))
+        else:
+            bases.append(base["dataset"])
+
+    datasets: List[Dataset] = []
+    for name in _SPLIT_NAMES:
+        base_index, inds = contents["splits"][name]
+        dataset = bases[base_index]
+        datasets.append(dataset if inds is None else Subset(dataset, inds.tolist()))
+    pretrain, task, task_train = datasets
+    return pretrain, task, task_train, contents["s_dim"], contents["y_dim"]
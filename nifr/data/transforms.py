@@ -1,6 +1,12 @@
+from typing import Optional, Tuple
+
+import numpy as np
 import torch
+from torch import Tensor, nn
+
+from ethicml.vision.data import LdColorizer
 
-__all__ = ["NoisyDequantize", "Quantize"]
+__all__ = ["BatchLdColorizer", "NoisyDequantize", "Quantize", "colorize"]
 
 
 class Augmentation:
@@ -51,3 +57,97 @@ class Quantize(Augmentation):
             # re-normalize to between 0 and 1
             x = x / self.n_bins
         return x
+
+
+def colorize(
+    data: Tensor, colors: Tensor, background: bool, black: bool, greyscale: bool = False
+) -> Tensor:
+    """Colorize greyscale images with the given colors.
+
+    This follows the same rules as `LdColorizer` from EthicML but works on whole batches.
+
+    Args:
+        data: Tensor of shape (B, 1, H, W) with values between 0 and 1.
+        colors: Tensor of shape (B, 3) with one color per sample.
+        background: Whether to color the background instead of the foreground.
+        black: Whether not to invert the black.
+        greyscale: Whether to greyscale the colorized images.
+
+    Returns:
+        Tensor of shape (B, 3, H, W), colorized images
+    """
+    colors = colors.view(colors.size(0), -1, 1, 1)
+    if background:
+        if black:
+            # colorful background, black digits
+            colorized = (1 - data) * colors
+        else:
+            # colorful background, white digits
+            colorized = torch.clamp(data + colors, 0, 1)
+    else:
+        if black:
+            # black background, colorful digits
+            colorized = data * colors
+        else:
+            # white background, colorful digits
+            colorized = 1 - data * (1 - colors)
+
+    if greyscale:
+        colorized = colorized.mean(dim=1, keepdim=True).repeat(1, 3, 1, 1)
+    return colorized
+
+
+class BatchLdColorizer(nn.Module):
+    """Label-dependent colorization of whole batches of greyscale images.
+
+    This does the work of `LdAugmentedDataset` with an `LdColorizer` (and the `Quantize` and
+    `NoisyDequantize` base augmentations) for a batch of shape (B, 1, H, W) at once, on whatever
+    device the batch is on. Batches of shape (B, H, W) are treated as having a single channel.
+    """
+
+    def __init__(
+        self,
+        colorizer: LdColorizer,
+        num_classes: int,
+        li_augmentation: bool = False,
+        quant_n_bits_x: Optional[int] = None,
+        noise_n_bits_x: Optional[int] = None,
+    ):
+        """
+        Args:
+            colorizer: the per-sample colorizer whose settings should be used
+            num_classes: number of possible labels
+            li_augmentation: if True, draw the labels used for coloring uniformly at random
+            quant_n_bits_x: if given, quantize the greyscale images to this many bits
+            noise_n_bits_x: if given, add uniform dequantization noise for this many bits
+        """
+        super().__init__()
+        self.num_classes = num_classes
+        self.li_augmentation = li_augmentation
+        self.quantize = None if quant_n_bits_x is None else Quantize(quant_n_bits_x)
+        self.dequantize = None if noise_n_bits_x is None else NoisyDequantize(noise_n_bits_x)
+        self.binarize = colorizer.binarize
+        self.background = colorizer.background
+        self.black = colorizer.black
+        self.greyscale = colorizer.greyscale
+        # the colorizer's covariance is isotropic, so we only need the standard deviation
+        self.color_std = float(colorizer.scale[0, 0]) ** 0.5
+        palette = torch.as_tensor(np.stack(colorizer.palette[:num_classes]), dtype=torch.float32)
+        self.register_buffer("palette", palette)
+
+    def forward(self, x: Tensor, s: Tensor) -> Tuple[Tensor, Tensor]:
+        if x.dim() == 3:  # `LdAugmentedDataset` drops the channel dimension of greyscale images
+            x = x.unsqueeze(1)
+        if self.li_augmentation:
+            s = torch.randint_like(s, low=0, high=self.num_classes)
+
+        if self.quantize is not None:
+            x = self.quantize(x)
+        if self.dequantize is not None:
+            x = self.dequantize(x)
+        if self.binarize:
+            x = (x > 0.5).float()
+
+        mean_colors = self.palette[s.view(-1).long()]
+        colors = torch.clamp(mean_colors + torch.randn_like(mean_colors) * self.color_std, 0, 1)
+        return colorize(x, colors, self.background, self.black, self.greyscale), s
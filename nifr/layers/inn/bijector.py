@@ -1,10 +1,12 @@
 from abc import abstractmethod
-from typing import Optional, Tuple
+from typing import Callable, List, Optional, Tuple
 
+import torch
 import torch.nn as nn
 from torch import Tensor
+from torch.optim.optimizer import register_optimizer_step_post_hook
 
-__all__ = ["Bijector", "InvertBijector"]
+__all__ = ["Bijector", "InverseCache", "InvertBijector"]
 
 
 class Bijector(nn.Module):
@@ -38,3 +40,51 @@ class InvertBijector(Bijector):
 
     def forward(self, x: Tensor, sum_ldj: Optional[Tensor] = None, reverse: bool = False):
         return self.to_invert(x, sum_ldj=sum_ldj, reverse=not reverse)
+
+
+class InverseCache:
+    """Holds a tensor that is derived from other tensors, like an inverted weight matrix.
+
+    The value is recomputed whenever one of the source tensors has been modified in-place (as by
+    `load_state_dict`) or replaced (as by `.to(device)`). Writes through `.data` don't change the
+    version counter of a tensor, so every optimizer step also invalidates all caches; code that
+    modifies parameters in another way has to call `invalidate_all`. If gradients have to flow
+    back to the sources, the cache is bypassed.
+    """
+
+    _generation = 0
+
+    def __init__(self):
+        self._key: Optional[Tuple] = None
+        self._value: Optional[Tensor] = None
+
+    @classmethod
+    def invalidate_all(cls, *_) -> None:
+        """Recompute all cached values when they are used next"""
+        cls._generation += 1
+
+    def get(self, sources: List[Tensor], compute: Callable[[], Tensor]) -> Tensor:
+        if torch.is_grad_enabled() and any(source.requires_grad for source in sources):
+            return compute()
+        key = (InverseCache._generation,) + tuple(
+            (source.device, source.data_ptr(), source._version) for source in sources
+        )
+        if self._value is None or key != self._key:
+            self._value = compute()
+            self._key = key
+        return self._value
+
+    @staticmethod
+    def lookup(module: nn.Module, sources: List[Tensor], compute: Callable[[], Tensor]) -> Tensor:
+        """Use the `_inverse_cache` attribute of `module` if it has one.
+
+        Scripted modules don't keep plain Python attributes, so for them the value is always
+        recomputed.
+        """
+        cache = getattr(module, "_inverse_cache", None)
+        if cache is None:
+            return compute()
+        return cache.get(sources, compute)
+
+
+register_optimizer_step_post_hook(InverseCache.invalidate_all)
@@ -1,4 +1,4 @@
-from typing import Dict, List, Optional, Sequence, Tuple
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
 import torch
 import torch.nn as nn
@@ -7,7 +7,7 @@ from torch import Tensor
 from .bijector import Bijector
 from .misc import Flatten
 
-__all__ = ["BijectorChain", "FactorOut", "OxbowNet"]
+__all__ = ["BijectorChain", "FactorOut", "OxbowNet", "set_reversible_backprop"]
 
 
 class BijectorChain(Bijector):
@@ -17,8 +17,14 @@ class BijectorChain(Bijector):
         super().__init__()
         self.chain: nn.ModuleList = nn.ModuleList(layer_list)
         self.reverse_chain: nn.ModuleList = nn.ModuleList(reversed(layer_list))
+        self.reversible = False  # see `set_reversible_backprop`
+
+    def _use_reversible(self, sum_ldj: Optional[Tensor]) -> bool:
+        return self.reversible and sum_ldj is not None and torch.is_grad_enabled()
 
     def _forward(self, x, sum_ldj: Optional[Tensor] = None) -> Tuple[Tensor, Optional[Tensor]]:
+        if self._use_reversible(sum_ldj):
+            return _reversible_forward(self.chain, x, sum_ldj)
         for layer in self.chain:
             x, sum_ldj = layer(x, sum_ldj, reverse=False)
         return x, sum_ldj
@@ -54,33 +60,39 @@ class FactorOut(BijectorChain):
         self._chain_len: int = len(layer_list_interleaved)
 
     def _forward(self, x, sum_ldj: Optional[Tensor] = None):
+        reversible = self._use_reversible(sum_ldj)
+        # in reversible mode, the layers between two splits are run together
+        segment: List[Bijector] = []
         xs = []
         for i, layer in enumerate(self.chain):
             if i in self.splits:  # layer is a flatten layer
+                if segment:
+                    x, sum_ldj = _reversible_forward(segment, x, sum_ldj)
+                    segment = []
                 x_removed, x = _frac_split_channelwise(x, self.splits[i])
                 x_removed_flat, _ = layer(x_removed)
                 xs.append(x_removed_flat)
+            elif reversible:
+                segment.append(layer)
             else:
                 x, sum_ldj = layer(x, sum_ldj=sum_ldj, reverse=False)
+        if segment:
+            x, sum_ldj = _reversible_forward(segment, x, sum_ldj)
         xs.append(self._final_flatten(x)[0])
         x = torch.cat(xs, dim=1)
 
         return x, sum_ldj
 
     def _inverse(self, y, sum_ldj: Optional[Tensor] = None):
-        x = y
+        # the sizes of the factored-out parts are known from the forward pass, so y can be split
+        # with static sizes; the parts are in the same order as in `_forward`
+        sizes = [self.chain[i].num_features for i in self.splits]
+        parts = y.split(sizes + [self._final_flatten.num_features], dim=1)
 
         components: Dict[int, Tensor] = {}
-
-        # we only want access to the flatten layers, but we have to iterate over all layers here
-        # because JIT does not allow indexing the module list
-        for i, layer in enumerate(self.chain):
-            # repeat the code from _forward to recover the shapes
-            if i in self.splits:
-                x_removed_flat, x = _frac_split_channelwise(x, self.splits[i])
-                components[i], _ = layer(x_removed_flat, reverse=True)
-
-        x, _ = self._final_flatten(x, reverse=True)
+        for i, part in zip(self.splits, parts[:-1]):
+            components[i], _ = self.chain[i](part, reverse=True)
+        x, _ = self._final_flatten(parts[-1], reverse=True)
 
         for reverse_i, layer in enumerate(self.reverse_chain):
             i = self._chain_len - (reverse_i + 1)  # we need the index for the non-reverse chain
@@ -163,6 +175,106 @@ class OxbowNet(Bijector):
         return (x, sum_ldj)
 
 
+def set_reversible_backprop(model: nn.Module, enabled: bool = True) -> None:
+    """Don't store the activations of the chains in `model` for the backward pass.
+
+    Instead, the input of every layer is reconstructed from its output with the inverse while
+    backpropagating, so that the memory needed for the activations doesn't grow with the depth.
+    This costs roughly one additional forward pass and one inverse pass. The layers have to be
+    exact inverses of each other during training; batch norm layers, for example, are not.
+    """
+    for module in model.modules():
+        if isinstance(module, BijectorChain):
+            module.reversible = enabled
+
+
+def _leaves(layers: Sequence[Bijector]) -> Iterator[Bijector]:
+    """Layers of nested (plain) chains; chains with splits manage their memory themselves."""
+    for layer in layers:
+        if type(layer) is BijectorChain:
+            yield from _leaves(layer.chain)
+        else:
+            yield layer
+
+
+def _reversible_forward(
+    layers: Sequence[Bijector], x: Tensor, sum_ldj: Tensor
+) -> Tuple[Tensor, Tensor]:
+    segment: List[Bijector] = []
+    for layer in _leaves(layers):
+        if isinstance(layer, BijectorChain):
+            if segment:
+                x, sum_ldj = _ReversibleSequence.apply(x, sum_ldj, segment, *_params(segment))
+                segment = []
+            x, sum_ldj = layer(x, sum_ldj=sum_ldj, reverse=False)
+        else:
+            segment.append(layer)
+    if segment:
+        x, sum_ldj = _ReversibleSequence.apply(x, sum_ldj, segment, *_params(segment))
+    return x, sum_ldj
+
+
+def _params(layers: Sequence[Bijector]) -> List[Tensor]:
+    params: Dict[int, Tensor] = {}
+    for layer in layers:
+        for param in layer.parameters():
+            if param.requires_grad:
+                params.setdefault(id(param), param)
+    return list(params.values())
+
+
+class _ReversibleSequence(torch.autograd.Function):
+    """Apply a sequence of layers without saving any activation but the final output.
+
+    The parameters of the layers are passed as inputs, so that their gradients are returned by
+    `backward` like any other gradient.
+    """
+
+    @staticmethod
+    def forward(ctx, x: Tensor, sum_ldj: Tensor, layers: List[Bijector], *params: Tensor):
+        ctx.layers = layers
+        ctx.param_index = {id(param): i for i, param in enumerate(params)}
+        ctx.ldj_shape = sum_ldj.shape
+        sum_ldj = sum_ldj.clone()  # some layers update sum_ldj in-place
+        for layer in layers:
+            x, sum_ldj = layer(x, sum_ldj=sum_ldj, reverse=False)
+        ctx.save_for_backward(x)
+        return x, sum_ldj
+
+    @staticmethod
+    def backward(ctx, grad_y: Optional[Tensor], grad_ldj: Optional[Tensor]):
+        (y,) = ctx.saved_tensors
+        param_grads: List[Optional[Tensor]] = [None] * len(ctx.param_index)
+
+        for layer in reversed(ctx.layers):
+            with torch.no_grad():
+                x, _ = layer(y, reverse=True)
+            with torch.enable_grad():
+                x = x.detach().requires_grad_()
+                layer_params = [param for param in layer.parameters() if param.requires_grad]
+                y_recomputed, ldj = layer(x, sum_ldj=x.new_zeros(ctx.ldj_shape), reverse=False)
+                outputs, grad_outputs = [], []
+                for output, grad in ((y_recomputed, grad_y), (ldj, grad_ldj)):
+                    if grad is not None and output is not None and output.requires_grad:
+                        outputs.append(output)
+                        grad_outputs.append(grad)
+                if not outputs:  # nothing that comes later depends on the outputs
+                    return (None, grad_ldj, None, *param_grads)
+                grads = torch.autograd.grad(
+                    outputs, [x] + layer_params, grad_outputs, allow_unused=True
+                )
+            grad_y = grads[0]
+            for param, grad in zip(layer_params, grads[1:]):
+                if grad is None:
+                    continue
+                i = ctx.param_index[id(param)]
+                param_grads[i] = grad if param_grads[i] is None else param_grads[i] + grad
+            y = x.detach()
+
+        # the log-determinant of the input is only shifted by the layers
+        return (grad_y, grad_ldj, None, *param_grads)
+
+
 def _compute_split_point(tensor: Tensor, frac: float) -> int:
     return int(round(tensor.size(1) * frac))
 
@@ -3,6 +3,7 @@ from typing import List, Optional, Sequence, Tuple
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import torch.utils.checkpoint
 from torch import Tensor
 from typing_extensions import Literal
 
@@ -21,11 +22,51 @@ __all__ = [
 ]
 
 
-class CouplingLayer(Bijector):
-    d: int
+class BaseCouplingLayer(Bijector):
+    """Bijector whose transformation is computed by one or more networks."""
+
+    autocast: bool
+    checkpoint: bool
 
-    def __init__(self, d: int):
+    def __init__(self, autocast: bool = False, checkpoint: bool = False):
+        """
+        Args:
+            autocast: if True, the network that computes the transformation runs in bfloat16
+                under autocast; everything else, including the log-determinant, stays float32
+            checkpoint: if True, the activations of the network are not stored for the backward
+                pass but recomputed
+        """
         super().__init__()
+        self.autocast = autocast
+        self.checkpoint = checkpoint
+
+    def _call_net(self, net: nn.Module, inputs: Tensor) -> Tensor:
+        if self.checkpoint and torch.is_grad_enabled():
+            return torch.utils.checkpoint.checkpoint(
+                self._run_net, net, inputs, use_reentrant=False
+            )
+        return self._run_net(net, inputs)
+
+    def _run_net(self, net: nn.Module, inputs: Tensor) -> Tensor:
+        if self.autocast:
+            with torch.autocast(device_type=inputs.device.type, dtype=torch.bfloat16):
+                return net(inputs).float()
+        return net(inputs)
+
+
+class CouplingLayer(BaseCouplingLayer):
+    """Coupling layer that splits its input along the channel dimension."""
+
+    d: int
+
+    def __init__(self, d: int, autocast: bool = False, checkpoint: bool = False):
+        """
+        Args:
+            d: number of channels that are passed through unchanged
+            autocast: see `BaseCouplingLayer`
+            checkpoint: see `BaseCouplingLayer`
+        """
+        super().__init__(autocast=autocast, checkpoint=checkpoint)
         self.d = d
 
     def _split(self, x):
@@ -33,9 +74,21 @@ class CouplingLayer(Bijector):
 
 
 class AffineCouplingLayer(CouplingLayer):
-    def __init__(self, in_channels, hidden_channels, num_blocks=2, pcnt_to_transform=0.5):
+    def __init__(
+        self,
+        in_channels,
+        hidden_channels,
+        num_blocks=2,
+        pcnt_to_transform=0.5,
+        autocast=False,
+        checkpoint=False,
+    ):
         assert is_probability(pcnt_to_transform)
-        super().__init__(d=in_channels - round(pcnt_to_transform * in_channels))
+        super().__init__(
+            d=in_channels - round(pcnt_to_transform * in_channels),
+            autocast=autocast,
+            checkpoint=checkpoint,
+        )
 
         self.net_s_t = BottleneckConvBlock(
             in_channels=self.d,
@@ -48,7 +101,7 @@ class AffineCouplingLayer(CouplingLayer):
         return sum_except_batch(torch.log(scale), keepdim=True)
 
     def _scale_and_shift_fn(self, inputs):
-        s_t = self.net_s_t(inputs)
+        s_t = self._call_net(self.net_s_t, inputs)
         scale, shift = s_t.chunk(2, dim=1)
         scale = scale.sigmoid() + 0.5
         return scale, shift
@@ -75,11 +128,20 @@ class AffineCouplingLayer(CouplingLayer):
 
 
 class AdditiveCouplingLayer(CouplingLayer):
-    def __init__(self, in_channels, hidden_channels, num_blocks=2, pcnt_to_transform=0.5, d=None):
+    def __init__(
+        self,
+        in_channels,
+        hidden_channels,
+        num_blocks=2,
+        pcnt_to_transform=0.5,
+        d=None,
+        autocast=False,
+        checkpoint=False,
+    ):
         assert is_probability(pcnt_to_transform)
 
         d = in_channels - round(pcnt_to_transform * in_channels) if d is None else d
-        super().__init__(d=d)
+        super().__init__(d=d, autocast=autocast, checkpoint=checkpoint)
 
         self.net_t = BottleneckConvBlock(
             in_channels=self.d,
@@ -89,7 +151,7 @@ class AdditiveCouplingLayer(CouplingLayer):
         )
 
     def _shift_fn(self, inputs):
-        return self.net_t(inputs)
+        return self._call_net(self.net_t, inputs)
 
     def _forward(self, x, sum_ldj: Optional[Tensor] = None):
         x_a, x_b = self._split(x)
@@ -111,8 +173,14 @@ class AdditiveCouplingLayer(CouplingLayer):
 
 
 class IntegerDiscreteFlow(AdditiveCouplingLayer):
-    def __init__(self, in_channels, hidden_channels, depth=3):
-        super().__init__(in_channels, hidden_channels, d=round(0.75 * in_channels))
+    def __init__(self, in_channels, hidden_channels, depth=3, autocast=False, checkpoint=False):
+        super().__init__(
+            in_channels,
+            hidden_channels,
+            d=round(0.75 * in_channels),
+            autocast=autocast,
+            checkpoint=checkpoint,
+        )
 
         self.net_t = ConvResidualNet(
             in_channels=self.d,
@@ -125,7 +193,7 @@ class IntegerDiscreteFlow(AdditiveCouplingLayer):
         )
 
     def _get_shift_param(self, inputs):
-        shift = self.net_t(inputs)
+        shift = self._shift_fn(inputs)
         # Round with straight-through-estimator
         return RoundSTE.apply(shift)
 
@@ -153,7 +221,7 @@ class IntegerDiscreteFlow(AdditiveCouplingLayer):
             return x, sum_ldj + self.logdetjac()
 
 
-class MaskedCouplingLayer(Bijector):
+class MaskedCouplingLayer(BaseCouplingLayer):
     """Used in the tabular experiments."""
 
     def __init__(
@@ -164,8 +232,9 @@ class MaskedCouplingLayer(Bijector):
         mask_type: Literal["alternate", "channel"] = "alternate",
         swap: bool = False,
         scaling: Literal["none", "exp", "sigmoid0.5", "add2_sigmoid"] = "exp",
+        autocast: bool = False,
     ):
-        super().__init__()
+        super().__init__(autocast=autocast)
         # self.input_dim = input_dim
         self.register_buffer("mask", sample_mask(input_dim, mask_type, swap).view(1, input_dim))
         self.net_scale = build_net(input_dim, hidden_dims, activation="tanh")
@@ -177,11 +246,11 @@ class MaskedCouplingLayer(Bijector):
         return scale.log().view(scale.shape[0], -1).sum(dim=1, keepdim=True)
 
     def _masked_scale_and_shift(self, x: Tensor) -> Tuple[Tensor, Tensor]:
-        shift = self.net_shift(x * self.mask)
+        shift = self._call_net(self.net_shift, x * self.mask)
         if self.scaling == "none":
             scale = torch.ones_like(shift)
         else:
-            raw_scale = self.net_scale(x * self.mask)
+            raw_scale = self._call_net(self.net_scale, x * self.mask)
             if self.scaling == "exp":
                 scale = torch.exp(raw_scale)
             elif self.scaling == "sigmoid0.5":
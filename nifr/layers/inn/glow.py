@@ -8,7 +8,7 @@ import torch.nn.functional as F
 from scipy import linalg
 from torch import Tensor
 
-from .bijector import Bijector
+from .bijector import Bijector, InverseCache
 
 __all__ = ["Invertible1x1Conv", "InvertibleLinear"]
 
@@ -83,21 +83,36 @@ class _Invertible1x1ConvLrDecomp(_Invertible1x1ConvBase):
 
         l_mask = np.tril(np.ones(w_shape, dtype=np.float32), -1)
         self.register_buffer("l_mask", torch.as_tensor(l_mask))
+        self._inverse_cache = InverseCache()
 
     def logdetjac(self, x: Tensor) -> Tensor:
         return self.log_s.sum() * (x.size(2) * x.size(3))
 
-    def get_w(self, reverse: bool = False) -> Tensor:
+    def _get_l_and_u(self) -> Tuple[Tensor, Tensor]:
         l = self.l * self.l_mask + torch.eye(self.num_channels, device=self.l.device)
         u = self.u * self.l_mask.t() + torch.diag(self.sign_s * self.log_s.exp())
+        return l, u
+
+    @torch.jit.export
+    def _compute_w_inv(self) -> Tensor:
+        l, u = self._get_l_and_u()
+        u_inv = u.inverse()
+        l_inv = l.inverse()
+        # p is a permutation matrix, so its inverse is its transpose
+        p_inv = self.p.t()
+        w_inv = u_inv @ (l_inv @ p_inv)
+        return w_inv.unsqueeze(-1).unsqueeze(-1)
+
+    @torch.jit.ignore
+    def _get_w_inv(self) -> Tensor:
+        sources = [self.l, self.u, self.log_s, self.sign_s, self.p]
+        return InverseCache.lookup(self, sources, self._compute_w_inv)
 
+    def get_w(self, reverse: bool = False) -> Tensor:
         if reverse:
-            u_inv = u.inverse()
-            l_inv = l.inverse()
-            p_inv = self.p.inverse()
-            w_inv = u_inv @ (l_inv @ p_inv)
-            return w_inv.unsqueeze(-1).unsqueeze(-1)
+            return self._get_w_inv()
         else:
+            l, u = self._get_l_and_u()
             w = self.p @ (l @ u)
             return w.unsqueeze(-1).unsqueeze(-1)
 
@@ -113,11 +128,18 @@ class _Invertible1x1ConvBruteForce(_Invertible1x1ConvBase):
         w_init = torch.from_numpy(w_init.astype("float32"))
         w_init = w_init.unsqueeze(-1).unsqueeze(-1)
         self.weight = nn.Parameter(w_init)
+        self._inverse_cache = InverseCache()
+
+    @torch.jit.ignore
+    def _get_w_inv(self) -> Tensor:
+        def _compute_w_inv() -> Tensor:
+            return self.weight.squeeze().inverse().unsqueeze(-1).unsqueeze(-1)
+
+        return InverseCache.lookup(self, [self.weight], _compute_w_inv)
 
     def get_w(self, reverse: bool = False) -> Tensor:
         if reverse:
-            w_inv = self.weight.squeeze().inverse()
-            return w_inv.unsqueeze(-1).unsqueeze(-1)
+            return self._get_w_inv()
         else:
             return self.weight
 
@@ -129,6 +151,13 @@ class InvertibleLinear(Bijector):
     def __init__(self, dim):
         super(InvertibleLinear, self).__init__()
         self.weight = nn.Parameter(torch.eye(dim), requires_grad=True)
+        self._inverse_cache = InverseCache()
+
+    @torch.jit.ignore
+    def _get_weight_inv(self) -> Tensor:
+        return InverseCache.lookup(
+            self, [self.weight], lambda: self.weight.double().inverse().float()
+        )
 
     def logdetjac(self) -> Tensor:
         return torch.log(torch.abs(torch.det(self.weight.double()))).float()
@@ -141,7 +170,7 @@ class InvertibleLinear(Bijector):
             return y, sum_ldj - self.logdetjac().expand_as(sum_ldj)
 
     def _inverse(self, x, sum_ldj: Optional[Tensor] = None) -> Tuple[Tensor, Optional[Tensor]]:
-        y = F.linear(x, self.weight.double().inverse().float())
+        y = F.linear(x, self._get_weight_inv())
         if sum_ldj is None:
             return y, None
         else:
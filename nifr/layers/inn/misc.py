@@ -1,35 +1,60 @@
-from typing import Optional, List
+from typing import Dict, List, Optional, Tuple
 
 import torch
 from torch import Tensor
 
+from nifr.utils import product
+
 from .bijector import Bijector
 
 __all__ = ["Flatten", "ConstantAffine"]
 
 
 class Flatten(Bijector):
-    """Flatten the input (except batch dimension)."""
+    """Flatten the input (except batch dimension).
 
-    first_input: bool
+    The shape of the first input is remembered as plain integers (and saved in the state dict), so
+    that the inverse doesn't depend on tensor values and has static shapes under `torch.compile`.
+    """
 
     def __init__(self):
         super().__init__()
-        self.register_buffer("orig_shape", torch.tensor([-1, 0, 0, 0], dtype=torch.int64))
-        self.first_input = True
+        self.orig_shape: Optional[Tuple[int, ...]] = None  # shape without the batch dimension
+        self._register_load_state_dict_pre_hook(self._convert_shape_buffer)
+
+    @property
+    def num_features(self) -> int:
+        """Number of elements per sample in the flattened output"""
+        if self.orig_shape is None:
+            raise RuntimeError("Flatten has to see an input before its shapes are known")
+        return product(self.orig_shape)
 
     def _forward(self, x, sum_ldj: Optional[Tensor] = None):
-        if self.first_input:
-            orig_shape = torch.tensor(x.shape, dtype=torch.int64)
-            self.orig_shape[1:] = orig_shape[1:]
-            self.first_input = False
+        if self.orig_shape is None:
+            self.orig_shape = tuple(x.shape[1:])
         y = x.flatten(start_dim=1)
         return y, sum_ldj
 
     def _inverse(self, y, sum_ldj: Optional[Tensor] = None):
-        x = y.view(self.orig_shape[0], self.orig_shape[1], self.orig_shape[2], self.orig_shape[3])
+        if self.orig_shape is None:
+            raise RuntimeError("Flatten has to see an input before it can be inverted")
+        x = y.view(y.size(0), *self.orig_shape)
         return x, sum_ldj
 
+    def get_extra_state(self) -> Dict[str, Optional[List[int]]]:
+        return {"orig_shape": None if self.orig_shape is None else list(self.orig_shape)}
+
+    def set_extra_state(self, state: Dict[str, Optional[List[int]]]) -> None:
+        orig_shape = state["orig_shape"]
+        self.orig_shape = None if orig_shape is None else tuple(orig_shape)
+
+    def _convert_shape_buffer(self, state_dict, prefix, *_) -> None:
+        """Older checkpoints store the shape (including a -1 for the batch) in a buffer"""
+        buffer = state_dict.pop(f"{prefix}orig_shape", None)
+        if buffer is not None and f"{prefix}_extra_state" not in state_dict:
+            shape = buffer.tolist()[1:]
+            state_dict[f"{prefix}_extra_state"] = {"orig_shape": shape if any(shape) else None}
+
 
 class ConstantAffine(Bijector):
     def __init__(self, scale, shift):
@@ -5,7 +5,7 @@ import torch.nn as nn
 from torch import Tensor
 from torch.nn import Parameter
 
-from nifr.utils import is_positive_int, sum_except_batch
+from nifr.utils import all_reduce_sum, is_positive_int, sum_except_batch
 
 from .misc import Bijector
 
@@ -200,15 +200,20 @@ class ActNorm(Bijector):
 
     def _initialize(self, inputs):
         """Data-dependent initialization, s.t. post-actnorm activations have zero mean and unit
-        variance. """
+        variance. In data-parallel training, the statistics are computed over all processes."""
         if inputs.dim() == 4:
             num_channels = inputs.shape[1]
             inputs = inputs.permute(0, 2, 3, 1).reshape(-1, num_channels)
 
         with torch.no_grad():
-            std = inputs.std(dim=0)
-            mu = (inputs / std).mean(dim=0)
+            count = inputs.new_tensor(inputs.size(0))
+            mean = inputs.sum(dim=0)
+            all_reduce_sum([count, mean])
+            mean /= count
+            sum_sq = (inputs - mean).pow(2).sum(dim=0)
+            all_reduce_sum([sum_sq])
+            std = (sum_sq / (count - 1)).sqrt()
             self.log_scale.data = -torch.log(std)
-            self.shift.data = -mu
+            self.shift.data = -mean / std
 
         self.initialized = True
@@ -3,7 +3,7 @@ from typing import Optional
 import torch
 from torch import Tensor
 
-from nifr.layers.inn import Bijector
+from nifr.layers.inn import Bijector, InverseCache
 from nifr.utils import is_positive_int
 
 __all__ = ["RandomPermutation", "ReversePermutation"]
@@ -21,10 +21,13 @@ class Permutation(Bijector):
         super().__init__()
         self._dim = dim
         self.register_buffer("_permutation", permutation)
+        self._inverse_cache = InverseCache()
 
-    @property
-    def _inverse_permutation(self):
-        return torch.argsort(self._permutation)
+    @torch.jit.ignore
+    def _inverse_permutation(self) -> Tensor:
+        return InverseCache.lookup(
+            self, [self._permutation], lambda: torch.argsort(self._permutation)
+        )
 
     @staticmethod
     def _permute(inputs, permutation, dim):
@@ -45,7 +48,7 @@ class Permutation(Bijector):
         return y, sum_ldj
 
     def _inverse(self, inputs, sum_ldj: Optional[Tensor] = None):
-        y = self._permute(inputs, self._inverse_permutation, self._dim)
+        y = self._permute(inputs, self._inverse_permutation(), self._dim)
 
         return y, sum_ldj
 
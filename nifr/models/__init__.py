@@ -2,6 +2,7 @@ from . import configs
 from .autoencoder import *
 from .base import *
 from .classifier import *
+from .ensemble import *
 from .factory import *
 from .inn import *
 from .masker import *
@@ -3,9 +3,10 @@ from typing import Dict, Optional, Tuple, Union
 import torch
 import torch.nn.functional as F
 from torch.optim.lr_scheduler import MultiStepLR
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import DataLoader, Dataset, Subset
 from tqdm import trange
 
+from nifr.data.dataset_wrappers import DataTupleDataset, TabularBatchLoader
 from nifr.models.base import ModelBase
 
 __all__ = ["Classifier"]
@@ -71,8 +72,8 @@ class Classifier(ModelBase):
         return pred
 
     def predict_dataset(self, data, device, batch_size=100):
-        if not isinstance(data, DataLoader):
-            data = DataLoader(data, batch_size=batch_size, shuffle=False, pin_memory=True)
+        if not isinstance(data, (DataLoader, TabularBatchLoader)):
+            data = _make_loader(data, batch_size=batch_size, shuffle=False)
         preds, actual, sens = [], [], []
         with torch.set_grad_enabled(False):
             for x, s, y in data:
@@ -90,7 +91,9 @@ class Classifier(ModelBase):
 
         return preds, actual, sens
 
-    def compute_accuracy(self, outputs: torch.Tensor, targets: torch.Tensor, top: int = 1) -> float:
+    def compute_accuracy(
+        self, outputs: torch.Tensor, targets: torch.Tensor, top: int = 1
+    ) -> torch.Tensor:
         """Computes the classification accuracy.
 
         Args:
@@ -99,7 +102,7 @@ class Classifier(ModelBase):
             top (int): Top-K accuracy.
 
         Returns:
-            Accuracy of the predictions (float).
+            Accuracy of the predictions (0-dim tensor on the device of `outputs`).
         """
 
         if self.criterion == "bce":
@@ -111,14 +114,14 @@ class Classifier(ModelBase):
         correct = correct[:top].view(-1).float().sum(0, keepdim=True)
         accuracy = correct / targets.size(0) * 100
 
-        return accuracy.detach().item()
+        return accuracy.detach().view(())
 
     def routine(
         self,
         data: torch.Tensor,
         targets: torch.Tensor,
         instance_weights: Optional[torch.Tensor] = None,
-    ) -> Tuple[torch.Tensor, float]:
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
         """Classifier routine.
 
         Args:
@@ -126,7 +129,7 @@ class Classifier(ModelBase):
             targets: Tensor. Prediction targets.
 
         Returns:
-            Tuple of classification loss (Tensor) and accuracy (float)
+            Tuple of classification loss (Tensor) and accuracy (0-dim Tensor)
         """
         outputs = super().__call__(data)
         loss = self.apply_criterion(outputs, targets)
@@ -149,15 +152,11 @@ class Classifier(ModelBase):
         lr_milestones: Optional[Dict] = None,
     ):
 
-        if not isinstance(train_data, DataLoader):
-            train_data = DataLoader(
-                train_data, batch_size=batch_size, shuffle=True, pin_memory=True
-            )
+        if not isinstance(train_data, (DataLoader, TabularBatchLoader)):
+            train_data = _make_loader(train_data, batch_size=batch_size, shuffle=True)
         if test_data is not None:
-            if not isinstance(test_data, DataLoader):
-                test_data = DataLoader(
-                    test_data, batch_size=test_batch_size, shuffle=False, pin_memory=True
-                )
+            if not isinstance(test_data, (DataLoader, TabularBatchLoader)):
+                test_data = _make_loader(test_data, batch_size=test_batch_size, shuffle=False)
 
         scheduler = None
         if lr_milestones is not None:
@@ -204,10 +203,22 @@ class Classifier(ModelBase):
 
                 avg_test_acc /= len(test_data)
 
-                pbar.set_postfix(epoch=epoch + 1, avg_test_acc=avg_test_acc)
+                pbar.set_postfix(epoch=epoch + 1, avg_test_acc=float(avg_test_acc))
             else:
                 pbar.set_postfix(epoch=epoch + 1)
 
             if scheduler is not None:
                 scheduler.step(epoch)
         pbar.close()
+
+
+def _make_loader(
+    data: Dataset, batch_size: int, shuffle: bool
+) -> Union[DataLoader, TabularBatchLoader]:
+    """Tabular data is served in whole batches; everything else goes through a DataLoader."""
+    base = data
+    while isinstance(base, Subset):
+        base = base.dataset
+    if isinstance(base, DataTupleDataset):
+        return TabularBatchLoader(data, batch_size=batch_size, shuffle=shuffle)
+    return DataLoader(data, batch_size=batch_size, shuffle=shuffle, pin_memory=True)
@@ -0,0 +1,205 @@
+"""Ensemble of identical discriminators that are evaluated and optimized together"""
+import copy
+import itertools
+from typing import Dict, Optional, Sequence, Tuple
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor, nn
+from torch.func import functional_call, stack_module_state, vmap
+from torch.nn.utils import parametrize
+
+from nifr.utils.optimizers import RAdam
+
+from .base import ModelBase
+from .classifier import Classifier
+
+__all__ = ["DiscriminatorEnsemble"]
+
+# names of the spectral norm tensors of `torch.nn.utils.spectral_norm` and of the parametrization
+_SPECTRAL_NORM_KEYS = {
+    "weight_orig": "parametrizations.weight.original",
+    "weight_u": "parametrizations.weight.0._u",
+    "weight_v": "parametrizations.weight.0._v",
+}
+
+
+class DiscriminatorEnsemble(nn.Module):
+    """Discriminators with the same architecture whose parameters are stacked along a new dimension
+
+    All members are evaluated with a single `vmap`ped call, with their slices of the stacked
+    parameters and buffers (e.g. batch norm statistics). There is only one optimizer for the whole
+    ensemble.
+    """
+
+    def __init__(
+        self,
+        members: Sequence[Classifier],
+        optimizer_kwargs: Optional[Dict] = None,
+        spectral_norm: bool = False,
+    ):
+        """
+        Args:
+            members: the discriminators; they have to have the same architecture
+            optimizer_kwargs: arguments for the optimizer of the ensemble
+            spectral_norm: if True, apply spectral normalization to all weights of the members
+        """
+        super().__init__()
+        if not members:
+            raise ValueError("an ensemble needs at least one member")
+        self.num_members = len(members)
+        self.spectral_norm = spectral_norm
+        # the templates are not registered as submodules, so their own parameters are not part of
+        # the ensemble; the pristine one is used to re-initialize members
+        object.__setattr__(self, "_pristine_template", copy.deepcopy(members[0]).cpu())
+        if spectral_norm:
+            members = [copy.deepcopy(member) for member in members]
+            for member in members:
+                member.apply(_apply_spectral_norm)
+        # the template is used for the functional calls
+        object.__setattr__(self, "_template", copy.deepcopy(members[0]).cpu())
+
+        params, buffers = stack_module_state([member.model for member in members])
+        # container with the stacked tensors; it uses the same names as the members
+        self.stacked = copy.deepcopy(self._template.model)
+        for name, tensor in params.items():
+            module, attr = _get_owner(self.stacked, name)
+            setattr(module, attr, nn.Parameter(tensor))
+        for name, tensor in buffers.items():
+            module, attr = _get_owner(self.stacked, name)
+            module.register_buffer(attr, tensor)
+        # state dicts of an `nn.ModuleList` of discriminators can still be loaded
+        self._register_load_state_dict_pre_hook(self._stack_member_state)
+
+        optimizer_kwargs = optimizer_kwargs or ModelBase.default_kwargs["optimizer_kwargs"]
+        self.optimizer = RAdam(self.parameters(), **optimizer_kwargs)
+
+    def train(self, mode: bool = True) -> "DiscriminatorEnsemble":
+        super().train(mode)
+        self._template.train(mode)
+        return self
+
+    def forward(self, inputs: Tensor) -> Tensor:
+        """Outputs of all members, stacked along the first dimension"""
+        params = dict(self.stacked.named_parameters())
+        # the buffers are batched views, so updates like batch norm statistics are done in-place
+        buffers = dict(self.stacked.named_buffers())
+        model = self._template.model
+
+        def _call_member(
+            member_params: Dict[str, Tensor], member_buffers: Dict[str, Tensor], x: Tensor
+        ) -> Tensor:
+            return functional_call(model, (member_params, member_buffers), (x,))
+
+        return vmap(_call_member, in_dims=(0, 0, None), randomness="different")(
+            params, buffers, inputs
+        )
+
+    def routine(self, data: Tensor, targets: Tensor) -> Tuple[Tensor, Tensor]:
+        """Loss and accuracy averaged over all members
+
+        Args:
+            data: Tensor. Input data to the discriminators.
+            targets: Tensor. Prediction targets.
+
+        Returns:
+            Tuple of classification loss (Tensor) and accuracy (0-dim Tensor)
+        """
+        outputs = self(data).flatten(end_dim=1)
+        targets = targets.repeat(self.num_members, *([1] * (targets.dim() - 1)))
+        loss = self._template.apply_criterion(outputs, targets).mean()
+        acc = self._template.compute_accuracy(outputs, targets)
+        return loss, acc
+
+    def zero_grad(self):
+        self.optimizer.zero_grad()
+
+    def step(self):
+        self.optimizer.step()
+
+    @torch.no_grad()
+    def reset_member(self, index: int) -> None:
+        """Re-initialize the parameters of one member; the others are not affected."""
+        fresh = copy.deepcopy(self._pristine_template)
+        fresh.reset_parameters()
+        if self.spectral_norm:
+            fresh.apply(_apply_spectral_norm)
+        fresh_tensors = dict(
+            itertools.chain(fresh.model.named_parameters(), fresh.model.named_buffers())
+        )
+        for name, tensor in itertools.chain(
+            self.stacked.named_parameters(), self.stacked.named_buffers()
+        ):
+            tensor[index].copy_(fresh_tensors[name])
+
+    def _stack_member_state(self, state_dict, prefix, *_) -> None:
+        member_prefix = f"{prefix}0.model."
+        names = [key[len(member_prefix) :] for key in state_dict if key.startswith(member_prefix)]
+        for name in names:
+            tensors = [state_dict.pop(f"{prefix}{k}.model.{name}") for k in range(self.num_members)]
+            state_dict[f"{prefix}stacked.{name}"] = torch.stack(tensors)
+        # spectral norm used to be applied with hooks instead of a parametrization
+        own_keys = set(self.state_dict(prefix=prefix))
+        for key in [key for key in state_dict if key.startswith(f"{prefix}stacked.")]:
+            module_name, _, attr = key.rpartition(".")
+            if attr in _SPECTRAL_NORM_KEYS:
+                tensor = state_dict.pop(key)
+                new_key = f"{module_name}.{_SPECTRAL_NORM_KEYS[attr]}"
+                if new_key in own_keys:  # 1-dim weights have no singular vectors
+                    state_dict[new_key] = tensor
+
+
+class _SpectralNorm(nn.Module):
+    """Spectral normalization of a weight as a parametrization that also works with `vmap`
+
+    The largest singular value is estimated with power iteration, like in
+    `torch.nn.utils.parametrizations.spectral_norm`. That one writes the singular vectors with
+    `out=`, which `vmap` doesn't support, so they are updated with `copy_` here.
+    """
+
+    def __init__(self, weight: Tensor, n_power_iterations: int = 1, eps: float = 1e-12):
+        super().__init__()
+        self.n_power_iterations = n_power_iterations
+        self.eps = eps
+        if weight.dim() > 1:
+            weight_mat = weight.detach().flatten(start_dim=1)
+            u = F.normalize(weight_mat.new_empty(weight_mat.size(0)).normal_(), dim=0, eps=eps)
+            v = F.normalize(weight_mat.new_empty(weight_mat.size(1)).normal_(), dim=0, eps=eps)
+            self.register_buffer("_u", u)
+            self.register_buffer("_v", v)
+            # start with reasonable estimates of the singular vectors
+            self._power_method(weight_mat, 15)
+
+    @torch.no_grad()
+    def _power_method(self, weight_mat: Tensor, n_power_iterations: int) -> None:
+        for _ in range(n_power_iterations):
+            self._u.copy_(F.normalize(torch.mv(weight_mat, self._v), dim=0, eps=self.eps))
+            self._v.copy_(F.normalize(torch.mv(weight_mat.t(), self._u), dim=0, eps=self.eps))
+
+    def forward(self, weight: Tensor) -> Tensor:
+        if weight.dim() == 1:  # the spectral norm of a vector is its length
+            return F.normalize(weight, dim=0, eps=self.eps)
+        weight_mat = weight.flatten(start_dim=1)
+        if self.training:
+            self._power_method(weight_mat, self.n_power_iterations)
+        # the singular vectors are cloned, because the next call changes them in-place and they
+        # are still needed for the backward pass of this one
+        sigma = torch.dot(self._u.clone(), torch.mv(weight_mat, self._v.clone()))
+        return weight / sigma
+
+    def right_inverse(self, value: Tensor) -> Tensor:
+        return value
+
+
+def _apply_spectral_norm(module: nn.Module) -> None:
+    weight = getattr(module, "weight", None)
+    if isinstance(weight, nn.Parameter):
+        parametrize.register_parametrization(module, "weight", _SpectralNorm(weight))
+
+
+def _get_owner(module: nn.Module, name: str) -> Tuple[nn.Module, str]:
+    """Find the submodule that owns the tensor with the (dotted) name `name`."""
+    *path, attr = name.split(".")
+    for part in path:
+        module = getattr(module, part)
+    return module, attr
@@ -1,6 +1,5 @@
 from typing import Dict, List, Optional, Tuple, Union
 
-from torch import jit
 from nifr import layers
 from nifr.configs import InnArgs
 from nifr.models import Classifier
@@ -33,6 +32,7 @@ def build_fc_inn(
                 mask_type="alternate",
                 swap=(i % 2 == 0) and not args.glow,
                 scaling=args.scaling,
+                autocast=args.precision == "bf16",
             )
         ]
 
@@ -42,15 +42,27 @@ def build_fc_inn(
     else:
         chain += [layers.RandomPermutation(input_dim)]
 
-    return layers.BijectorChain(chain)
+    model = layers.BijectorChain(chain)
+    layers.set_reversible_backprop(model, args.reversible_backprop)
+    return model
+
 
+def _block(args: InnArgs, input_dim: int, checkpoint: bool = False) -> layers.Bijector:
+    """Construct one block of the conv INN
 
-def _block(args: InnArgs, input_dim: int) -> layers.Bijector:
-    """Construct one block of the conv INN"""
+    If `checkpoint` is True, the network of the coupling layer uses activation checkpointing.
+    """
     _chain: List[layers.Bijector] = []
 
     if args.idf:
-        _chain += [layers.IntegerDiscreteFlow(input_dim, hidden_channels=args.coupling_channels)]
+        _chain += [
+            layers.IntegerDiscreteFlow(
+                input_dim,
+                hidden_channels=args.coupling_channels,
+                autocast=args.precision == "bf16",
+                checkpoint=checkpoint,
+            )
+        ]
         _chain += [layers.RandomPermutation(input_dim)]
     else:
         if args.batch_norm:
@@ -67,6 +79,8 @@ def _block(args: InnArgs, input_dim: int) -> layers.Bijector:
                     hidden_channels=args.coupling_channels,
                     num_blocks=args.coupling_depth,
                     pcnt_to_transform=0.25,
+                    autocast=args.precision == "bf16",
+                    checkpoint=checkpoint,
                 )
             ]
         elif args.scaling == "sigmoid0.5":
@@ -75,15 +89,14 @@ def _block(args: InnArgs, input_dim: int) -> layers.Bijector:
                     input_dim,
                     num_blocks=args.coupling_depth,
                     hidden_channels=args.coupling_channels,
+                    autocast=args.precision == "bf16",
+                    checkpoint=checkpoint,
                 )
             ]
         else:
             raise ValueError(f"Scaling {args.scaling} is not supported")
 
-    block = layers.BijectorChain(_chain)
-    if args.jit:
-        block = jit.script(block)
-    return block
+    return layers.BijectorChain(_chain)
 
 
 def _build_multi_scale_chain(
@@ -104,15 +117,16 @@ def _build_multi_scale_chain(
 
         input_dim *= 4
 
-        level += [_block(args, input_dim) for _ in range(args.level_depth)]
+        # an empty list of levels means that all levels are checkpointed
+        checkpoint = args.checkpoint_couplings and (
+            not args.checkpoint_levels or i in args.checkpoint_levels
+        )
+        level += [_block(args, input_dim, checkpoint) for _ in range(args.level_depth)]
 
         if unsqueeze:  # when unsqueezing, the unsqueeze layer has to come after the block
             level += [layers.InvertBijector(to_invert=squeeze)]
 
-        level_layer = layers.BijectorChain(level)
-        if args.jit:
-            level_layer = jit.script(level_layer)
-        chain.append(level_layer)
+        chain.append(layers.BijectorChain(level))
         if i in factor_splits:
             input_dim = round(factor_splits[i] * input_dim)
     return chain
@@ -137,9 +151,7 @@ def build_conv_inn(args: InnArgs, input_shape: Tuple[int, ...]) -> layers.Biject
     # full_chain += [layers.RandomPermutation(flattened_shape)]
 
     model = layers.BijectorChain(full_chain)
-
-    # if args.jit:
-    #     model = jit.script(model)
+    layers.set_reversible_backprop(model, args.reversible_backprop)
     return model
 
 
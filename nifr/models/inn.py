@@ -8,7 +8,7 @@ from typing_extensions import Literal
 
 from nifr.configs import InnArgs
 from nifr.layers import Bijector
-from nifr.utils import DLogistic, MixtureDistribution, logistic_distribution, to_discrete
+from nifr.utils import DLogisticMixture, Logistic, to_discrete
 
 from .autoencoder import AutoEncoder
 from .base import ModelBase
@@ -44,13 +44,14 @@ class BipartiteInn(ModelBase):
         self.base_density: td.Distribution
 
         if args.idf:
-            probs = 5 * [1 / 5]
-            dist_params = [(0, 0.5), (2, 0.5), (-2, 0.5), (4, 0.5), (-4, 0.5)]
-            components = [DLogistic(loc, scale) for loc, scale in dist_params]
-            self.base_density = MixtureDistribution(probs=probs, components=components)
+            self.base_density = DLogisticMixture(
+                probs=torch.full((5,), 1 / 5, device=args.device),
+                locs=torch.tensor([0.0, 2.0, -2.0, 4.0, -4.0], device=args.device),
+                scales=torch.full((5,), 0.5, device=args.device),
+            )
         else:
             if args.base_density == "logistic":
-                self.base_density = logistic_distribution(
+                self.base_density = Logistic(
                     torch.zeros(1, device=args.device),
                     torch.ones(1, device=args.device) * args.base_density_std,
                 )
@@ -204,17 +205,45 @@ class PartitionedInn(BipartiteInn):
             return z
 
     def decode(
-        self, z: Tensor, partials: bool = True, discretize: bool = False
-    ) -> Union[Tensor, Tuple[Tensor, Tensor, Tensor]]:
-        x = super().decode(z, discretize=discretize)
-        if partials:
-            zy_m, zs_m = self.zero_mask(z)
-            xy = super().decode(zy_m, discretize=discretize)
-            xs = super().decode(zs_m, discretize=discretize)
+        self,
+        z: Tensor,
+        partials: bool = True,
+        discretize: bool = False,
+        parts: Sequence[str] = ("x", "xy", "xs"),
+    ) -> Union[Tensor, Tuple[Tensor, ...]]:
+        """Map the encoding back to the input space.
 
-            return x, xy, xs
-        else:
-            return x
+        Args:
+            z: the encoding
+            partials: if True, also decode the encodings in which `zs` or `zy` are masked out
+            discretize: whether to discretize the discrete features
+            parts: which reconstructions to return if `partials` is True; "x" is the full
+                reconstruction, "xy" the one with zs masked out and "xs" the one with zy masked out
+
+        Returns:
+            the reconstruction or, if `partials` is True, a tuple with the requested parts
+        """
+        if not partials:
+            return super().decode(z, discretize=discretize)
+
+        zy_m, zs_m = self.zero_mask(z)
+        latents = {"x": z, "xy": zy_m, "xs": zs_m}
+        if any(part not in latents for part in parts):
+            raise ValueError(f"parts have to be among {list(latents)}, not {list(parts)}")
+        if not self._has_batch_independent_inverse():
+            return tuple(super().decode(latents[part], discretize=discretize) for part in parts)
+
+        # all variants go through the flow together in a single pass
+        stacked = torch.cat([latents[part] for part in parts], dim=0)
+        decoded = super().decode(stacked, discretize=discretize)
+        return tuple(decoded.split(z.size(0), dim=0))
+
+    def _has_batch_independent_inverse(self) -> bool:
+        """Batch norm layers in training mode use (and update) statistics of the whole batch."""
+        return not any(
+            isinstance(module, torch.nn.modules.batchnorm._BatchNorm) and module.training
+            for module in self.modules()
+        )
 
     def routine(self, data: torch.Tensor) -> Tuple[Tensor, Tensor]:
         """Training routine for the Split INN.
@@ -231,6 +260,17 @@ class PartitionedInn(BipartiteInn):
 
         return z, nll
 
+    def compile_graphs(self) -> None:
+        """Compile the flow with `torch.compile`.
+
+        `routine` (forward pass and NLL) becomes a single graph. All other uses of the flow, like
+        the inverse in `decode`, go through the compiled `model`. The parameters and the keys of
+        the state dict are not affected. Every input shape (e.g. a smaller last batch) gets its
+        own static graph.
+        """
+        self.model.compile(dynamic=False)
+        self.routine = torch.compile(self.routine, dynamic=False)  # type: ignore[assignment]
+
 
 class PartitionedAeInn(PartitionedInn):
     def __init__(
@@ -265,12 +305,18 @@ class PartitionedAeInn(PartitionedInn):
         logdet: Optional[Tensor] = None,
         reverse: bool = False,
         return_ae_enc: bool = False,
+        encoded: bool = False,
     ) -> Tensor:
+        """
+        Args:
+            encoded: if True, the inputs of the forward direction are already encodings of the
+                auto-encoder
+        """
         if reverse:
             ae_enc, _ = self.model(inputs, sum_ldj=logdet, reverse=reverse)
             outputs = self.autoencoder.decode(ae_enc)
         else:
-            ae_enc = self.autoencoder.encode(inputs)
+            ae_enc = inputs if encoded else self.autoencoder.encode(inputs)
             outputs, sum_ldj = self.model(ae_enc, sum_ldj=logdet, reverse=reverse)
             if sum_ldj is not None:
                 outputs = (outputs, sum_ldj)
@@ -1,3 +1,4 @@
+from .checkpointing import *
 from .evaluation import *
 from .loss import *
 from .train_inn import *
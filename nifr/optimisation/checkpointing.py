@@ -0,0 +1,215 @@
+"""Checkpoints that are written in the background and loaded lazily"""
+import atexit
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Mapping, NamedTuple, Optional, Tuple
+
+import torch
+
+__all__ = ["CheckpointManager", "LazyCheckpoint"]
+
+BEST_LINK = "checkpt_best"
+META_FILE = "meta.json"
+SHARD_SUFFIX = ".pt"
+
+
+class _Record(NamedTuple):
+    itr: int
+    score: Optional[float]
+    path: Path
+
+
+class CheckpointManager:
+    """Writes checkpoints in a background thread and deletes the ones that are no longer needed.
+
+    `save` only copies the tensors to the CPU; writing the checkpoint happens in the background.
+    A checkpoint is a directory: the entries of the state that contain tensors are written to
+    separate shards (`<key>.pt`) and everything else goes to `meta.json` (see `LazyCheckpoint`).
+    The directory is first written under a temporary name and then renamed, so a crash can't
+    leave a truncated checkpoint behind. Only the `keep_best` checkpoints with the lowest score
+    and the `keep_last` most recent ones are kept; `checkpt_best` links to the one with the
+    lowest score.
+    """
+
+    def __init__(self, save_dir: Path, keep_best: int = 1, keep_last: int = 1):
+        self.save_dir = save_dir
+        self.keep_best = keep_best
+        self.keep_last = keep_last
+        self.write_seconds: List[float] = []  # how long each write took
+
+        self._records: List[_Record] = []
+        self._error: Optional[BaseException] = None
+        self._queue: "queue.Queue[Tuple[Dict[str, Any], _Record]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="checkpoint_writer", daemon=True)
+        self._thread.start()
+        # the thread is a daemon, so the pending checkpoints have to be written before exiting
+        atexit.register(self._queue.join)
+
+    def save(self, state: Dict[str, Any], itr: int, score: Optional[float] = None) -> Path:
+        """Schedule `state` to be written; the file exists once `wait` has returned.
+
+        Args:
+            state: the checkpoint; tensors can be nested in dicts, lists and tuples, everything
+                else has to be serializable as JSON (with `str` as fallback)
+            itr: the iteration; it determines the filename
+            score: checkpoints with a lower score are better; None means that this checkpoint is
+                only kept as one of the most recent ones
+
+        Returns:
+            path of the checkpoint
+        """
+        self._raise_error()
+        record = _Record(itr=itr, score=score, path=self.save_dir / f"checkpt_step{itr}")
+        self._queue.put((_snapshot(state), record))
+        return record.path
+
+    def wait(self) -> None:
+        """Block until all scheduled checkpoints have been written."""
+        self._queue.join()
+        self._raise_error()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("writing a checkpoint failed") from error
+
+    def _run(self) -> None:
+        while True:
+            state, record = self._queue.get()
+            try:
+                start = time.perf_counter()
+                _atomic_save(state, record.path)
+                self.write_seconds.append(time.perf_counter() - start)
+                self._add_record(record)
+                self._apply_retention()
+            except Exception as error:  # pylint: disable=broad-except
+                logging.getLogger(__name__).exception("writing %s failed", record.path)
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _add_record(self, record: _Record) -> None:
+        for previous in self._records:
+            # a checkpoint for the same iteration replaces the file but keeps its score
+            if previous.path == record.path:
+                if record.score is None:
+                    record = record._replace(score=previous.score)
+                self._records.remove(previous)
+                break
+        self._records.append(record)
+
+    def _apply_retention(self) -> None:
+        scored = sorted((r for r in self._records if r.score is not None), key=lambda r: r.score)
+        by_itr = sorted(self._records, key=lambda r: r.itr)
+        keep = set(scored[: self.keep_best])
+        keep.update(by_itr[-self.keep_last :] if self.keep_last > 0 else [])
+        if scored and self.keep_best > 0:
+            _atomic_symlink(scored[0].path, self.save_dir / BEST_LINK)
+        for record in self._records:
+            if record not in keep:
+                shutil.rmtree(record.path)
+        self._records = [record for record in self._records if record in keep]
+
+
+def _snapshot(state: Any) -> Any:
+    """Copy of `state` with all tensors on the CPU, so that training can modify the original"""
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        snapshot = type(state)((key, _snapshot(value)) for key, value in state.items())
+        # state dicts carry the versions of the modules, which the load hooks of some modules need
+        if hasattr(state, "_metadata"):
+            snapshot._metadata = state._metadata  # type: ignore[attr-defined]
+        return snapshot
+    if isinstance(state, (list, tuple)):
+        return type(state)(_snapshot(value) for value in state)
+    return state
+
+
+class LazyCheckpoint(Mapping[str, Any]):
+    """Read-only view of a checkpoint that only loads the shards that are accessed.
+
+    The metadata is read right away. Shards are memory-mapped when they are accessed, so only the
+    parts of the tensors that are actually used are read from disk. Checkpoints in the old format
+    (a single file) are loaded completely.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._shards: Dict[str, Path] = {}
+        if path.is_dir():
+            with (path / META_FILE).open() as f:
+                self._meta: Dict[str, Any] = json.load(f)
+            self._shards = {shard.stem: shard for shard in path.glob(f"*{SHARD_SUFFIX}")}
+        else:
+            self._meta = torch.load(path, map_location="cpu")
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._shards:
+            return torch.load(self._shards[key], map_location="cpu", mmap=True, weights_only=True)
+        return self._meta[key]
+
+    def __contains__(self, key: object) -> bool:
+        # without loading the shard
+        return key in self._meta or key in self._shards
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._meta
+        yield from self._shards
+
+    def __len__(self) -> int:
+        return len(self._meta) + len(self._shards)
+
+
+def _has_tensors(value: Any) -> bool:
+    if isinstance(value, torch.Tensor):
+        return True
+    if isinstance(value, dict):
+        return any(_has_tensors(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(_has_tensors(item) for item in value)
+    return False
+
+
+def _atomic_save(state: Dict[str, Any], path: Path) -> None:
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    if tmp_path.exists():  # left over from a crash
+        shutil.rmtree(tmp_path)
+    tmp_path.mkdir()
+    meta = {}
+    for key, value in state.items():
+        if not _has_tensors(value):
+            meta[key] = value
+            continue
+        with (tmp_path / f"{key}{SHARD_SUFFIX}").open("wb") as f:
+            torch.save(value, f)
+            f.flush()
+            os.fsync(f.fileno())
+    with (tmp_path / META_FILE).open("w") as f:
+        json.dump(meta, f, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+
+    if path.exists():  # a checkpoint for the same iteration; it's replaced
+        old_path = path.with_name(f"{path.name}.old")
+        if old_path.exists():
+            shutil.rmtree(old_path)
+        path.replace(old_path)
+        tmp_path.replace(path)
+        shutil.rmtree(old_path)
+    else:
+        tmp_path.replace(path)
+
+
+def _atomic_symlink(target: Path, link: Path) -> None:
+    tmp_link = link.with_name(f"{link.name}.tmp")
+    if tmp_link.is_symlink():
+        tmp_link.unlink()
+    tmp_link.symlink_to(target.name)  # relative, so the directory can be moved
+    tmp_link.replace(link)
@@ -1,16 +1,18 @@
 import random
 import types
+from multiprocessing import Pool
 from pathlib import Path
-from typing import Dict, List, Optional, Union, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import pandas as pd
 import torch
-from captum.attr import IntegratedGradients, NoiseTunnel
+import torch.nn.functional as F
 from captum.attr import visualization as viz
 from matplotlib import cm
+from torch import nn
 from torch.utils.data import DataLoader, Dataset, TensorDataset, Subset
-from tqdm import tqdm
+from tqdm import tqdm, trange
 
 import wandb
 from ethicml.algorithms.inprocess import LR
@@ -18,15 +20,67 @@ from ethicml.evaluators import run_metrics
 from ethicml.metrics import PPV, TNR, TPR, Accuracy, ProbPos, RenyiCorrelation
 from ethicml.utility import DataTuple, Prediction
 from nifr.configs import InnArgs, SharedArgs
-from nifr.data import DatasetTriplet, get_data_tuples, CelebA
-from nifr.models import BipartiteInn, Classifier
+from nifr.data import (
+    CelebA,
+    DatasetTriplet,
+    EncodingCache,
+    EncodingWriter,
+    get_data_tuples,
+    get_encoding_cache,
+)
+from nifr.models import Classifier, PartitionedInn
 from nifr.models.configs import fc_net, mp_32x32_net, mp_64x64_net
 from nifr.utils import wandb_log
+from nifr.utils.optimizers import RAdam
 
 from .utils import log_images
 
 __all__ = ["compute_metrics", "log_metrics"]
 
+# settings that determine the data which is encoded by `encode_dataset`
+_ENCODING_DATA_FIELDS = (
+    "dataset",
+    "data_pcnt",
+    "task_mixing_factor",
+    "pretrain_pcnt",
+    "test_pcnt",
+    "drop_native",
+    "drop_discrete",
+    "scale",
+    "greyscale",
+    "background",
+    "black",
+    "binarize",
+    "rotate_data",
+    "shift_data",
+    "padding",
+    "quant_level",
+    "input_noise",
+    "cmnist_cache",
+    "celeba_packed",
+    "celeba_sens_attr",
+    "celeba_target_attr",
+    "genfaces_sens_attr",
+    "genfaces_target_attr",
+    "seed",
+    "data_split_seed",
+)
+# settings that change the output of the model without changing its state dict
+_ENCODING_MODEL_FIELDS = (
+    "zs_frac",
+    "levels",
+    "level_depth",
+    "reshape_method",
+    "factor_splits",
+    "idf",
+    "scaling",
+    "oxbow_net",
+    "autoencode",
+    "vae",
+    "spectral_norm",
+    "precision",
+)
+
 
 def log_sample_images(args, data, name, step):
     data_loader = DataLoader(data, shuffle=False, batch_size=64)
@@ -51,6 +105,14 @@ def log_metrics(
     task_repr = encode_dataset(args, data.task, model, recon=True, subdir="task")
     print("Encoding task train dataset...")
     task_train_repr = encode_dataset(args, data.task_train, model, recon=True, subdir="task_train")
+    if args.encoding_cache_dir:
+        cache = get_encoding_cache(Path(args.encoding_cache_dir), args.encoding_cache_size_gb)
+        print(f"Encoding cache: {cache.hits} hits, {cache.misses} misses")
+        wandb_log(
+            args,
+            {"encoding cache hits": cache.hits, "encoding cache misses": cache.misses},
+            step=step,
+        )
 
     _, clf_recons = evaluate(
         args,
@@ -108,26 +170,40 @@ def log_metrics(
             clf_recons.forward = types.MethodType(_binary_clf_fn, clf_recons)
             clf_orig.forward = types.MethodType(_binary_clf_fn, clf_orig)
 
-        clf_recons.cpu()
-        clf_orig.cpu()
-
-        for k, _ in enumerate(inds):
-            image_orig, _, target_orig = data.task[k]
-            image_deb, _, target_deb = task_repr["xy"][k]
-
-            if args.dataset in ("celeba", "ssrp", "genfaces"):
-                # for `image_deb` this is already done in `encode_dataset()`
-                image_orig = 0.5 * image_orig + 0.5
-
-            if image_orig.dim() == 3:
-                feat_attr_map_orig = get_image_attribution(image_orig, target_orig, clf_orig)
-                feat_attr_map_orig.savefig(save_dir / f"feat_attr_map_{k}_orig.png")
+        images_orig, _, targets = next(iter(DataLoader(Subset(data.task, inds), len(inds))))
+        images_deb, _, _ = next(iter(DataLoader(Subset(task_repr["xy"], inds), len(inds))))
 
-                feat_attr_map_deb = get_image_attribution(image_deb, target_deb, clf_recons)
-                feat_attr_map_deb.savefig(save_dir / f"feat_attr_map_{k}_deb.png")
+        if args.dataset in ("celeba", "ssrp", "genfaces"):
+            # for `images_deb` this is already done in `encode_dataset()`
+            images_orig = 0.5 * images_orig + 0.5
 
-        clf_recons.to(args.device)
-        clf_orig.to(args.device)
+        if images_orig.dim() == 4:
+            attr_orig, attr_deb = smoothgrad_sq_integrated_gradients(
+                models=[clf_orig, clf_recons],
+                inputs=[images_orig.to(args.device), images_deb.to(args.device)],
+                targets=targets.view(-1).long().to(args.device),
+                batch_size=args.test_batch_size,
+            )
+            jobs = []
+            for attrs, images, suffix in [
+                (attr_orig, images_orig, "orig"),
+                (attr_deb, images_deb, "deb"),
+            ]:
+                for k, (attr, image) in enumerate(zip(attrs.cpu(), images.cpu())):
+                    jobs.append(
+                        (
+                            attr.permute(1, 2, 0).numpy(),
+                            image.permute(1, 2, 0).numpy(),
+                            save_dir / f"feat_attr_map_{k}_{suffix}.png",
+                        )
+                    )
+            # rendering the figures is slow and independent of everything else
+            if args.num_workers > 0:
+                with Pool(args.num_workers) as pool:
+                    pool.starmap(save_image_attribution, jobs)
+            else:
+                for job in jobs:
+                    save_image_attribution(*job)
 
     # print("===> Predict y from xy")
     # evaluate(args, experiment, repr.task_train['x'], repr.task['x'], name='xy', pred_s=False)
@@ -210,32 +286,34 @@ def evaluate_celeba_all_attrs(
         if k not in args.celeba_sens_attr and k != args.celeba_target_attr
     }
 
-    # Iterate over each feature group that is not s or y
-    for name, feats in feat_groups_filtered.items():
-        print(f"Fitting classifier with {name} as the target.")
-        #  As before, we need to go down an additional level if the dataset is a subset
-        try:
-            if isinstance(train_data, Subset):
-                #  We take the argmax to cover multinomial attributes
-                train_data.dataset.target_attr = torch.as_tensor(
-                    other_attrs[feats].to_numpy()
-                ).argmax(1)
-            else:
-                train_data.target_attr = torch.as_tensor(other_attrs[feats].to_numpy()).argmax(1)
-
-            # Train a specialised classifier on the training data
-            clf = fit_classifier(args, input_dim, target_dim=len(feats), train_data=train_data)
-            #  Generate predictions for the original test data
-            preds_te, _, _ = clf.predict_dataset(test_data, device=args.device)
-            #  Generate predictions for the transformed test data
-            preds_te_xy, _, _ = clf.predict_dataset(test_data_xy, device=args.device)
-            # Compute how often the predictions agree
-            agreement = (preds_te == preds_te_xy).float().mean().item()
-            print(f"Prediction agreement for target {name}: {agreement}")
-            res[name] = agreement
-        except KeyError:
-            print("Skipped because it corresponds to s or y.")
-            continue
+    if args.all_attrs_multi_head:
+        res = _all_attrs_agreement_multi_head(
+            args, train_data, test_data, test_data_xy, other_attrs, feat_groups_filtered
+        )
+    else:
+        # Iterate over each feature group that is not s or y
+        for name, feats in feat_groups_filtered.items():
+            print(f"Fitting classifier with {name} as the target.")
+            #  As before, we need to go down an additional level if the dataset is a subset
+            try:
+                if isinstance(train_data, Subset):
+                    train_data.dataset.target_attr = _attr_group_target(other_attrs, feats)
+                else:
+                    train_data.target_attr = _attr_group_target(other_attrs, feats)
+
+                # Train a specialised classifier on the training data
+                clf = fit_classifier(args, input_dim, target_dim=len(feats), train_data=train_data)
+                #  Generate predictions for the original test data
+                preds_te, _, _ = clf.predict_dataset(test_data, device=args.device)
+                #  Generate predictions for the transformed test data
+                preds_te_xy, _, _ = clf.predict_dataset(test_data_xy, device=args.device)
+                # Compute how often the predictions agree
+                agreement = (preds_te == preds_te_xy).float().mean().item()
+                print(f"Prediction agreement for target {name}: {agreement}")
+                res[name] = agreement
+            except KeyError:
+                print("Skipped because it corresponds to s or y.")
+                continue
 
     res = pd.DataFrame(res, index=[0])
     save_path = save_dir / "agreement_attrs_not_s_or_y.csv"
@@ -248,6 +326,101 @@ def evaluate_celeba_all_attrs(
         train_data.target_attr = orig_target_attr_tr
 
 
+def _attr_group_target(other_attrs: pd.DataFrame, feats: List[str]) -> torch.Tensor:
+    """Class labels for a group of CelebA attributes with values in {-1, 1}"""
+    values = torch.as_tensor(other_attrs[feats].to_numpy())
+    if len(feats) == 1:
+        return (values.view(-1) + 1) // 2  # map from {-1, 1} to {0, 1}
+    # take the argmax to cover multinomial attributes
+    return values.argmax(1)
+
+
+class _MultiTargetDataset(Dataset):
+    """Replaces the target of every sample with the targets for all attribute groups."""
+
+    def __init__(self, dataset: Dataset, targets: torch.Tensor):
+        self.dataset = dataset
+        self.targets = targets
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, index: int) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        x, s, _ = self.dataset[index]
+        return x, s, self.targets[index]
+
+
+def _all_attrs_agreement_multi_head(
+    args: SharedArgs,
+    train_data: Union[Subset, Dataset],
+    test_data: Dataset,
+    test_data_xy: Dataset,
+    other_attrs: pd.DataFrame,
+    feat_groups: Dict[str, List[str]],
+) -> Dict[str, float]:
+    """Train one network with a head per attribute group and compare its predictions.
+
+    The heads are slices of the output of a single `mp_64x64_net` whose last layer is as wide as
+    all heads together. Binary attributes get one output, multinomial ones an output per class.
+    """
+    names = [name for name, feats in feat_groups.items() if set(feats) <= set(other_attrs.columns)]
+    skipped = sorted(set(feat_groups) - set(names))
+    if skipped:
+        print(f"Skipped {skipped} because they correspond to s or y.")
+    out_dims = [len(feat_groups[name]) for name in names]
+    targets = torch.stack([_attr_group_target(other_attrs, feat_groups[name]) for name in names], 1)
+    if isinstance(train_data, Subset):
+        targets = targets[torch.as_tensor(train_data.indices)]
+
+    input_dim = next(iter(train_data))[0].shape[0]
+    net = mp_64x64_net(input_dim=input_dim, target_dim=sum(out_dims)).to(args.device)
+    optimizer = RAdam(net.parameters(), lr=args.eval_lr)
+    train_loader = DataLoader(
+        _MultiTargetDataset(train_data, targets),
+        batch_size=256,
+        shuffle=True,
+        pin_memory=True,
+        num_workers=args.num_workers,
+    )
+
+    print(f"Fitting one classifier with {len(names)} heads...")
+    net.train()
+    for _ in trange(args.eval_epochs):
+        for x, _, target in train_loader:
+            x = x.to(args.device, non_blocking=True)
+            target = target.to(args.device, non_blocking=True)
+            loss = x.new_zeros(())
+            for i, logits in enumerate(net(x).split(out_dims, dim=1)):
+                if logits.size(1) == 1:
+                    head_target = target[:, i].float()
+                    loss += F.binary_cross_entropy_with_logits(logits.view(-1), head_target)
+                else:
+                    loss += F.cross_entropy(logits, target[:, i].long())
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+    def _predict(data: Dataset) -> torch.Tensor:
+        preds = []
+        with torch.set_grad_enabled(False):
+            for x, _, _ in DataLoader(data, batch_size=args.encode_batch_size):
+                outputs = net(x.to(args.device)).split(out_dims, dim=1)
+                head_preds = [
+                    (logits.view(-1) > 0).long() if logits.size(1) == 1 else logits.argmax(1)
+                    for logits in outputs
+                ]
+                preds.append(torch.stack(head_preds, dim=1).cpu())
+        return torch.cat(preds, dim=0)
+
+    net.eval()
+    agreement = (_predict(test_data) == _predict(test_data_xy)).float().mean(0)
+    res = {}
+    for name, value in zip(names, agreement.tolist()):
+        print(f"Prediction agreement for target {name}: {value}")
+        res[name] = value
+    return res
+
+
 def fit_classifier(
     args: SharedArgs,
     input_dim: Union[int, Tuple[int, ...]],
@@ -289,31 +462,65 @@ def make_tuple_from_data(train, test, pred_s):
     return (DataTuple(x=train_x, s=train.s, y=train_y), DataTuple(x=test_x, s=test.s, y=test_y))
 
 
-def get_image_attribution(input, target, model):
-
-    if input.dim() == 3:
-        original_image = np.transpose(input.cpu().detach().numpy(), (1, 2, 0))
-        input = input.unsqueeze(0)
-    else:
-        original_image = np.transpose(input.squeeze(0).cpu().detach().numpy(), (1, 2, 0))
+def smoothgrad_sq_integrated_gradients(
+    models: Sequence[nn.Module],
+    inputs: Sequence[torch.Tensor],
+    targets: torch.Tensor,
+    n_samples: int = 100,
+    stdevs: float = 0.2,
+    n_steps: int = 50,
+    batch_size: int = 1000,
+) -> List[torch.Tensor]:
+    """SmoothGrad-squared of integrated gradients (with a zero baseline) for batches of images.
+
+    This computes the same quantity as captum's `NoiseTunnel(IntegratedGradients)` with
+    `nt_type="smoothgrad_sq"`, but all images, noise samples and integration steps go through
+    the models together in chunks of (at most) `batch_size`. `models[i]` is attributed on
+    `inputs[i]`; all models are evaluated in the same forward and backward passes.
+
+    Returns:
+        one attribution tensor per model, with the same shape as the corresponding input
+    """
+    num_images = targets.size(0)
+    device = targets.device
+    # midpoints of `n_steps` equally sized intervals on the path from the baseline to the input
+    alphas = (torch.arange(n_steps, device=device, dtype=torch.float32) + 0.5) / n_steps
+    attributions = [torch.zeros_like(x) for x in inputs]
+    # every row corresponds to one noise sample of one image
+    image_inds = torch.arange(num_images, device=device).repeat(n_samples)
+    rows_per_chunk = max(1, batch_size // n_steps)
+
+    for start in range(0, image_inds.size(0), rows_per_chunk):
+        chunk_inds = image_inds[start : start + rows_per_chunk]
+        chunk_targets = targets[chunk_inds].repeat(n_steps)
+        noisy, scaled = [], []
+        for x in inputs:
+            x_noisy = x[chunk_inds] + stdevs * torch.randn_like(x[chunk_inds])
+            alpha_shape = (n_steps, 1) + (1,) * (x.dim() - 1)
+            x_scaled = (alphas.view(alpha_shape) * x_noisy.unsqueeze(0)).flatten(end_dim=1)
+            noisy.append(x_noisy)
+            scaled.append(x_scaled.requires_grad_(True))
+
+        with torch.set_grad_enabled(True):
+            total = sum(
+                model(x_scaled).gather(1, chunk_targets.view(-1, 1)).sum()
+                for model, x_scaled in zip(models, scaled)
+            )
+            grads = torch.autograd.grad(total, scaled)
 
-    def attribute_image_features(algorithm, input, **kwargs):
-        model.zero_grad()
-        tensor_attributions = algorithm.attribute(input, target=target, **kwargs)
+        for attribution, x_noisy, grad in zip(attributions, noisy, grads):
+            avg_grad = grad.view((n_steps,) + x_noisy.shape).mean(0)
+            attribution.index_add_(0, chunk_inds, (x_noisy * avg_grad) ** 2)
 
-        return tensor_attributions
+    return [attribution / n_samples for attribution in attributions]
 
-    ig = IntegratedGradients(model)
-    nt = NoiseTunnel(ig)
 
-    attr_ig_nt = attribute_image_features(
-        nt, input, baselines=input * 0, nt_type="smoothgrad_sq", n_samples=100, stdevs=0.2
-    )
-    attr_ig_nt = np.transpose(attr_ig_nt.squeeze(0).cpu().detach().numpy(), (1, 2, 0))
+def save_image_attribution(attribution: np.ndarray, image: np.ndarray, path: Path) -> None:
+    """Plot an attribution map (H x W x C) next to the image and save the figure to `path`."""
     cmap = cm.get_cmap("viridis", 12)
-    fig, ax = viz.visualize_image_attr_multiple(
-        attr_ig_nt,
-        original_image=original_image,
+    fig, _ = viz.visualize_image_attr_multiple(
+        attribution,
+        original_image=image,
         methods=["original_image", "masked_image", "blended_heat_map"],
         signs=[None, "absolute_value", "absolute_value"],
         outlier_perc=10,
@@ -321,8 +528,7 @@ def get_image_attribution(input, target, model):
         show_colorbar=True,
         use_pyplot=False,
     )
-
-    return fig
+    fig.savefig(path)
 
 
 def evaluate(
@@ -394,20 +600,43 @@ def evaluate(
     return metrics, clf
 
 
+def _encoding_cache_key(args: SharedArgs, model: PartitionedInn, subdir: str) -> str:
+    config = {
+        field: getattr(args, field) for field in _ENCODING_DATA_FIELDS + _ENCODING_MODEL_FIELDS
+    }
+    config["split"] = subdir
+    # the split of the encoding into zy and zs
+    config["zy_dim"], config["zs_dim"] = model.zy_dim, model.zs_dim
+    return EncodingCache.make_key(model, config)
+
+
 def encode_dataset(
     args: SharedArgs,
     data: Dataset,
-    model: BipartiteInn,
+    model: PartitionedInn,
     recon: bool,
     subdir: str,
     get_zy: bool = False,
 ) -> Dict[str, torch.utils.data.Dataset]:
 
-    encodings: Dict[str, List[torch.Tensor]] = {"xy": []}
-    if get_zy:
-        encodings["zy"] = []
+    keys = ["xy", "zy"] if get_zy else ["xy"]
+    encodings: Dict[str, List[torch.Tensor]] = {key: [] for key in keys}
     all_s = []
     all_y = []
+    # with `encodings_dir`, the encodings are streamed to disk instead of being collected in memory
+    store_dir: Optional[Path] = Path(args.encodings_dir) / subdir if args.encodings_dir else None
+    writers: Dict[str, EncodingWriter] = {}
+    num_samples = len(data)
+
+    cache: Optional[EncodingCache] = None
+    if args.encoding_cache_dir:
+        cache = get_encoding_cache(Path(args.encoding_cache_dir), args.encoding_cache_size_gb)
+        cache_key = _encoding_cache_key(args, model, subdir)
+        cached = cache.lookup(cache_key, keys)
+        if cached is not None:
+            print(f"Using cached encodings of {subdir}")
+            return cached
+        store_dir = cache.entry_dir(cache_key)
 
     data = DataLoader(
         data, batch_size=args.encode_batch_size, pin_memory=True, shuffle=False, num_workers=4
@@ -417,13 +646,9 @@ def encode_dataset(
         for _, (x, s, y) in enumerate(tqdm(data)):
 
             x = x.to(args.device, non_blocking=True)
-            all_s.append(s)
-            all_y.append(y)
-
-            _, zy, zs = model.encode(x, partials=True)
 
-            zs_m = torch.cat([zy, torch.zeros_like(zs)], dim=1)
-            xy = model.invert(zs_m)
+            z, zy, _ = model.encode(x, partials=True)
+            (xy,) = model.decode(z, partials=True, discretize=True, parts=("xy",))
 
             if args.dataset in ("celeba", "ssrp", "genfaces"):
                 xy = 0.5 * xy + 0.5
@@ -431,17 +656,35 @@ def encode_dataset(
             if x.dim() > 2:
                 xy = xy.clamp(min=0, max=1)
 
-            encodings["xy"].append(xy.detach().cpu())
-            if get_zy:
-                encodings["zy"].append(zy.detach().cpu())
-
-    all_s = torch.cat(all_s, dim=0)
-    all_y = torch.cat(all_y, dim=0)
+            batch = {"xy": xy, "zy": zy}
+            if store_dir is not None:
+                if not writers:
+                    writers = {
+                        # images are stored with 8 bits, everything else as float16
+                        key: EncodingWriter(
+                            store_dir / key, num_samples, quantize=key == "xy" and x.dim() > 2
+                        )
+                        for key in keys
+                    }
+                for key in keys:
+                    writers[key].write(batch[key], s, y)
+            else:
+                all_s.append(s)
+                all_y.append(y)
+                for key in keys:
+                    encodings[key].append(batch[key].detach().cpu())
 
     encodings_dt: Dict[str, torch.utils.data.Dataset] = {}
-    encodings_dt["xy"] = TensorDataset(torch.cat(encodings["xy"], dim=0), all_s, all_y)
-    if get_zy:
-        encodings_dt["zy"] = TensorDataset(torch.cat(encodings["zy"], dim=0), all_s, all_y)
+    if store_dir is not None:
+        for key in keys:
+            encodings_dt[key] = writers[key].finish()
+        if cache is not None:
+            cache.evict(keep=store_dir.name)
+    else:
+        all_s = torch.cat(all_s, dim=0)
+        all_y = torch.cat(all_y, dim=0)
+        for key in keys:
+            encodings_dt[key] = TensorDataset(torch.cat(encodings[key], dim=0), all_s, all_y)
 
     return encodings_dt
 
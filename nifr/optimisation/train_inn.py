@@ -1,24 +1,35 @@
 # -*- coding: UTF-8 -*-
 """Main training file"""
+import itertools
 import time
 from logging import Logger
 from pathlib import Path
-from typing import Callable, Dict, List, Optional, Tuple, Union
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 import git
 import numpy as np
 import torch
+import torch.distributed as dist
 import torch.nn as nn
 import torch.nn.functional as F
 from torch import Tensor
-from torch.utils.data import DataLoader
+from torch.utils.data import BatchSampler, DataLoader, Dataset
 
 import wandb
 from nifr.configs import InnArgs
-from nifr.data import DatasetTriplet, load_dataset
+from nifr.data import (
+    DatasetTriplet,
+    DeviceLoader,
+    EncodedDataset,
+    EncodingWriter,
+    ResumableSampler,
+    TabularBatchLoader,
+    load_dataset,
+)
 from nifr.models import (
     VAE,
     AutoEncoder,
+    DiscriminatorEnsemble,
     PartitionedAeInn,
     PartitionedInn,
     build_conv_inn,
@@ -34,19 +45,33 @@ from nifr.models.configs import (
     mp_32x32_net,
     mp_64x64_net,
 )
+from nifr.layers import MovingBatchNorm1d, MovingBatchNorm2d
 from nifr.utils import (
-    AverageMeter,
+    MetricsAccumulator,
+    all_reduce_mean,
+    averaged_gradients,
+    barrier,
+    broadcast_module,
+    broadcast_object,
     count_parameters,
+    flush_wandb_log,
+    gather_object,
     get_logger,
+    get_rank,
+    get_rng_state,
+    get_world_size,
+    is_main_process,
     iter_forever,
     random_seed,
     readable_duration,
+    set_rng_state,
     wandb_log,
 )
 
+from .checkpointing import CheckpointManager
 from .evaluation import log_metrics
 from .loss import MixedLoss, PixelCrossEntropy, grad_reverse
-from .utils import get_data_dim, log_images, restore_model, save_model
+from .utils import checkpoint_state, get_data_dim, log_images, restore_model, restore_training
 
 __all__ = ["main_inn"]
 
@@ -58,18 +83,22 @@ def compute_loss(
     x: Tensor,
     s: Tensor,
     inn: Union[PartitionedInn, PartitionedAeInn],
-    disc_ensemble: nn.ModuleList,
+    disc_ensemble: DiscriminatorEnsemble,
     itr: int,
-) -> Tuple[Tensor, Dict[str, float]]:
+    encoded: bool = False,
+) -> Tuple[Tensor, Dict[str, Tensor]]:
+    """Compute the loss; if `encoded` is True, x has already been encoded by the auto-encoder"""
     logging_dict = {}
 
-    # the following code is also in inn.routine() but we need to access ae_enc directly
-    zero = x.new_zeros(x.size(0), 1)
     if ARGS.autoencode:
-        (enc, sum_ldj), ae_enc = inn.forward(x, logdet=zero, reverse=False, return_ae_enc=True)
+        # the following code is also in inn.routine() but we need to access ae_enc directly
+        zero = x.new_zeros(x.size(0), 1)
+        (enc, sum_ldj), ae_enc = inn.forward(
+            x, logdet=zero, reverse=False, return_ae_enc=True, encoded=encoded
+        )
+        nll = inn.nll(enc, sum_ldj)
     else:
-        enc, sum_ldj = inn.forward(x, logdet=zero, reverse=False)
-    nll = inn.nll(enc, sum_ldj)
+        enc, nll = inn.routine(x)
 
     enc_y, enc_s = inn.split_encoding(enc)
 
@@ -93,15 +122,8 @@ def compute_loss(
             recon_loss = ARGS.recon_stability_weight * F.mse_loss(recon, recon_target)
 
     enc_y = grad_reverse(enc_y)
-    disc_loss = x.new_zeros(1)
-    disc_acc = 0
-    for disc in disc_ensemble:
-        disc_loss_k, disc_acc_k = disc.routine(enc_y, s)
-        disc_loss += disc_loss_k
-        disc_acc += disc_acc_k
-
-    disc_loss /= ARGS.num_discs
-    disc_acc /= ARGS.num_discs
+    # loss and accuracy are averaged over the discriminators
+    disc_loss, disc_acc = disc_ensemble.routine(enc_y, s)
 
     if itr < ARGS.warmup_steps:
         pred_s_weight = ARGS.pred_s_weight * np.exp(-7 + 7 * itr / ARGS.warmup_steps)
@@ -116,12 +138,12 @@ def compute_loss(
 
     logging_dict.update(
         {
-            "NLL Loss (INN)": nll.item(),
-            "Loss (Disc.)": disc_loss.item(),
-            "Adversarial Loss (INN)": disc_loss.item(),
+            "NLL Loss (INN)": nll.detach(),
+            "Loss (Disc.)": disc_loss.detach(),
+            "Adversarial Loss (INN)": disc_loss.detach(),
             "Accuracy (Disc.)": disc_acc,
-            "Recon Loss (INN)": recon_loss.item(),
-            "Total Loss (INN)": (nll - disc_loss + recon_loss).item(),
+            "Recon Loss (INN)": recon_loss.detach(),
+            "Total Loss (INN)": (nll - disc_loss + recon_loss).detach(),
         }
     )
     return loss, logging_dict
@@ -129,11 +151,13 @@ def compute_loss(
 
 def update_model(
     inn: Union[PartitionedInn, PartitionedAeInn],
-    disc_ensemble: nn.ModuleList,
+    disc_ensemble: DiscriminatorEnsemble,
     x: Tensor,
     s: Tensor,
     itr: int,
-) -> Dict[str, float]:
+    encoded: bool = False,
+) -> Dict[str, Tensor]:
+    """Do one training step; the returned metrics are left on the device"""
     inn.train()
     disc_ensemble.train()
 
@@ -141,37 +165,38 @@ def update_model(
 
     x, s = to_device(x, s)
 
-    loss, logging_dict = compute_loss(x, s, inn, disc_ensemble, itr)
+    loss, logging_dict = compute_loss(x, s, inn, disc_ensemble, itr, encoded=encoded)
 
     inn.zero_grad()
-
-    for disc in disc_ensemble:
-        disc.zero_grad()
+    disc_ensemble.zero_grad()
 
     loss.backward()
+    if ARGS.distributed:
+        # DistributedDataParallel can't be used because the parameters aren't only used in the
+        # forward pass of the modules (e.g. in the inverse pass and in `vmap`)
+        params = itertools.chain(inn.model.parameters(), disc_ensemble.parameters())
+        all_reduce_mean(param.grad for param in params if param.grad is not None)
     inn.step()
+    disc_ensemble.step()
 
-    for disc in disc_ensemble:
-        disc.step()
-
-    # Log losses
-    wandb_log(ARGS, logging_dict, step=itr)
     return logging_dict
 
 
-def validate(inn: PartitionedInn, disc_ensemble: nn.ModuleList, val_loader, itr: int):
+def validate(inn: PartitionedInn, disc_ensemble: DiscriminatorEnsemble, val_loader, itr: int):
     inn.eval()
     disc_ensemble.eval()
 
     with torch.set_grad_enabled(False):
-        loss_meter = AverageMeter()
+        loss_meter = MetricsAccumulator()
         for val_itr, (x_val, s_val, y_val) in enumerate(val_loader):
 
             x_val, s_val, y_val = to_device(x_val, s_val, y_val)
 
             _, logging_dict = compute_loss(x_val, s_val, inn, disc_ensemble, itr)
 
-            loss_meter.update(logging_dict["Total Loss (INN)"], n=x_val.size(0))
+            loss_meter.update(
+                {"Validation Loss (INN)": logging_dict["Total Loss (INN)"]}, n=x_val.size(0)
+            )
 
             if val_itr == 0:
                 if ARGS.dataset in ("cmnist", "celeba", "ssrp", "genfaces"):
@@ -182,14 +207,21 @@ def validate(inn: PartitionedInn, disc_ensemble: nn.ModuleList, val_loader, itr:
                     log_images(ARGS, x_val, "original_x", prefix="test", step=itr)
                     log_images(ARGS, recon_y, "reconstruction_yn", prefix="test", step=itr)
                     log_images(ARGS, recon_s, "reconstruction_yn", prefix="test", step=itr)
-                    x_recon = inn(inn(x_val), reverse=True)
-                    x_diff = (x_recon - x_val).abs().mean().item()
-                    print(f"MAE of x and reconstructed x: {x_diff}")
-                    wandb_log(ARGS, {"reconstruction MAE": x_diff}, step=itr)
+                # check that the INN is still invertible (reduced precision can break this); the
+                # auto-encoder isn't invertible, so then this is measured on its encodings
+                if isinstance(inn, PartitionedAeInn):
+                    inn_input = inn.autoencoder.encode(x_val)
+                else:
+                    inn_input = x_val
+                inn_recon, _ = inn.model(inn.model(inn_input)[0], reverse=True)
+                inn_diff = (inn_recon - inn_input).abs().mean().item()
+                LOGGER.info("MAE of the INN inputs and their reconstructions: {:.3g}", inn_diff)
+                wandb_log(ARGS, {"reconstruction MAE": inn_diff}, step=itr)
 
-        wandb_log(ARGS, {"Validation Loss (INN)": loss_meter.avg}, step=itr)
+        val_metrics = loss_meter.compute()
+        wandb_log(ARGS, val_metrics, step=itr)
 
-    return loss_meter.avg
+    return val_metrics["Validation Loss (INN)"]
 
 
 def to_device(*tensors):
@@ -200,6 +232,31 @@ def to_device(*tensors):
     return tuple(moved)
 
 
+def _pretrain_data_is_random(args: InnArgs) -> bool:
+    """Whether the pretraining samples are different every time they are loaded"""
+    # cMNIST digits get a new random color every time
+    return args.input_noise or args.dataset == "cmnist"
+
+
+def encode_pretrain_data(
+    autoencoder: AutoEncoder, data: Dataset, directory: Path
+) -> EncodedDataset:
+    """Encode a whole dataset with the auto-encoder and store the encodings in `directory`"""
+    loader = DataLoader(
+        data,
+        batch_size=ARGS.encode_batch_size,
+        shuffle=False,
+        num_workers=ARGS.num_workers,
+        pin_memory=True,
+    )
+    writer = EncodingWriter(directory, len(data), half_precision=ARGS.ae_latent_dtype == "float16")
+    autoencoder.eval()
+    with torch.set_grad_enabled(False):
+        for x, s, y in loader:
+            writer.write(autoencoder.encode(to_device(x)), s, y)
+    return writer.finish()
+
+
 def log_recons(inn: PartitionedInn, x, itr: int, prefix: Optional[str] = None) -> None:
     z = inn(x[:64])
     recon_all, recon_y, recon_s = inn.decode(z, partials=True)
@@ -224,21 +281,39 @@ def main_inn(raw_args: Optional[List[str]] = None) -> Union[PartitionedInn, Part
 
     args = InnArgs(explicit_bool=True, underscores_to_dashes=True)
     args.parse_args(raw_args)
+    if args.distributed:
+        # the rank and the number of processes are taken from the environment (set by torchrun)
+        dist.init_process_group("gloo")
+    rank, world_size = get_rank(), get_world_size()
+    if args.batch_size % world_size != 0:
+        raise ValueError("the batch size has to be divisible by the number of processes")
     use_gpu = torch.cuda.is_available() and args.gpu >= 0
     random_seed(args.seed, use_gpu)
     datasets: DatasetTriplet = load_dataset(args)
+    if world_size > 1:
+        # the random augmentations have to be different in every process; the weights are
+        # synchronized at the start of the training
+        random_seed(args.seed + rank, use_gpu)
     # ==== initialize globals ====
     global ARGS, LOGGER
     ARGS = args
+    # only the main process logs and saves checkpoints
+    ARGS.use_wandb = ARGS.use_wandb and is_main_process()
     args_dict = args.as_dict()
 
     if ARGS.use_wandb:
         wandb.init(project="nosinn", config=args_dict)
 
-    save_dir = Path(ARGS.save_dir) / str(time.time())
-    save_dir.mkdir(parents=True, exist_ok=True)
+    save_dir = broadcast_object(Path(ARGS.save_dir) / str(time.time()))
+    if is_main_process():
+        save_dir.mkdir(parents=True, exist_ok=True)
 
-    LOGGER = get_logger(logpath=save_dir / "logs", filepath=Path(__file__).resolve())
+    LOGGER = get_logger(
+        logpath=save_dir / "logs",
+        filepath=Path(__file__).resolve(),
+        displaying=is_main_process(),
+        saving=is_main_process(),
+    )
     LOGGER.info("Namespace(" + ", ".join(f"{k}={args_dict[k]}" for k in sorted(args_dict)) + ")")
     LOGGER.info("Save directory: {}", save_dir.resolve())
     # ==== check GPU ====
@@ -246,8 +321,8 @@ def main_inn(raw_args: Optional[List[str]] = None) -> Union[PartitionedInn, Part
         f"cuda:{ARGS.gpu}" if (torch.cuda.is_available() and not ARGS.gpu < 0) else "cpu"
     )
     LOGGER.info("{} GPUs available. Using device '{}'", torch.cuda.device_count(), ARGS.device)
-    if ARGS.jit:
-        LOGGER.info("JIT enabled")
+    if ARGS.distributed:
+        LOGGER.info("Data-parallel training with {} processes", world_size)
 
     # ==== construct dataset ====
     LOGGER.info(
@@ -257,20 +332,47 @@ def main_inn(raw_args: Optional[List[str]] = None) -> Union[PartitionedInn, Part
         len(datasets.task),
     )
     ARGS.test_batch_size = ARGS.test_batch_size if ARGS.test_batch_size else ARGS.batch_size
-    train_loader = DataLoader(
-        datasets.pretrain,
-        shuffle=True,
-        batch_size=ARGS.batch_size,
-        num_workers=ARGS.num_workers,
-        pin_memory=True,
-    )
-    val_loader = DataLoader(
-        datasets.task_train,
-        shuffle=False,
-        batch_size=ARGS.test_batch_size,
-        num_workers=ARGS.num_workers,
-        pin_memory=True,
-    )
+    train_loader: Union[DataLoader, DeviceLoader, TabularBatchLoader]
+    val_loader: Union[DataLoader, TabularBatchLoader]
+    if ARGS.dataset == "adult":
+        # tabular data fits in memory and is cheaper to serve in whole batches
+        train_loader = TabularBatchLoader(
+            datasets.pretrain,
+            batch_size=ARGS.batch_size,
+            shuffle=True,
+            seed=ARGS.seed,
+            num_replicas=world_size,
+            rank=rank,
+        )
+    else:
+        # the order and the seeds of the workers can be resumed mid-epoch; the seeds come from a
+        # generator of the sampler, so that the global RNG doesn't depend on when an epoch starts
+        sampler = ResumableSampler(
+            datasets.pretrain, ARGS.batch_size, seed=ARGS.seed, num_replicas=world_size, rank=rank
+        )
+        train_loader = DataLoader(
+            datasets.pretrain,
+            sampler=sampler,
+            batch_size=ARGS.batch_size // world_size,
+            num_workers=ARGS.num_workers,
+            pin_memory=True,
+            generator=sampler.worker_generator,
+        )
+    if datasets.pretrain_batch_transform is not None:
+        batch_transform = datasets.pretrain_batch_transform.to(ARGS.device)
+        train_loader = DeviceLoader(train_loader, ARGS.device, batch_transform=batch_transform)
+    if ARGS.dataset == "adult":
+        val_loader = TabularBatchLoader(
+            datasets.task_train, batch_size=ARGS.test_batch_size, seed=ARGS.seed
+        )
+    else:
+        val_loader = DataLoader(
+            datasets.task_train,
+            shuffle=False,
+            batch_size=ARGS.test_batch_size,
+            num_workers=ARGS.num_workers,
+            pin_memory=True,
+        )
 
     # ==== construct networks ====
     input_shape = get_data_dim(train_loader)
@@ -305,6 +407,7 @@ def main_inn(raw_args: Optional[List[str]] = None) -> Union[PartitionedInn, Part
 
     # ======================================== INN settings =======================================
     inn_kwargs = {"args": args, "optimizer_args": optimizer_args, "feature_groups": feature_groups}
+    encoded_train_data = False
 
     # ======================================= initialise INN ======================================
     if ARGS.autoencode:
@@ -366,12 +469,41 @@ def main_inn(raw_args: Optional[List[str]] = None) -> Union[PartitionedInn, Part
             else:
                 raise ValueError(f"{ARGS.ae_loss} is an invalid reconstruction loss")
 
-            inn.fit_ae(train_loader, epochs=ARGS.ae_epochs, device=ARGS.device, loss_fn=ae_loss_fn)
-            # the args names follow the convention of the standalone VAE commandline args
-            args_ae = {"init_channels": ARGS.ae_channels, "levels": ARGS.ae_levels}
-            torch.save(
-                {"model": autoencoder.state_dict(), "args": args_ae}, save_dir / "autoencoder"
-            )
+            broadcast_module(autoencoder)
+            with averaged_gradients(autoencoder):
+                inn.fit_ae(
+                    train_loader, epochs=ARGS.ae_epochs, device=ARGS.device, loss_fn=ae_loss_fn
+                )
+            if is_main_process():
+                # the args names follow the convention of the standalone VAE commandline args
+                args_ae = {"init_channels": ARGS.ae_channels, "levels": ARGS.ae_levels}
+                torch.save(
+                    {"model": autoencoder.state_dict(), "args": args_ae}, save_dir / "autoencoder"
+                )
+
+        if ARGS.ae_latent_cache:
+            if _pretrain_data_is_random(ARGS):
+                LOGGER.info("The pretraining data is augmented, so it is encoded on the fly")
+            else:
+                LOGGER.info("Encoding the pretraining data with the auto-encoder...")
+                # the other processes use the encodings of the main process
+                if is_main_process():
+                    encode_pretrain_data(autoencoder, datasets.pretrain, save_dir / "ae_latents")
+                barrier()
+                latents = EncodedDataset(save_dir / "ae_latents")
+                # whole batches are read from the memory-mapped encodings at once
+                sampler = ResumableSampler(
+                    latents, ARGS.batch_size, seed=ARGS.seed, num_replicas=world_size, rank=rank
+                )
+                train_loader = DataLoader(
+                    latents,
+                    sampler=BatchSampler(sampler, ARGS.batch_size // world_size, drop_last=False),
+                    batch_size=None,
+                    num_workers=ARGS.num_workers,
+                    pin_memory=True,
+                    generator=sampler.worker_generator,
+                )
+                encoded_train_data = True
     else:
         inn_kwargs["input_shape"] = input_shape
         inn_kwargs["model"] = inn_fn(args, input_shape)
@@ -392,7 +524,7 @@ def main_inn(raw_args: Optional[List[str]] = None) -> Union[PartitionedInn, Part
 
     # Initialise Discriminators
     disc_optimizer_kwargs = {"lr": ARGS.disc_lr}
-    disc_ensemble = []
+    discs = []
 
     for k in range(ARGS.num_discs):
         disc = build_discriminator(
@@ -404,26 +536,26 @@ def main_inn(raw_args: Optional[List[str]] = None) -> Union[PartitionedInn, Part
             model_kwargs=disc_kwargs,
             optimizer_kwargs=disc_optimizer_kwargs,
         )
-        disc_ensemble.append(disc)
-    disc_ensemble = nn.ModuleList(disc_ensemble)
+        discs.append(disc)
+    disc_ensemble = DiscriminatorEnsemble(
+        discs, optimizer_kwargs=disc_optimizer_kwargs, spectral_norm=ARGS.spectral_norm
+    )
     disc_ensemble.to(ARGS.device)
 
-    if ARGS.spectral_norm:
-
-        def spectral_norm(m):
-            if hasattr(m, "weight"):
-                return torch.nn.utils.spectral_norm(m)
+    def spectral_norm(m):
+        if hasattr(m, "weight"):
+            return torch.nn.utils.spectral_norm(m)
 
+    if ARGS.spectral_norm:
         inn.apply(spectral_norm)
-        for disc in disc_ensemble:
-            disc.apply(spectral_norm)
 
     # Resume from checkpoint
+    progress = None
     if ARGS.resume is not None:
         LOGGER.info("Restoring model from checkpoint")
         filename = Path(ARGS.resume)
-        inn, _ = restore_model(args, filename, inn=inn, disc_ensemble=disc_ensemble)
         if ARGS.evaluate:
+            inn = restore_model(args, filename, inn=inn)
             log_metrics(
                 ARGS,
                 model=inn,
@@ -433,8 +565,17 @@ def main_inn(raw_args: Optional[List[str]] = None) -> Union[PartitionedInn, Part
                 feat_attr=save_dir if ARGS.feat_attr else None,
                 all_attrs_celeba=save_dir if ARGS.all_attrs else None,
             )
-
+            flush_wandb_log()
             return inn
+        progress = restore_training(args, filename, inn=inn, disc_ensemble=disc_ensemble)
+        if progress is None:
+            LOGGER.info("The checkpoint only has the weights; the optimizers start from scratch")
+        else:
+            LOGGER.info("Resuming the training at step {}", progress["itr"])
+
+    if ARGS.compile:
+        LOGGER.info("Compiling the INN")
+        inn.compile_graphs()
 
     # Logging
     # wandb.set_model_graph(str(inn))
@@ -447,7 +588,77 @@ def main_inn(raw_args: Optional[List[str]] = None) -> Union[PartitionedInn, Part
         val_loader=val_loader,
         save_dir=save_dir,
         sha=sha,
+        encoded_train_data=encoded_train_data,
+        progress=progress,
+    )
+
+
+class _SkipBatches:
+    """Iterate over `loader`, but drop the first `num_batches` batches of the first epoch"""
+
+    def __init__(self, loader: DataLoader, num_batches: int):
+        self.loader = loader
+        self.dataset = loader.dataset
+        self.num_batches = num_batches
+
+    def __iter__(self) -> Iterator:
+        num_batches, self.num_batches = self.num_batches, 0
+        return itertools.islice(self.loader, num_batches, None)
+
+    def __len__(self) -> int:
+        return len(self.loader)
+
+
+def _set_loader_position(
+    loader: Union[DataLoader, DeviceLoader, TabularBatchLoader], num_batches: int
+) -> Union[DataLoader, DeviceLoader, TabularBatchLoader, _SkipBatches]:
+    """Continue the iteration over the training data after `num_batches` training steps
+
+    Returns:
+        the loader that continues at this position
+    """
+    data_loader = loader.data_loader if isinstance(loader, DeviceLoader) else loader
+    if isinstance(data_loader, TabularBatchLoader):
+        data_loader.set_position(num_batches)
+        return loader
+    sampler = data_loader.sampler
+    if isinstance(sampler, BatchSampler):
+        sampler = sampler.sampler
+    if data_loader.num_workers == 0:
+        sampler.set_position(num_batches)
+        return loader
+    # the random numbers of a worker depend on all the batches that it has loaded in the epoch,
+    # so the epoch is loaded from the start and the batches that were already used are dropped
+    skip = num_batches % sampler.batches_per_epoch
+    sampler.set_position(num_batches - skip)
+    if isinstance(loader, DeviceLoader):
+        # before the batch transform, which uses the global RNG
+        loader.data_loader = _SkipBatches(data_loader, skip)
+        return loader
+    return _SkipBatches(data_loader, skip)
+
+
+def _sync_running_stats(inn: nn.Module) -> None:
+    """Average the running statistics of the batch norm layers over all processes"""
+    if not ARGS.distributed:
+        return
+    batch_norms = (
+        module
+        for module in inn.modules()
+        if isinstance(module, (MovingBatchNorm1d, MovingBatchNorm2d))
     )
+    all_reduce_mean(
+        itertools.chain.from_iterable((bn.running_mean, bn.running_var) for bn in batch_norms)
+    )
+
+
+def _average_metrics(metrics: Dict[str, float]) -> Dict[str, float]:
+    """Average the metrics over all processes"""
+    if not ARGS.distributed:
+        return metrics
+    values = torch.tensor(list(metrics.values()), dtype=torch.float64)
+    all_reduce_mean([values])
+    return dict(zip(metrics, values.tolist()))
 
 
 def train(
@@ -458,58 +669,130 @@ def train(
     val_loader: DataLoader,
     save_dir: Path,
     sha: str,
+    encoded_train_data: bool = False,
+    progress: Optional[Dict] = None,
 ) -> Union[PartitionedInn, PartitionedAeInn]:
+    """Train the INN and the discriminators; `progress` is the state of a resumed training
+
+    In data-parallel training, this is called in every process. Validation, logging and
+    checkpointing only happen in the main process.
+    """
     best_loss = float("inf")
     n_vals_without_improvement = 0
     super_val_freq = ARGS.super_val_freq or ARGS.val_freq
+    checkpoints: Optional[CheckpointManager] = None
+    if is_main_process():
+        checkpoints = CheckpointManager(
+            save_dir, keep_best=ARGS.keep_best_checkpoints, keep_last=ARGS.keep_last_checkpoints
+        )
 
     itr = 0
+    if progress is not None:
+        itr = progress["itr"]
+        best_loss = progress["best_loss"]
+        n_vals_without_improvement = progress["n_vals_without_improvement"]
+        # every training step draws exactly one batch; the training starts with a new epoch
+        train_loader = _set_loader_position(train_loader, itr)
+        rng_state = progress["rng"]
+        if isinstance(rng_state, list):  # one state per process
+            if len(rng_state) != get_world_size():
+                raise ValueError(f"the checkpoint was saved by {len(rng_state)} processes")
+            rng_state = rng_state[get_rank()]
+        set_rng_state(rng_state)
+    # all processes start with the weights of the main process
+    broadcast_module(inn)
+    broadcast_module(disc_ensemble)
+
+    def _save_checkpoint(score: Optional[float] = None) -> Optional[Path]:
+        """This has to be called in all processes; only the main process saves the checkpoint"""
+        _sync_running_stats(inn)
+        rng_states = gather_object(get_rng_state()) if ARGS.distributed else None
+        if checkpoints is None:
+            return None
+        state = checkpoint_state(
+            ARGS,
+            inn,
+            disc_ensemble,
+            itr=itr,
+            sha=sha,
+            rng_states=rng_states,
+            best_loss=best_loss,
+            n_vals_without_improvement=n_vals_without_improvement,
+        )
+        return checkpoints.save(state, itr=itr, score=score)
+
     start_epoch_time = time.time()
-    loss_meters: Optional[Dict[str, AverageMeter]] = None
+    loss_meters = MetricsAccumulator()
     for x, s, y in iter_forever(train_loader):
         if itr > ARGS.iters:
             break
 
-        logging_dict = update_model(inn, disc_ensemble, x=x, s=s, itr=itr)
-        if loss_meters is None:
-            loss_meters = {name: AverageMeter() for name in logging_dict}
-        for name, value in logging_dict.items():
-            loss_meters[name].update(value)
+        # this happens at the start of a step, so that a resumed training (which starts after a
+        # checkpoint) draws the same random numbers as an uninterrupted one
+        resets = [
+            k
+            for k in range(disc_ensemble.num_members)
+            if np.random.uniform() < ARGS.disc_reset_prob
+        ]
+        if ARGS.distributed:
+            # the main process decides and the others copy the re-initialized weights
+            resets = broadcast_object(resets)
+        for k in resets:
+            LOGGER.info("Reinitializing discriminator {}", k)
+            disc_ensemble.reset_member(k)
+        if resets:
+            broadcast_module(disc_ensemble)
+
+        logging_dict = update_model(
+            inn, disc_ensemble, x=x, s=s, itr=itr, encoded=encoded_train_data
+        )
+        loss_meters.update(logging_dict)
 
         itr += 1
 
         if itr % ARGS.log_freq == 0:
             time_for_epoch = time.time() - start_epoch_time
             start_epoch_time = time.time()
-            # Log images
-            with torch.set_grad_enabled(False):
-                x = to_device(x)
-                log_recons(inn, x, itr)
-
-            assert loss_meters is not None
+            # Log images; training on encodings means that the original images aren't available
+            if not encoded_train_data and is_main_process():
+                with torch.set_grad_enabled(False):
+                    x = to_device(x)
+                    log_recons(inn, x, itr)
+
+            # this is the only place where the training metrics are copied to the host
+            train_metrics = _average_metrics(loss_meters.compute())
+            wandb_log(ARGS, train_metrics, step=itr)
             LOGGER.info(
                 "[TRN] Step {:06d} | Time since last: {} | Iterations/s: {:.3g} | {}",
                 itr,
                 readable_duration(time_for_epoch),
                 ARGS.log_freq / time_for_epoch,
-                " | ".join(f"{name}: {meter.avg:.3g}" for name, meter in loss_meters.items()),
+                " | ".join(f"{name}: {value:.3g}" for name, value in train_metrics.items()),
             )
-            # reset loss meters
-            loss_meters = None
+            loss_meters.reset()
 
         if itr % ARGS.val_freq == 0:
             start_val_time = time.time()
-            val_loss = validate(
-                inn, disc_ensemble, train_loader if ARGS.dataset == "ssrp" else val_loader, itr
-            )
+            _sync_running_stats(inn)
+            val_loss = None
+            if is_main_process():
+                val_loss = validate(
+                    inn, disc_ensemble, train_loader if ARGS.dataset == "ssrp" else val_loader, itr
+                )
+            val_loss = broadcast_object(val_loss)
             val_time = time.time() - start_val_time
+            if checkpoints is not None and checkpoints.write_seconds:
+                wandb_log(ARGS, {"checkpoint write time": checkpoints.write_seconds[-1]}, step=itr)
 
-            if val_loss < best_loss:
+            improved = val_loss < best_loss
+            if improved:
                 best_loss = val_loss
-                save_model(ARGS, save_dir, inn, disc_ensemble, itr=itr, sha=sha, best=True)
                 n_vals_without_improvement = 0
             else:
                 n_vals_without_improvement += 1
+            # a checkpoint at every validation (writing it is cheap), so that an interrupted
+            # training can be resumed from here; only the best ones get a score
+            _save_checkpoint(score=val_loss if improved else None)
 
             if n_vals_without_improvement > ARGS.early_stopping > 0:
                 break
@@ -526,19 +809,24 @@ def train(
             start_epoch_time = time.time()
 
         if ARGS.super_val and itr % super_val_freq == 0:
-            log_metrics(ARGS, model=inn, data=datasets, step=itr)
-            save_model(ARGS, save_dir, model=inn, disc_ensemble=disc_ensemble, itr=itr, sha=sha)
+            _sync_running_stats(inn)
+            if is_main_process():
+                log_metrics(ARGS, model=inn, data=datasets, step=itr)
+            _save_checkpoint()
             # reset the "epoch" time, because we're nice people
             start_epoch_time = time.time()
 
-        for k, disc in enumerate(disc_ensemble):
-            if np.random.uniform() < ARGS.disc_reset_prob:
-                LOGGER.info("Reinitializing discriminator {}", k)
-                disc.reset_parameters()
-
     LOGGER.info("Training has finished.")
-    path = save_model(ARGS, save_dir, model=inn, disc_ensemble=disc_ensemble, itr=itr, sha=sha)
-    inn, disc_ensemble = restore_model(ARGS, path, inn=inn, disc_ensemble=disc_ensemble)
+    path = _save_checkpoint()
+    if checkpoints is None:  # the evaluation is only done by the main process
+        return inn
+    checkpoints.wait()
+    LOGGER.info(
+        "Wrote {} checkpoints, {:.3g}s per checkpoint",
+        len(checkpoints.write_seconds),
+        float(np.mean(checkpoints.write_seconds)),
+    )
+    inn = restore_model(ARGS, path, inn=inn)
     log_metrics(
         ARGS,
         model=inn,
@@ -548,6 +836,7 @@ def train(
         feat_attr=save_dir,
         all_attrs_celeba=save_dir,
     )
+    flush_wandb_log()
     return inn
 
 
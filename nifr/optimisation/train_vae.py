@@ -12,7 +12,7 @@ from torch.utils.data import DataLoader, TensorDataset
 import wandb
 from nifr import utils
 from nifr.configs import VaeArgs
-from nifr.data import DatasetTriplet, load_dataset
+from nifr.data import DatasetTriplet, DeviceLoader, load_dataset
 from nifr.models import VAE, VaeResults, build_discriminator
 from nifr.models.configs import conv_autoencoder, fc_autoencoder, linear_disciminator
 from nifr.utils import random_seed, wandb_log
@@ -310,6 +310,9 @@ def main_vae(raw_args=None) -> None:
         num_workers=ARGS.num_workers,
         pin_memory=True,
     )
+    if datasets.pretrain_batch_transform is not None:
+        batch_transform = datasets.pretrain_batch_transform.to(ARGS.device)
+        train_loader = DeviceLoader(train_loader, ARGS.device, batch_transform=batch_transform)
     val_loader = DataLoader(
         datasets.task_train,
         shuffle=True,
@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import torch
 import torchvision
@@ -7,7 +7,9 @@ from torch import nn
 
 import wandb
 from nifr.configs import InnArgs, SharedArgs
-from nifr.utils import wandb_log
+from nifr.utils import get_rng_state, wandb_log
+
+from .checkpointing import LazyCheckpoint
 
 __all__ = ["get_data_dim", "log_images"]
 
@@ -40,41 +42,68 @@ def log_images(
     )
 
 
-def save_model(
+def checkpoint_state(
     args: SharedArgs,
-    save_dir: Path,
     model: nn.Module,
-    disc_ensemble: nn.ModuleList,
+    disc_ensemble: nn.Module,
     itr: int,
     sha: str,
-    best: bool = False,
-) -> Path:
-    if best:
-        filename = save_dir / "checkpt_best.pth"
-    else:
-        filename = save_dir / f"checkpt_step{itr}.pth"
-    save_dict = {
+    rng_states: Optional[List[Dict[str, Any]]] = None,
+    **progress: Any,
+) -> Dict[str, Any]:
+    """Everything that goes into a checkpoint of the INN training
+
+    Besides the weights, this includes the states of the optimizers and the random number
+    generators, so that the training can be resumed exactly. `rng_states` are the states of all
+    processes in data-parallel training; by default, the state of this process is stored.
+    `progress` holds further state of the training loop, like the best validation loss.
+    """
+    return {
         "args": args.as_dict(),
         "sha": sha,
         "model": model.state_dict(),
         "disc_ensemble": disc_ensemble.state_dict(),
         "itr": itr,
+        "optimizers": {
+            "model": model.optimizer.state_dict(),
+            "disc_ensemble": disc_ensemble.optimizer.state_dict(),
+        },
+        "rng": get_rng_state() if rng_states is None else rng_states,
+        "progress": progress,
     }
 
-    torch.save(save_dict, filename)
 
-    return filename
+def restore_model(args: InnArgs, filename: Path, inn: nn.Module) -> nn.Module:
+    """Load the weights of the INN from a checkpoint; no other parts of the checkpoint are read"""
+    chkpt = LazyCheckpoint(filename)
+    _check_args(args, chkpt["args"])
+    inn.load_state_dict(chkpt["model"])
+    return inn
 
 
-def restore_model(args: InnArgs, filename: Path, inn: nn.Module, disc_ensemble: nn.ModuleList):
-    chkpt = torch.load(filename, map_location=lambda storage, loc: storage)
-    args_chkpt = chkpt["args"]
-    assert args.levels == args_chkpt["levels"]
-    assert args.level_depth == args_chkpt["level_depth"]
-    assert args.coupling_channels == args_chkpt["coupling_channels"]
-    assert args.coupling_depth == args_chkpt["coupling_depth"]
+def restore_training(
+    args: InnArgs, filename: Path, inn: nn.Module, disc_ensemble: nn.Module
+) -> Optional[Dict[str, Any]]:
+    """Restore the weights and the optimizers from a checkpoint to resume the training.
 
+    Returns:
+        the progress of the training, with the iteration and the state of the random number
+        generators, or None if the checkpoint only contains the weights
+    """
+    chkpt = LazyCheckpoint(filename)
+    _check_args(args, chkpt["args"])
     inn.load_state_dict(chkpt["model"])
     disc_ensemble.load_state_dict(chkpt["disc_ensemble"])
+    if "optimizers" not in chkpt:
+        return None
+    optimizers = chkpt["optimizers"]
+    inn.optimizer.load_state_dict(optimizers["model"])
+    disc_ensemble.optimizer.load_state_dict(optimizers["disc_ensemble"])
+    return dict(chkpt["progress"], itr=chkpt["itr"], rng=chkpt["rng"])
 
-    return inn, disc_ensemble
+
+def _check_args(args: InnArgs, args_chkpt: Dict[str, Any]) -> None:
+    assert args.levels == args_chkpt["levels"]
+    assert args.level_depth == args_chkpt["level_depth"]
+    assert args.coupling_channels == args_chkpt["coupling_channels"]
+    assert args.coupling_depth == args_chkpt["coupling_depth"]
@@ -1,3 +1,4 @@
+from .distributed import *
 from .distributions import *
 from .plotting import *
 from .torch_ops import *
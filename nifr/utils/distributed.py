@@ -0,0 +1,134 @@
+"""Helpers for data-parallel training with `torch.distributed`
+
+All functions also work without an initialized process group; they then act as if there was a
+single process.
+"""
+import io
+import itertools
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, TypeVar
+
+import torch
+import torch.distributed as dist
+from torch import Tensor, nn
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
+
+__all__ = [
+    "all_reduce_mean",
+    "all_reduce_sum",
+    "averaged_gradients",
+    "barrier",
+    "broadcast_module",
+    "broadcast_object",
+    "gather_object",
+    "get_rank",
+    "get_world_size",
+    "is_main_process",
+]
+
+T = TypeVar("T")
+
+
+def get_rank() -> int:
+    return dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+
+
+def get_world_size() -> int:
+    return dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+
+
+def is_main_process() -> bool:
+    """Whether this process is responsible for logging and checkpointing"""
+    return get_rank() == 0
+
+
+def barrier() -> None:
+    if get_world_size() > 1:
+        dist.barrier()
+
+
+def all_reduce_sum(tensors: Iterable[Tensor]) -> None:
+    """Sum the tensors over all processes (in-place), with one collective call per dtype"""
+    if get_world_size() == 1:
+        return
+    by_dtype: Dict[torch.dtype, List[Tensor]] = defaultdict(list)
+    for tensor in tensors:
+        by_dtype[tensor.dtype].append(tensor)
+    for group in by_dtype.values():
+        flat = _flatten_dense_tensors(group)
+        dist.all_reduce(flat)
+        for tensor, reduced in zip(group, _unflatten_dense_tensors(flat, group)):
+            tensor.copy_(reduced)
+
+
+def all_reduce_mean(tensors: Iterable[Tensor]) -> None:
+    """Average the tensors over all processes (in-place)"""
+    tensors = list(tensors)
+    all_reduce_sum(tensors)
+    world_size = get_world_size()
+    if world_size > 1 and tensors:
+        torch._foreach_div_(tensors, world_size)
+
+
+@contextmanager
+def averaged_gradients(module: nn.Module) -> Iterator[None]:
+    """Average the gradients of `module` over all processes as soon as they have been computed
+
+    This needs a collective call per parameter; for the main training loop, one `all_reduce_mean`
+    of all gradients after the backward pass is faster.
+    """
+    if get_world_size() == 1:
+        yield
+        return
+
+    def _average(param: Tensor) -> None:
+        all_reduce_mean([param.grad])
+
+    handles = [
+        param.register_post_accumulate_grad_hook(_average)
+        for param in module.parameters()
+        if param.requires_grad
+    ]
+    try:
+        yield
+    finally:
+        for handle in handles:
+            handle.remove()
+
+
+@torch.no_grad()
+def broadcast_module(module: nn.Module, src: int = 0) -> None:
+    """Copy the parameters and buffers of `module` from process `src` to all the others"""
+    if get_world_size() == 1:
+        return
+    by_dtype: Dict[torch.dtype, List[Tensor]] = defaultdict(list)
+    for tensor in itertools.chain(module.parameters(), module.buffers()):
+        by_dtype[tensor.dtype].append(tensor)
+    for group in by_dtype.values():
+        flat = _flatten_dense_tensors(group)
+        dist.broadcast(flat, src=src)
+        # `copy_` changes the version counters, which invalidates caches like `InverseCache`
+        for tensor, received in zip(group, _unflatten_dense_tensors(flat, group)):
+            tensor.copy_(received)
+
+
+def broadcast_object(obj: T, src: int = 0) -> T:
+    """The value of `obj` in process `src`; it has to be picklable"""
+    if get_world_size() == 1:
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=src)
+    return objects[0]
+
+
+def gather_object(obj: Any, dst: int = 0) -> List[Any]:
+    """The values of `obj` in all processes; only process `dst` gets them, the others get []"""
+    if get_world_size() == 1:
+        return [obj]
+    # tensors in plain pickles can't always be restored, so `obj` is serialized with torch.save
+    buffer = io.BytesIO()
+    torch.save(obj, buffer)
+    gathered: List[Any] = [None] * get_world_size() if get_rank() == dst else []
+    dist.gather_object(buffer.getvalue(), gathered if get_rank() == dst else None, dst=dst)
+    return [torch.load(io.BytesIO(data), weights_only=False) for data in gathered]
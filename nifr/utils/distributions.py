@@ -3,16 +3,66 @@ from typing import Sequence
 import numpy as np
 import torch
 import torch.distributions as td
+import torch.nn.functional as F
 from torch import Tensor
+from torch.distributions import constraints
 
-__all__ = ["DLogistic", "MixtureDistribution", "logistic_distribution", "uniform_bernoulli"]
+__all__ = [
+    "DLogistic",
+    "DLogisticMixture",
+    "Logistic",
+    "MixtureDistribution",
+    "logistic_distribution",
+    "uniform_bernoulli",
+]
 
 
-def logistic_distribution(loc: Tensor, scale: Tensor):
-    base_distribution = td.Uniform(loc.new_zeros(1), scale.new_zeros(1))
-    transforms = [td.SigmoidTransform().inv, td.AffineTransform(loc=loc, scale=scale)]
-    logistic = td.TransformedDistribution(base_distribution, transforms)
-    return logistic
+class Logistic(td.Distribution):
+    """Logistic distribution with a closed-form log-density
+
+    This is equivalent to transforming a uniform distribution with the inverse of the sigmoid and
+    an affine transformation, but avoids the intermediate tensors of `td.TransformedDistribution`.
+    """
+
+    arg_constraints = {"loc": constraints.real, "scale": constraints.positive}
+    support = constraints.real
+    has_rsample = True
+
+    def __init__(self, loc: Tensor, scale: Tensor):
+        self.loc, self.scale = td.utils.broadcast_all(loc, scale)
+        super().__init__(batch_shape=self.loc.size())
+
+    @property
+    def mean(self):
+        return self.loc
+
+    @property
+    def variance(self):
+        return (np.pi * self.scale) ** 2 / 3
+
+    def log_prob(self, value):
+        # log(sigmoid(z) * sigmoid(-z)) written such that it is stable for large |z|
+        abs_z = ((value - self.loc) / self.scale).abs()
+        return -abs_z - 2 * F.softplus(-abs_z) - self.scale.log()
+
+    def cdf(self, value):
+        return ((value - self.loc) / self.scale).sigmoid()
+
+    def icdf(self, value):
+        return self.loc + self.scale * (value.log() - (-value).log1p())
+
+    def rsample(self, sample_shape=torch.Size()):
+        shape = self._extended_shape(sample_shape)
+        finfo = torch.finfo(self.loc.dtype)
+        u = torch.rand(shape, dtype=self.loc.dtype, device=self.loc.device)
+        return self.icdf(u.clamp(min=finfo.tiny, max=1 - finfo.eps))
+
+    def entropy(self):
+        return self.scale.log() + 2
+
+
+def logistic_distribution(loc: Tensor, scale: Tensor) -> Logistic:
+    return Logistic(loc, scale)
 
 
 class DLogistic(td.Distribution):
@@ -30,9 +80,45 @@ class DLogistic(td.Distribution):
         return self.scale ** 2
 
     def log_prob(self, value):
-        upper = ((value + 0.5 - self.loc) / self.scale).sigmoid()
-        lower = ((value - 0.5 - self.loc) / self.scale).sigmoid()
-        return upper - lower
+        return _dlogistic_log_prob(value, self.loc, self.scale)
+
+
+def _dlogistic_log_prob(value: Tensor, loc, scale) -> Tensor:
+    """log(sigmoid(upper) - sigmoid(lower)) for the bin of width 1 around `value`
+
+    This uses sigmoid(u) - sigmoid(l) = sigmoid(l) * sigmoid(-u) * (exp(u - l) - 1), which stays
+    finite far out in the tails where the difference of the sigmoids underflows.
+    """
+    upper = (value + 0.5 - loc) / scale
+    lower = (value - 0.5 - loc) / scale
+    return F.logsigmoid(lower) + F.logsigmoid(-upper) + torch.log(torch.expm1(upper - lower))
+
+
+class DLogisticMixture(td.Distribution):
+    """Mixture of discretized logistic distributions with all parameters stacked into tensors
+
+    All components are evaluated with one broadcasted operation and combined with `logsumexp`.
+    """
+
+    arg_constraints = {
+        "probs": constraints.simplex,
+        "locs": constraints.real,
+        "scales": constraints.positive,
+    }
+
+    def __init__(self, probs: Tensor, locs: Tensor, scales: Tensor):
+        self.probs = probs
+        self.locs = locs
+        self.scales = scales
+        super().__init__()
+
+    @property
+    def mean(self):
+        return (self.probs * self.locs).sum(-1)
+
+    def log_prob(self, value):
+        component_log_probs = _dlogistic_log_prob(value.unsqueeze(-1), self.locs, self.scales)
+        return torch.logsumexp(component_log_probs + self.probs.log(), dim=-1)
 
 
 class MixtureDistribution(td.Distribution):
@@ -46,10 +132,14 @@ class MixtureDistribution(td.Distribution):
         self.components = components
 
     def log_prob(self, value):
-        log_prob = 0.0
-        for prob, dist in zip(self.probs, self.components):
-            log_prob += prob * dist.log_prob(value)
-        return log_prob
+        component_log_probs = torch.stack(
+            [
+                np.log(prob) + dist.log_prob(value)
+                for prob, dist in zip(self.probs, self.components)
+            ],
+            dim=-1,
+        )
+        return torch.logsumexp(component_log_probs, dim=-1)
 
 
 def uniform_bernoulli(shape, prob_1=0.5):
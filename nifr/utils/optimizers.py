@@ -1,96 +1,123 @@
 import math
 from collections import defaultdict
+from typing import Dict, List
 
 import torch
 from torch.optim.optimizer import Optimizer, required
 
 
 class RAdam(Optimizer):
+    """Rectified Adam
+
+    The update is computed with multi-tensor (`torch._foreach_*`) operations: all parameters of a
+    param group that are at the same step are updated together in a handful of kernels.
+    Parameters that are not float32 are updated in a float32 copy.
+    """
+
     def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8, weight_decay=0):
         defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay)
-        self.buffer = [[None, None, None] for ind in range(10)]
         super(RAdam, self).__init__(params, defaults)
 
     def __setstate__(self, state):
         super(RAdam, self).__setstate__(state)
 
+    @torch.no_grad()
     def step(self, closure=None):
 
         loss = None
         if closure is not None:
-            loss = closure()
+            with torch.enable_grad():
+                loss = closure()
 
         for group in self.param_groups:
+            # the step size depends on the step, so parameters are grouped by their step
+            buckets: Dict[int, List[List[torch.Tensor]]] = defaultdict(lambda: [[], [], [], []])
 
             for p in group["params"]:
                 if p.grad is None:
                     continue
-                grad = p.grad.data.float()
-                if grad.is_sparse:
+                if p.grad.is_sparse:
                     raise RuntimeError("RAdam does not support sparse gradients")
 
-                p_data_fp32 = p.data.float()
-
                 state = self.state[p]
 
                 if len(state) == 0:
                     state["step"] = 0
-                    state["exp_avg"] = torch.zeros_like(p_data_fp32)
-                    state["exp_avg_sq"] = torch.zeros_like(p_data_fp32)
-                else:
-                    state["exp_avg"] = state["exp_avg"].type_as(p_data_fp32)
-                    state["exp_avg_sq"] = state["exp_avg_sq"].type_as(p_data_fp32)
-
-                exp_avg, exp_avg_sq = state["exp_avg"], state["exp_avg_sq"]
-                beta1, beta2 = group["betas"]
-
-                exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
-                exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+                    state["exp_avg"] = torch.zeros_like(p, dtype=torch.float32)
+                    state["exp_avg_sq"] = torch.zeros_like(p, dtype=torch.float32)
+                elif state["exp_avg"].dtype != torch.float32:
+                    state["exp_avg"] = state["exp_avg"].float()
+                    state["exp_avg_sq"] = state["exp_avg_sq"].float()
 
                 state["step"] += 1
-                buffered = self.buffer[int(state["step"] % 10)]
-                if state["step"] == buffered[0]:
-                    N_sma, step_size = buffered[1], buffered[2]
-                else:
-                    buffered[0] = state["step"]
-                    beta2_t = beta2 ** state["step"]
-                    N_sma_max = 2 / (1 - beta2) - 1
-                    N_sma = N_sma_max - 2 * state["step"] * beta2_t / (1 - beta2_t)
-                    buffered[1] = N_sma
-
-                    # more conservative since it's an approximated value
-                    if N_sma >= 5:
-                        step_size = (
-                            group["lr"]
-                            * math.sqrt(
-                                (1 - beta2_t)
-                                * (N_sma - 4)
-                                / (N_sma_max - 4)
-                                * (N_sma - 2)
-                                / N_sma
-                                * N_sma_max
-                                / (N_sma_max - 2)
-                            )
-                            / (1 - beta1 ** state["step"])
-                        )
-                    else:
-                        step_size = group["lr"] / (1 - beta1 ** state["step"])
-                    buffered[2] = step_size
-
-                if group["weight_decay"] != 0:
-                    p_data_fp32.add_(p_data_fp32, alpha=-group["weight_decay"] * group["lr"])
-
-                # more conservative since it's an approximated value
-                if N_sma >= 5:
-                    denom = exp_avg_sq.sqrt().add_(group["eps"])
-                    p_data_fp32.addcdiv_(exp_avg, denom, value=-step_size)
-                else:
-                    p_data_fp32.add_(exp_avg, alpha=-step_size)
-
-                p.data.copy_(p_data_fp32)
+                params, grads, exp_avgs, exp_avg_sqs = buckets[state["step"]]
+                params.append(p)
+                grads.append(p.grad)
+                exp_avgs.append(state["exp_avg"])
+                exp_avg_sqs.append(state["exp_avg_sq"])
+
+            for step, (params, grads, exp_avgs, exp_avg_sqs) in buckets.items():
+                self._update(group, step, params, grads, exp_avgs, exp_avg_sqs)
 
         return loss
 
+    @staticmethod
+    def _update(
+        group: Dict,
+        step: int,
+        params: List[torch.Tensor],
+        grads: List[torch.Tensor],
+        exp_avgs: List[torch.Tensor],
+        exp_avg_sqs: List[torch.Tensor],
+    ) -> None:
+        beta1, beta2 = group["betas"]
+        # only parameters that are not float32 need a float32 copy
+        params_fp32 = [p if p.dtype == torch.float32 else p.float() for p in params]
+        grads = [g if g.dtype == torch.float32 else g.float() for g in grads]
+
+        torch._foreach_mul_(exp_avg_sqs, beta2)
+        torch._foreach_addcmul_(exp_avg_sqs, grads, grads, value=1 - beta2)
+        torch._foreach_mul_(exp_avgs, beta1)
+        torch._foreach_add_(exp_avgs, grads, alpha=1 - beta1)
+
+        beta2_t = beta2 ** step
+        N_sma_max = 2 / (1 - beta2) - 1
+        N_sma = N_sma_max - 2 * step * beta2_t / (1 - beta2_t)
+
+        # more conservative since it's an approximated value
+        if N_sma >= 5:
+            step_size = (
+                group["lr"]
+                * math.sqrt(
+                    (1 - beta2_t)
+                    * (N_sma - 4)
+                    / (N_sma_max - 4)
+                    * (N_sma - 2)
+                    / N_sma
+                    * N_sma_max
+                    / (N_sma_max - 2)
+                )
+                / (1 - beta1 ** step)
+            )
+        else:
+            step_size = group["lr"] / (1 - beta1 ** step)
+
+        if group["weight_decay"] != 0:
+            torch._foreach_add_(
+                params_fp32, params_fp32, alpha=-group["weight_decay"] * group["lr"]
+            )
+
+        if N_sma >= 5:
+            denom = torch._foreach_sqrt(exp_avg_sqs)
+            torch._foreach_add_(denom, group["eps"])
+            torch._foreach_addcdiv_(params_fp32, exp_avgs, denom, value=-step_size)
+        else:
+            torch._foreach_add_(params_fp32, exp_avgs, alpha=-step_size)
+
+        for p, p_fp32 in zip(params, params_fp32):
+            if p is not p_fp32:
+                p.copy_(p_fp32)
+
 
 class Lookahead(Optimizer):
     def __init__(self, optimizer, k=5, alpha=0.5):
@@ -103,15 +130,16 @@ class Lookahead(Optimizer):
         for group in self.param_groups:
             group["counter"] = 0
 
+    @torch.no_grad()
     def update(self, group):
         for fast in group["params"]:
             param_state = self.state[fast]
             if "slow_param" not in param_state:
-                param_state["slow_param"] = torch.zeros_like(fast.data)
-                param_state["slow_param"].copy_(fast.data)
+                param_state["slow_param"] = fast.detach().clone()
             slow = param_state["slow_param"]
-            slow += (fast.data - slow) * self.alpha
-            fast.data.copy_(slow)
+            slow += (fast - slow) * self.alpha
+            # not through `.data`, so that the version counter of the parameter changes
+            fast.copy_(slow)
 
     def update_lookahead(self):
         for group in self.param_groups:
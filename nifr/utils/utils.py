@@ -1,7 +1,10 @@
+import atexit
 import logging
 import os
+import queue
 import random
-from typing import Any, Dict, Sequence, TypeVar, Iterable, Iterator
+import threading
+from typing import Any, Dict, Iterable, Iterator, Optional, Sequence, Tuple, TypeVar, Union
 
 import numpy as np
 import torch
@@ -13,14 +16,18 @@ LOGGER = None
 
 __all__ = [
     "AverageMeter",
+    "MetricsAccumulator",
     "RunningAverageMeter",
     "count_parameters",
+    "flush_wandb_log",
     "get_logger",
+    "get_rng_state",
     "iter_forever",
     "product",
     "random_seed",
     "readable_duration",
     "save_checkpoint",
+    "set_rng_state",
     "wandb_log",
 ]
 
@@ -28,9 +35,62 @@ T = TypeVar("T")
 
 
 def wandb_log(args: SharedArgs, row: Dict[str, Any], step: int, commit: bool = True):
-    """Wrapper around wandb's log function"""
+    """Wrapper around wandb's log function
+
+    The row is handed to a background thread, so this never blocks. Values can be tensors; they are
+    converted to numbers in the background thread.
+    """
     if args.use_wandb:
-        wandb.log(row, commit=commit, step=step)
+        _get_wandb_sink().put(dict(row), step=step, commit=commit)
+
+
+def flush_wandb_log() -> None:
+    """Wait until everything that was passed to `wandb_log` has been sent to wandb."""
+    if _WANDB_SINK is not None:
+        _WANDB_SINK.flush()
+
+
+class _WandbSink:
+    """Buffer of rows that are passed on to wandb by a background thread"""
+
+    def __init__(self, max_buffered: int = 1000):
+        self._queue: "queue.Queue[Tuple[Dict[str, Any], int, bool]]" = queue.Queue(max_buffered)
+        self._thread = threading.Thread(target=self._run, name="wandb_log", daemon=True)
+        self._thread.start()
+        # the thread is a daemon, so the remaining rows have to be sent before the interpreter exits
+        atexit.register(self.flush)
+
+    def put(self, row: Dict[str, Any], step: int, commit: bool) -> None:
+        self._queue.put((row, step, commit))
+
+    def flush(self) -> None:
+        self._queue.join()
+
+    def _run(self) -> None:
+        while True:
+            row, step, commit = self._queue.get()
+            try:
+                row = {
+                    key: value.item()
+                    if isinstance(value, torch.Tensor) and value.numel() == 1
+                    else value
+                    for key, value in row.items()
+                }
+                wandb.log(row, commit=commit, step=step)
+            except Exception:  # pylint: disable=broad-except
+                logging.getLogger(__name__).exception("logging to wandb failed")
+            finally:
+                self._queue.task_done()
+
+
+_WANDB_SINK: Optional[_WandbSink] = None
+
+
+def _get_wandb_sink() -> _WandbSink:
+    global _WANDB_SINK
+    if _WANDB_SINK is None:
+        _WANDB_SINK = _WandbSink()
+    return _WANDB_SINK
 
 
 class BraceString(str):
@@ -103,6 +163,44 @@ class AverageMeter:
         self.avg = self.sum / self.count
 
 
+class MetricsAccumulator:
+    """Running averages of metrics that stay on the device until they are needed
+
+    Tensors are only summed up in `update()`; `compute()` copies all averages to the host at once.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._sums: Dict[str, Union[torch.Tensor, float]] = {}
+        self._counts: Dict[str, int] = {}
+
+    def update(self, metrics: Dict[str, Union[torch.Tensor, float]], n: int = 1):
+        for name, value in metrics.items():
+            if isinstance(value, torch.Tensor):
+                value = value.detach().float().view(())
+            if name in self._sums:
+                self._sums[name] += value * n
+            else:
+                self._sums[name] = value * n  # creates a new tensor, so in-place updates are safe
+                self._counts[name] = 0
+            self._counts[name] += n
+
+    def compute(self) -> Dict[str, float]:
+        tensor_names = [
+            name for name, value in self._sums.items() if isinstance(value, torch.Tensor)
+        ]
+        sums: Dict[str, float] = {
+            name: value for name, value in self._sums.items() if name not in tensor_names
+        }
+        if tensor_names:
+            # one synchronisation for all metrics
+            stacked = torch.stack([self._sums[name] for name in tensor_names]).tolist()
+            sums.update(zip(tensor_names, stacked))
+        return {name: sums[name] / self._counts[name] for name in self._sums}
+
+
 class RunningAverageMeter:
     """Computes and stores the average and current value"""
 
@@ -158,6 +256,27 @@ def random_seed(seed_value, use_cuda) -> None:
         torch.backends.cudnn.benchmark = False
 
 
+def get_rng_state() -> Dict[str, Any]:
+    """State of all random number generators; it only contains tensors and Python types"""
+    bit_generator, key, pos, has_gauss, cached_gaussian = np.random.get_state()
+    return {
+        "python": random.getstate(),
+        "numpy": (bit_generator, torch.from_numpy(key), pos, has_gauss, cached_gaussian),
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+    }
+
+
+def set_rng_state(state: Dict[str, Any]) -> None:
+    """Restore the random number generators from the output of `get_rng_state`"""
+    random.setstate(state["python"])
+    bit_generator, key, pos, has_gauss, cached_gaussian = state["numpy"]
+    np.random.set_state((bit_generator, key.numpy(), pos, has_gauss, cached_gaussian))
+    torch.set_rng_state(state["torch"])
+    if state["cuda"] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
 def product(seq: Sequence[T]) -> T:
     if not seq:
         raise ValueError("seq cannot be empty")
@@ -0,0 +1,33 @@
+"""Decode and resize the CelebA images once and pack them into a single uint8 array
+
+Usage:
+
+    python pack_celeba.py --root <data root> --image-size 64
+
+Afterwards, CelebA can be loaded from the packed array with `--celeba-packed True`.
+"""
+import tap
+
+from nifr.data.celeba import pack_celeba
+from nifr.data.data_loading import find_data_dir
+
+
+class PackArgs(tap.Tap):
+    """Commandline arguments for packing CelebA."""
+
+    root: str = ""  # root directory of the data; if empty, it is determined from the machine name
+    image_size: int = 64  # size that the images are resized and center-cropped to
+    num_workers: int = 4  # number of processes that decode images
+
+
+def main():
+    args = PackArgs(underscores_to_dashes=True, explicit_bool=True)
+    args.parse_args()
+    packed_dir = pack_celeba(
+        args.root or find_data_dir(), image_size=args.image_size, num_workers=args.num_workers
+    )
+    print(f"Packed images have been written to {packed_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-"""Test the invertible u-net"""
+"""Test the invertible u-net and the chain with factoring-out"""
 from copy import deepcopy
 from typing import Optional
 
@@ -6,7 +6,16 @@ import numpy as np
 import torch
 from torch import nn
 
-from nifr.layers import OxbowNet
+from nifr.layers import (
+    AffineCouplingLayer,
+    BijectorChain,
+    FactorOut,
+    Flatten,
+    Invertible1x1Conv,
+    OxbowNet,
+    SqueezeLayer,
+    set_reversible_backprop,
+)
 
 
 class Adder(nn.Module):
@@ -29,3 +38,54 @@ def test_unet():
     reconstruction, _ = u_net(output, reverse=True)
 
     np.testing.assert_allclose(input_.numpy(), reconstruction.numpy())
+
+
+def test_factor_out():
+    chain = [Adder(1, 1), Adder(1, 2), Adder(1, 4)]
+    factor_out = FactorOut(chain, splits={0: 0.4, 1: 0.5})
+    input_ = torch.randn(3, 5, 2, 2)
+    output, _ = factor_out(input_, reverse=False)
+    assert output.shape == (3, 20)
+    reconstruction, _ = factor_out(output, reverse=True)
+
+    np.testing.assert_allclose(input_.numpy(), reconstruction.numpy(), atol=1e-6)
+
+    # the shapes are part of the state dict
+    restored = FactorOut(deepcopy(chain), splits={0: 0.4, 1: 0.5})
+    restored.load_state_dict(factor_out.state_dict())
+    reconstruction, _ = restored(output, reverse=True)
+    np.testing.assert_allclose(input_.numpy(), reconstruction.numpy(), atol=1e-6)
+
+
+def test_flatten_old_state_dict():
+    flatten = Flatten()
+    flatten.load_state_dict({"orig_shape": torch.tensor([-1, 3, 4, 4])})
+    output, _ = flatten(torch.zeros(2, 48), reverse=True)
+    assert output.shape == (2, 3, 4, 4)
+
+
+def test_reversible_backprop():
+    torch.manual_seed(0)
+    levels = [
+        BijectorChain(
+            [
+                SqueezeLayer(2),
+                Invertible1x1Conv(channels, use_lr_decomp=True),
+                AffineCouplingLayer(channels, hidden_channels=8),
+            ]
+        )
+        for channels in (12, 24)
+    ]
+    model = BijectorChain([FactorOut(levels, splits={0: 0.5})]).double()
+    input_ = torch.rand(4, 3, 8, 8, dtype=torch.float64)
+
+    def _outputs_and_grads():
+        model.zero_grad()
+        output, sum_ldj = model(input_, sum_ldj=input_.new_zeros(4, 1))
+        (output.pow(2).sum() + sum_ldj.sum()).backward()
+        return [output.detach(), sum_ldj.detach()] + [p.grad.clone() for p in model.parameters()]
+
+    expected = _outputs_and_grads()
+    set_reversible_backprop(model)
+    for actual, reference in zip(_outputs_and_grads(), expected):
+        np.testing.assert_allclose(actual.numpy(), reference.numpy(), rtol=1e-8, atol=1e-10)
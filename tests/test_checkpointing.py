@@ -0,0 +1,75 @@
+"""Test writing and keeping checkpoints with the `CheckpointManager`"""
+import os
+from pathlib import Path
+from typing import Optional, Set
+
+import torch
+from torch import nn
+
+from nifr.optimisation.checkpointing import BEST_LINK, CheckpointManager, LazyCheckpoint
+
+
+def _saved_itrs(save_dir: Path) -> Set[int]:
+    return {
+        int(path.name[len("checkpt_step") :])
+        for path in save_dir.glob("checkpt_step*")
+        if not path.is_symlink()
+    }
+
+
+def test_retention(tmp_path: Path):
+    manager = CheckpointManager(tmp_path, keep_best=2, keep_last=1)
+
+    def _save(itr: int, score: Optional[float], value: float = 0.0) -> None:
+        manager.save({"weights": torch.tensor(value), "itr": itr}, itr=itr, score=score)
+        manager.wait()
+
+    _save(1, score=5.0)
+    _save(2, score=None)
+    assert _saved_itrs(tmp_path) == {1, 2}
+    _save(3, score=3.0)
+    _save(4, score=4.0)
+    # the two best ones; the most recent one is one of them
+    assert _saved_itrs(tmp_path) == {3, 4}
+    assert os.readlink(tmp_path / BEST_LINK) == "checkpt_step3"
+
+    _save(5, score=None)
+    assert _saved_itrs(tmp_path) == {3, 4, 5}
+    _save(6, score=1.0)
+    # a checkpoint for the same iteration without a score replaces the file but stays the best
+    _save(6, score=None, value=6.0)
+    assert _saved_itrs(tmp_path) == {3, 6}
+    _save(7, score=None)
+    assert _saved_itrs(tmp_path) == {3, 6, 7}
+    assert os.readlink(tmp_path / BEST_LINK) == "checkpt_step6"
+
+    best = LazyCheckpoint(tmp_path / BEST_LINK)
+    assert best["itr"] == 6
+    assert best["weights"].item() == 6.0
+    # no temporary directories are left behind
+    assert {path.name for path in tmp_path.iterdir()} == {
+        "checkpt_step3",
+        "checkpt_step6",
+        "checkpt_step7",
+        BEST_LINK,
+    }
+
+
+def test_keep_no_best(tmp_path: Path):
+    manager = CheckpointManager(tmp_path, keep_best=0, keep_last=2)
+    for itr, score in enumerate([1.0, None, 2.0, None]):
+        manager.save({"weights": torch.zeros(2)}, itr=itr, score=score)
+    manager.wait()
+    assert _saved_itrs(tmp_path) == {2, 3}
+    assert not (tmp_path / BEST_LINK).exists()
+
+
+def test_state_dict_metadata(tmp_path: Path):
+    manager = CheckpointManager(tmp_path)
+    model = nn.Sequential(nn.Linear(2, 3), nn.BatchNorm1d(3))
+    manager.save({"model": model.state_dict()}, itr=1)
+    manager.wait()
+    state_dict = LazyCheckpoint(tmp_path / "checkpt_step1")["model"]
+    # the version of batch norm is needed to load its state dict correctly
+    assert state_dict._metadata == model.state_dict()._metadata
+    model.load_state_dict(state_dict)
@@ -0,0 +1,136 @@
+"""Test the data loading helpers"""
+from types import SimpleNamespace
+from typing import List
+
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+from ethicml.vision.data import LdColorizer
+from torch.utils.data import DataLoader
+from torchvision import transforms
+from torchvision.datasets import FakeData
+
+from nifr.data import BatchLdColorizer, DeviceLoader, ResumableSampler, TabularBatchLoader
+from nifr.data.dataset_wrappers import LdAugmentedDataset, PerturbedDataTupleDataset
+
+NUM_SAMPLES = 50
+BATCH_SIZE = 8
+
+
+def _tabular_data() -> PerturbedDataTupleDataset:
+    """Dataset where `s` is the index of the sample"""
+    index = np.arange(NUM_SAMPLES)
+    data = SimpleNamespace(
+        x=pd.DataFrame({"a": index % 7, "b": index % 3}),
+        s=pd.DataFrame({"s": index}),
+        y=pd.DataFrame({"y": index % 2}),
+    )
+    return PerturbedDataTupleDataset(data, features=["a", "b"], num_bins=np.array([7, 3]))
+
+
+def _sampler_batches(num_replicas: int, rank: int, num_epochs: int = 2) -> List[List[int]]:
+    sampler = ResumableSampler(
+        range(NUM_SAMPLES), BATCH_SIZE, seed=3, num_replicas=num_replicas, rank=rank
+    )
+    batches = []
+    for _ in range(num_epochs):
+        order = list(sampler)
+        assert len(order) == len(sampler)
+        local_batch_size = BATCH_SIZE // num_replicas
+        batches += [order[i : i + local_batch_size] for i in range(0, len(order), local_batch_size)]
+    return batches
+
+
+def test_batch_colorizer_on_greyscale_loader():
+    source = FakeData(size=8, image_size=(1, 28, 28), num_classes=10)
+    # the same setup as the pretraining set with `--batch-colorize`
+    greyscale_data = LdAugmentedDataset(
+        source,
+        ld_augmentations=[],
+        num_classes=10,
+        li_augmentation=False,
+        base_augmentations=[transforms.ToTensor()],
+    )
+    colorizer = LdColorizer(scale=0.02, background=False, black=True, binarize=True)
+    batch_transform = BatchLdColorizer(
+        colorizer, num_classes=10, li_augmentation=True, quant_n_bits_x=5, noise_n_bits_x=5
+    )
+    loader = DeviceLoader(DataLoader(greyscale_data, batch_size=4), "cpu", batch_transform)
+
+    x, s, y = next(iter(loader))
+    assert x.shape == (4, 3, 28, 28)
+    assert s.shape == y.shape == (4,)
+    assert 0 <= x.min() and x.max() <= 1
+    assert torch.all((0 <= s) & (s < 10))
+
+
+@pytest.mark.parametrize("num_replicas", [2, 4])
+def test_sampler_shards(num_replicas: int):
+    full_batches = _sampler_batches(num_replicas=1, rank=0)
+    shards = [_sampler_batches(num_replicas, rank) for rank in range(num_replicas)]
+    num_batches = NUM_SAMPLES // BATCH_SIZE  # the last incomplete batch is dropped
+    assert all(len(batches) == 2 * num_batches for batches in shards)
+    for k, rank_batches in enumerate(zip(*shards)):
+        combined = [i for batch in rank_batches for i in batch]
+        # the shards are disjoint and together make up the batch without sharding
+        assert len(set(combined)) == BATCH_SIZE
+        epoch, batch = divmod(k, num_batches)
+        assert set(combined) == set(full_batches[epoch * (num_batches + 1) + batch])
+
+
+@pytest.mark.parametrize("num_replicas", [1, 2])
+def test_sampler_resume(num_replicas: int):
+    batches = _sampler_batches(num_replicas, rank=num_replicas - 1, num_epochs=3)
+    for num_done in [0, 3, 6, 8]:
+        sampler = ResumableSampler(
+            range(NUM_SAMPLES), BATCH_SIZE, seed=3, num_replicas=num_replicas, rank=num_replicas - 1
+        )
+        sampler.set_position(num_done)
+        loader = DataLoader(
+            range(NUM_SAMPLES), batch_size=BATCH_SIZE // num_replicas, sampler=sampler
+        )
+        resumed = [batch.tolist() for batch in loader] + [batch.tolist() for batch in loader]
+        assert resumed == batches[num_done : num_done + len(resumed)]
+
+
+@pytest.mark.parametrize("num_replicas", [2, 4])
+def test_tabular_loader_shards(num_replicas: int):
+    data = _tabular_data()
+    full_loader = TabularBatchLoader(data, BATCH_SIZE, shuffle=True, seed=3)
+    full_batches = [s.long().tolist() for _, s, _ in full_loader]
+    shards = []
+    for rank in range(num_replicas):
+        loader = TabularBatchLoader(
+            data, BATCH_SIZE, shuffle=True, seed=3, num_replicas=num_replicas, rank=rank
+        )
+        shards.append(list(loader))
+    assert len(full_batches) == NUM_SAMPLES // BATCH_SIZE + 1
+    assert all(len(batches) == NUM_SAMPLES // BATCH_SIZE for batches in shards)
+    for k, rank_batches in enumerate(zip(*shards)):
+        combined = [i for _, s, _ in rank_batches for i in s.long().tolist()]
+        assert len(set(combined)) == BATCH_SIZE
+        assert set(combined) == set(full_batches[k])
+    # every process adds its own dequantization noise
+    assert not torch.equal(shards[0][0][0] % 1, shards[1][0][0] % 1)
+
+
+@pytest.mark.parametrize("num_replicas", [1, 2])
+def test_tabular_loader_resume(num_replicas: int):
+    data = _tabular_data()
+
+    def _loader():
+        return TabularBatchLoader(
+            data, BATCH_SIZE, shuffle=True, seed=3, num_replicas=num_replicas, rank=num_replicas - 1
+        )
+
+    loader = _loader()
+    batches = [batch for _ in range(3) for batch in loader]
+    for num_done in [0, 3, 6, 8]:
+        loader = _loader()
+        loader.set_position(num_done)
+        resumed = list(loader) + list(loader)
+        for batch, expected in zip(resumed, batches[num_done:]):
+            # the noise of the samples is the same as without the interruption
+            for tensor, expected_tensor in zip(batch, expected):
+                assert torch.equal(tensor, expected_tensor)
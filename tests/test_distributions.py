@@ -0,0 +1,64 @@
+"""Test the mixture distributions"""
+import numpy as np
+import torch
+import torch.distributions as td
+
+from nifr.utils import DLogistic, DLogisticMixture, Logistic, MixtureDistribution
+
+PROBS = [0.1, 0.2, 0.3, 0.4]
+LOCS = [0.0, 2.0, -2.0, 4.0]
+SCALES = [0.5, 0.5, 1.0, 2.0]
+
+
+def _reference_log_prob(value: torch.Tensor) -> torch.Tensor:
+    value = value.double()
+    prob = torch.zeros_like(value)
+    for weight, loc, scale in zip(PROBS, LOCS, SCALES):
+        upper = ((value + 0.5 - loc) / scale).sigmoid()
+        lower = ((value - 0.5 - loc) / scale).sigmoid()
+        prob += weight * (upper - lower)
+    return prob.log()
+
+
+def test_mixtures_match_reference():
+    value = torch.arange(-10, 11, dtype=torch.float32).view(3, 7)
+    expected = _reference_log_prob(value).numpy()
+
+    stacked = DLogisticMixture(
+        probs=torch.tensor(PROBS), locs=torch.tensor(LOCS), scales=torch.tensor(SCALES)
+    )
+    looped = MixtureDistribution(
+        probs=PROBS, components=[DLogistic(loc, scale) for loc, scale in zip(LOCS, SCALES)]
+    )
+    np.testing.assert_allclose(stacked.log_prob(value).numpy(), expected, rtol=1e-5)
+    np.testing.assert_allclose(looped.log_prob(value).numpy(), expected, rtol=1e-5)
+
+
+def test_dlogistic_mixture_tails_are_finite():
+    stacked = DLogisticMixture(
+        probs=torch.tensor(PROBS), locs=torch.tensor(LOCS), scales=torch.tensor(SCALES)
+    )
+    value = torch.tensor([-1000.0, 1000.0], requires_grad=True)
+    log_prob = stacked.log_prob(value)
+    log_prob.sum().backward()
+    assert torch.isfinite(log_prob).all()
+    assert torch.isfinite(value.grad).all()
+
+
+def test_logistic_matches_transformed_uniform():
+    loc, scale = torch.tensor([0.5]), torch.tensor([2.0])
+    reference = td.TransformedDistribution(
+        td.Uniform(torch.zeros(1), torch.ones(1)),
+        [td.SigmoidTransform().inv, td.AffineTransform(loc=loc, scale=scale)],
+    )
+    logistic = Logistic(loc, scale)
+    value = torch.linspace(-20, 20, 41)
+    np.testing.assert_allclose(
+        logistic.log_prob(value).numpy(), reference.log_prob(value).numpy(), rtol=1e-5, atol=1e-6
+    )
+    assert torch.isfinite(logistic.log_prob(torch.tensor([-1e4, 1e4]))).all()
+
+    torch.manual_seed(0)
+    samples = logistic.rsample((100_000,))
+    assert abs(samples.mean().item() - 0.5) < 0.05
+    assert abs(samples.var().item() / logistic.variance.item() - 1) < 0.05
@@ -0,0 +1,93 @@
+"""Test the stacked discriminator ensemble"""
+import copy
+
+import pytest
+import torch
+from torch import nn
+
+from nifr.models import Classifier, DiscriminatorEnsemble
+
+NUM_MEMBERS = 3
+
+
+def _members():
+    torch.manual_seed(0)
+    return [
+        Classifier(
+            nn.Sequential(nn.Linear(4, 8), nn.BatchNorm1d(8), nn.ReLU(), nn.Linear(8, 1)),
+            num_classes=2,
+        )
+        for _ in range(NUM_MEMBERS)
+    ]
+
+
+def _unstacked(ensemble: DiscriminatorEnsemble):
+    """Separate copies of the members of the ensemble"""
+    members = []
+    for k in range(NUM_MEMBERS):
+        member = copy.deepcopy(ensemble._template.model)
+        member.load_state_dict({name: t[k] for name, t in ensemble.stacked.state_dict().items()})
+        members.append(member)
+    return members
+
+
+@pytest.mark.parametrize("spectral_norm", [False, True])
+def test_ensemble_matches_members(spectral_norm: bool):
+    ensemble = DiscriminatorEnsemble(_members(), spectral_norm=spectral_norm)
+    members = _unstacked(ensemble)
+    x = torch.randn(6, 4)
+
+    outputs = ensemble(x)
+    assert outputs.shape == (NUM_MEMBERS, 6, 1)
+    outputs.sum().backward()
+    for k, member in enumerate(members):
+        member_out = member(x)
+        torch.testing.assert_close(outputs[k], member_out)
+        member_out.sum().backward()
+        member_grads = {name: param.grad for name, param in member.named_parameters()}
+        for name, param in ensemble.stacked.named_parameters():
+            torch.testing.assert_close(param.grad[k], member_grads[name])
+        # batch norm statistics and singular vectors are updated for every member
+        for name, buffer in ensemble.stacked.named_buffers():
+            torch.testing.assert_close(buffer[k], member.get_buffer(name))
+
+
+def test_reset_member():
+    ensemble = DiscriminatorEnsemble(_members(), spectral_norm=True)
+    ensemble(torch.randn(6, 4))
+    before = copy.deepcopy(ensemble.stacked.state_dict())
+    ensemble.reset_member(1)
+    after = ensemble.stacked.state_dict()
+
+    weight = "0.parametrizations.weight.original"
+    assert not torch.equal(after[weight][1], before[weight][1])
+    assert torch.all(after["1.running_mean"][1] == 0)
+    for name in before:
+        torch.testing.assert_close(after[name][[0, 2]], before[name][[0, 2]])
+
+
+def test_load_member_state_dicts():
+    members = _members()
+    x = torch.randn(6, 4)
+    ensemble = DiscriminatorEnsemble(_members()[::-1])
+    ensemble.load_state_dict(nn.ModuleList(members).state_dict())
+    ensemble.eval()
+    for k, member in enumerate(members):
+        torch.testing.assert_close(ensemble(x)[k], member.eval()(x))
+
+
+def test_load_hook_spectral_norm_state_dicts():
+    members = _members()
+    for member in members:  # like the discriminators were created before the ensemble existed
+        member.apply(lambda m: nn.utils.spectral_norm(m) if hasattr(m, "weight") else None)
+    x = torch.randn(6, 4)
+    # 1-dim weights are normalized exactly by the parametrization, so let the power iteration of
+    # the hooks converge first
+    for _ in range(20):
+        for member in members:
+            member(x)
+    ensemble = DiscriminatorEnsemble(_members(), spectral_norm=True)
+    ensemble.load_state_dict(nn.ModuleList(members).state_dict())
+    ensemble.eval()
+    for k, member in enumerate(members):
+        torch.testing.assert_close(ensemble(x)[k], member.eval()(x))
@@ -0,0 +1,74 @@
+"""Test the feature attribution of the evaluation"""
+import pytest
+import torch
+from captum.attr import IntegratedGradients, NoiseTunnel
+from torch import nn
+
+from nifr.configs import InnArgs
+from nifr.optimisation.evaluation import _encoding_cache_key, smoothgrad_sq_integrated_gradients
+
+NUM_IMAGES = 3
+NUM_SAMPLES = 4
+STDEVS = 0.3
+NUM_STEPS = 8
+
+
+def test_smoothgrad_sq_integrated_gradients(monkeypatch: pytest.MonkeyPatch):
+    torch.manual_seed(0)
+    model = nn.Sequential(nn.Flatten(), nn.Linear(16, 8), nn.Tanh(), nn.Linear(8, 3))
+    inputs = torch.randn(NUM_IMAGES, 1, 4, 4)
+    targets = torch.tensor([0, 2, 1])
+    noise = torch.randn(NUM_SAMPLES, NUM_IMAGES, 1, 4, 4)
+
+    # both implementations get the same noise; they just order the samples differently
+    with monkeypatch.context() as patch:
+        # all noise samples of all images in one chunk, ordered by noise sample
+        patch.setattr(torch, "randn_like", lambda x: noise.flatten(end_dim=1))
+        (attribution,) = smoothgrad_sq_integrated_gradients(
+            [model], [inputs], targets, NUM_SAMPLES, STDEVS, NUM_STEPS, batch_size=1000
+        )
+    with monkeypatch.context() as patch:
+        # ordered by image
+        patch.setattr(torch, "normal", lambda mean, std: std * noise.transpose(0, 1).flatten(0, 1))
+        expected = NoiseTunnel(IntegratedGradients(model)).attribute(
+            inputs,
+            nt_type="smoothgrad_sq",
+            nt_samples=NUM_SAMPLES,
+            stdevs=STDEVS,
+            target=targets,
+            n_steps=NUM_STEPS,
+            method="riemann_middle",
+        )
+
+    assert attribution.shape == inputs.shape
+    torch.testing.assert_close(attribution, expected)
+
+
+class _FakeInn(nn.Linear):
+    def __init__(self, args: InnArgs):
+        super().__init__(10, 10)
+        self.zs_dim = round(args.zs_frac * 10)
+        self.zy_dim = 10 - self.zs_dim
+
+
+def _cache_key(*cli_args: str) -> str:
+    args = InnArgs(explicit_bool=True, underscores_to_dashes=True)
+    args.parse_args(list(cli_args))
+    torch.manual_seed(0)
+    return _encoding_cache_key(args, _FakeInn(args), subdir="task")
+
+
+@pytest.mark.parametrize(
+    "cli_args",
+    [
+        ["--zs-frac", "0.2"],
+        ["--cmnist-cache", "True"],
+        ["--precision", "bf16"],
+        ["--scaling", "exp"],
+        ["--data-split-seed", "1"],
+    ],
+)
+def test_encoding_cache_key(cli_args):
+    # the weights are the same, but the settings change the encodings
+    assert _cache_key(*cli_args) != _cache_key()
+    assert _cache_key(*cli_args) == _cache_key(*cli_args)
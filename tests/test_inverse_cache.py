@@ -0,0 +1,63 @@
+"""Test that the cached inverse weights follow the parameters"""
+import copy
+
+import pytest
+import torch
+from torch import nn
+
+from nifr.layers import Invertible1x1Conv, InvertibleLinear
+from nifr.utils.optimizers import Lookahead, RAdam
+
+
+class _DataSGD(torch.optim.Optimizer):
+    """SGD that writes the parameters through `.data`, like many optimizers do"""
+
+    def __init__(self, params, lr: float):
+        super().__init__(params, dict(lr=lr))
+
+    def step(self, closure=None):
+        for group in self.param_groups:
+            for param in group["params"]:
+                param.data.add_(param.grad, alpha=-group["lr"])
+
+
+@pytest.mark.parametrize(
+    "make_optimizer",
+    [
+        lambda params: RAdam(params, lr=0.01),
+        lambda params: Lookahead(RAdam(params, lr=0.01), k=1),
+        lambda params: _DataSGD(params, lr=0.01),
+    ],
+)
+@pytest.mark.parametrize(
+    "make_layer",
+    [
+        lambda: InvertibleLinear(4),
+        lambda: Invertible1x1Conv(4, use_lr_decomp=True),
+        lambda: Invertible1x1Conv(4, use_lr_decomp=False),
+    ],
+)
+def test_inverse_after_optimizer_step(make_layer, make_optimizer):
+    torch.manual_seed(0)
+    layer: nn.Module = make_layer()
+    optimizer = make_optimizer(list(layer.parameters()))
+    x = torch.randn(3, 4) if isinstance(layer, InvertibleLinear) else torch.randn(3, 4, 2, 2)
+    loss_weights = torch.randn_like(x)
+
+    for _ in range(3):
+        with torch.no_grad():
+            y, _ = layer(x)
+            # fills the cache
+            layer(y, reverse=True)
+
+        layer.zero_grad()
+        y, _ = layer(x)
+        (y * loss_weights).sum().backward()
+        optimizer.step()
+
+        with torch.no_grad():
+            y, _ = layer(x)
+            x_recon, _ = layer(y, reverse=True)
+            # a copy has new storage, so its inverse is computed from scratch
+            expected, _ = copy.deepcopy(layer)(y, reverse=True)
+        torch.testing.assert_close(x_recon, expected)
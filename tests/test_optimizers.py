@@ -0,0 +1,82 @@
+"""Test the multi-tensor RAdam against a per-parameter implementation"""
+import math
+
+import numpy as np
+import torch
+from torch import nn
+
+from nifr.utils.optimizers import RAdam
+
+
+def _reference_radam_step(params, state, lr, betas, eps, weight_decay):
+    """The update of RAdam, computed one parameter at a time"""
+    beta1, beta2 = betas
+    for p in params:
+        if p.grad is None:
+            continue
+        grad = p.grad.data.float()
+        p_data_fp32 = p.data.float()
+        if p not in state:
+            state[p] = {
+                "step": 0,
+                "exp_avg": torch.zeros_like(p_data_fp32),
+                "exp_avg_sq": torch.zeros_like(p_data_fp32),
+            }
+        exp_avg, exp_avg_sq = state[p]["exp_avg"], state[p]["exp_avg_sq"]
+        exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+        exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+        state[p]["step"] += 1
+        step = state[p]["step"]
+
+        beta2_t = beta2 ** step
+        N_sma_max = 2 / (1 - beta2) - 1
+        N_sma = N_sma_max - 2 * step * beta2_t / (1 - beta2_t)
+        if N_sma >= 5:
+            step_size = (
+                lr
+                * math.sqrt(
+                    (1 - beta2_t)
+                    * (N_sma - 4)
+                    / (N_sma_max - 4)
+                    * (N_sma - 2)
+                    / N_sma
+                    * N_sma_max
+                    / (N_sma_max - 2)
+                )
+                / (1 - beta1 ** step)
+            )
+        else:
+            step_size = lr / (1 - beta1 ** step)
+
+        if weight_decay != 0:
+            p_data_fp32.add_(p_data_fp32, alpha=-weight_decay * lr)
+        if N_sma >= 5:
+            denom = exp_avg_sq.sqrt().add_(eps)
+            p_data_fp32.addcdiv_(exp_avg, denom, value=-step_size)
+        else:
+            p_data_fp32.add_(exp_avg, alpha=-step_size)
+        p.data.copy_(p_data_fp32)
+
+
+def test_radam_matches_reference():
+    torch.manual_seed(0)
+    model = nn.Sequential(nn.Linear(10, 20), nn.SELU(), nn.Linear(20, 3))
+    # one parameter in double precision goes through the float32 copy
+    model.add_module("extra", nn.Linear(3, 3).double())
+    reference = [p.detach().clone().requires_grad_(True) for p in model.parameters()]
+    hparams = dict(lr=1e-2, betas=(0.9, 0.999), eps=1e-8, weight_decay=1e-4)
+    optimizer = RAdam(model.parameters(), **hparams)
+    reference_state = {}
+
+    for itr in range(20):
+        grads = [torch.randn_like(p) for p in reference]
+        for p, p_ref, grad in zip(model.parameters(), reference, grads):
+            # leave out one parameter every few steps so that the steps differ between parameters
+            skip = itr % 3 == 0 and p_ref is reference[0]
+            p.grad = None if skip else grad.clone()
+            p_ref.grad = None if skip else grad.clone()
+        optimizer.step()
+        _reference_radam_step(reference, reference_state, **hparams)
+
+    for p, p_ref in zip(model.parameters(), reference):
+        np.testing.assert_allclose(p.detach().numpy(), p_ref.detach().numpy(), rtol=1e-6, atol=1e-7)
@@ -0,0 +1,75 @@
+"""Test that an interrupted training can be resumed exactly"""
+import random
+from pathlib import Path
+from typing import Iterable, List, Tuple, Union
+
+import numpy as np
+import pytest
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from nifr.data import DeviceLoader, ResumableSampler
+from nifr.optimisation.train_inn import _set_loader_position
+from nifr.utils import get_rng_state, iter_forever, random_seed, set_rng_state
+
+NUM_SAMPLES = 30
+BATCH_SIZE = 4
+NUM_STEPS = 20  # more than two epochs
+
+
+class _NoisyDataset(Dataset):
+    """Random noise with the index of the sample as `s` and `y`, like a data augmentation"""
+
+    def __len__(self) -> int:
+        return NUM_SAMPLES
+
+    def __getitem__(self, index: int) -> Tuple[torch.Tensor, int, int]:
+        return torch.rand(()), index, index
+
+
+def _add_noise(x: torch.Tensor, s: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    return x + torch.rand_like(x), s
+
+
+def _loader(num_workers: int, batch_transform: bool) -> Union[DataLoader, DeviceLoader]:
+    data = _NoisyDataset()
+    sampler = ResumableSampler(data, BATCH_SIZE, seed=5)
+    # like in the training, the seeds of the workers come from the sampler, so that starting an
+    # epoch doesn't consume random numbers of the global generator
+    loader = DataLoader(
+        data,
+        batch_size=BATCH_SIZE,
+        sampler=sampler,
+        num_workers=num_workers,
+        generator=sampler.worker_generator,
+    )
+    return DeviceLoader(loader, "cpu", _add_noise) if batch_transform else loader
+
+
+def _train(loader: Iterable, num_steps: int) -> List[Tuple[List[float], float, float, float]]:
+    """The batches and the random numbers that a training would draw in every step"""
+    steps = []
+    # `range` comes first, so that no batch is fetched after the last step
+    for _, (x, s, _) in zip(range(num_steps), iter_forever(loader)):
+        batch = s.tolist() + x.tolist()
+        steps.append((batch, torch.rand(1).item(), np.random.rand(), random.random()))
+    return steps
+
+
+@pytest.mark.parametrize("batch_transform", [False, True])
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_resume(tmp_path: Path, num_workers: int, batch_transform: bool):
+    random_seed(0, use_cuda=False)
+    uninterrupted = _train(_loader(num_workers, batch_transform), NUM_STEPS)
+
+    for num_done in [5, 7, 16]:
+        random_seed(0, use_cuda=False)
+        before = _train(_loader(num_workers, batch_transform), num_done)
+        # the state is stored like in a checkpoint
+        torch.save(get_rng_state(), tmp_path / "rng.pt")
+
+        random_seed(1, use_cuda=False)
+        loader = _set_loader_position(_loader(num_workers, batch_transform), num_done)
+        set_rng_state(torch.load(tmp_path / "rng.pt", weights_only=True))
+        after = _train(loader, NUM_STEPS - num_done)
+        assert before + after == uninterrupted